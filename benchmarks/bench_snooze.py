@@ -0,0 +1,233 @@
+"""Offline throughput and latency benchmarks for github-snooze-button.
+
+Replays a synthetic stream of webhook events, built from the fixtures in
+snooze/test/github_responses.py, against a local fake Github API and an
+in-process SNS/SQS stand-in, and reports events per second, p50/p99 latency
+and Github calls per event for github_callback, RepositoryListener.poll and
+lambda_handler.
+
+Usage: python benchmarks/bench_snooze.py [--events N] [--latency S] ...
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "snooze", "test"))
+sys.path.insert(0, HERE)
+
+import github_responses  # noqa: E402
+import snooze.callbacks  # noqa: E402
+from snooze.github import GithubClient, RateLimiter  # noqa: E402
+from snooze.repository_listener import QueueListener  # noqa: E402
+from fakes import FakeGithub, FakeQueue, FakeTopic  # noqa: E402
+
+REPOSITORY = "baxterthehacker/public-repo"
+SNOOZE_LABEL = "snooze"
+ORGANIZATION = "fellowship"
+MEMBERS = ["frodo", "samwise"]
+AUTHORS = MEMBERS + ["baxterthehacker", "gollum", "smeagol"]
+
+
+def synthetic_events(count, github, snoozed_fraction=0.2, events_per_issue=5, seed=0):
+    """Builds a reproducible stream of webhook events.
+
+    Issues start snoozed with probability snoozed_fraction; the fake Github
+    is primed with that label state.
+
+    Returns: list<(str event_type, str payload)>
+    """
+    rng = random.Random(seed)
+    issues = max(1, count // events_per_issue)
+    snoozed = {number for number in range(1, issues + 1) if rng.random() < snoozed_fraction}
+    for number in snoozed:
+        github.labels[github.issue_key(REPOSITORY, number)] = {SNOOZE_LABEL, "bug"}
+
+    fixtures = [
+        ("issue_comment", 4),
+        ("pull_request", 2),
+        ("pull_request_review_comment", 4),
+    ]
+    kinds = [kind for kind, weight in fixtures for _ in range(weight)]
+    events = []
+    for _ in range(count):
+        kind = rng.choice(kinds)
+        number = rng.randint(1, issues)
+        issue_url = "{}/repos/{}/issues/{}".format(github.url, REPOSITORY, number)
+        html_url = "https://github.com/{}/issues/{}".format(REPOSITORY, number)
+        if kind == "issue_comment":
+            fixture = (github_responses.SNOOZED_ISSUE_COMMENT if number in snoozed
+                       else github_responses.UNSNOOZED_ISSUE_COMMENT)
+            payload = json.loads(fixture)
+            payload["issue"].update(url=issue_url, html_url=html_url, number=number)
+        elif kind == "pull_request":
+            payload = json.loads(github_responses.PULL_REQUEST)
+        else:
+            payload = json.loads(github_responses.PULL_REQUEST_REVIEW_COMMENT)
+        if "pull_request" in payload:
+            payload["pull_request"].update(issue_url=issue_url, html_url=html_url)
+        if "comment" in payload:
+            payload["comment"]["user"]["login"] = rng.choice(AUTHORS)
+        events.append((kind, json.dumps(payload)))
+    return events
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(name, events, elapsed, latencies, github, calls_before):
+    calls = github.total_calls - calls_before
+    return {
+        "scenario": name,
+        "events": events,
+        "events_per_sec": events / elapsed if elapsed else float("inf"),
+        "p50_ms": 1000 * percentile(latencies, 0.50),
+        "p99_ms": 1000 * percentile(latencies, 0.99),
+        "github_calls_per_event": calls / events if events else 0,
+    }
+
+
+def reset_state(github):
+    github.reset()
+    snooze.callbacks.membership_cache.clear()
+    snooze.callbacks.stats.clear()
+    snooze.callbacks.cleared_issues.clear()
+    snooze.callbacks.label_state.clear()
+
+
+def make_client(github):
+    return GithubClient("bench", "token", api_url=github.url, rate_limiter=RateLimiter())
+
+
+def bench_github_callback(github, args):
+    reset_state(github)
+    events = synthetic_events(args.events, github, seed=args.seed)
+    client = make_client(github)
+    latencies = []
+    calls_before = github.total_calls
+    start = time.time()
+    for event_type, payload in events:
+        t = time.time()
+        try:
+            snooze.callbacks.github_callback(
+                event_type, json.loads(payload), client, SNOOZE_LABEL, ORGANIZATION)
+        except Exception:
+            pass
+        latencies.append(time.time() - t)
+    elapsed = time.time() - start
+    return summarize("github_callback", len(events), elapsed, latencies, github, calls_before)
+
+
+def bench_listener_poll(github, args):
+    reset_state(github)
+    events = synthetic_events(args.events, github, seed=args.seed)
+    client = make_client(github)
+    queue = FakeQueue()
+    topic = FakeTopic(queue)
+    callbacks = [lambda event_type, message: snooze.callbacks.github_callback(
+        event_type, message, client, SNOOZE_LABEL, ORGANIZATION)]
+    listener = QueueListener(
+        queue, lambda event_type, message: callbacks, workers=args.workers)
+    calls_before = github.total_calls
+    start = time.time()
+    for event_type, payload in events:
+        topic.publish(event_type, payload)
+    while len(queue.latencies) < len(events):
+        listener.poll(wait=False, drain=True)
+    elapsed = time.time() - start
+    listener.executor.shutdown()
+    return summarize("RepositoryListener.poll", len(events), elapsed,
+                     queue.latencies, github, calls_before)
+
+
+def load_lambda_handler():
+    """Imports snooze.lambda_handler with a generated lambda_config."""
+    lambda_config = types.ModuleType("snooze.lambda_config")
+    lambda_config.github_auth = ("bench", "token")
+    lambda_config.snooze_label = SNOOZE_LABEL
+    lambda_config.ignore_members_of = ORGANIZATION
+    sys.modules["snooze.lambda_config"] = lambda_config
+    import snooze.lambda_handler
+    # the handler configures DEBUG logging for CloudWatch
+    logging.getLogger().setLevel(logging.WARNING)
+    return snooze.lambda_handler
+
+
+def bench_lambda_handler(github, args):
+    reset_state(github)
+    events = synthetic_events(args.events, github, seed=args.seed)
+    handler = load_lambda_handler()
+    handler.github = make_client(github)
+    topic = FakeTopic()
+    invocations = [topic.lambda_event(event_type, payload) for event_type, payload in events]
+    latencies = []
+    calls_before = github.total_calls
+    start = time.time()
+    for invocation in invocations:
+        t = time.time()
+        try:
+            handler.lambda_handler(invocation, None)
+        except Exception:
+            pass
+        latencies.append(time.time() - t)
+    elapsed = time.time() - start
+    return summarize("lambda_handler", len(events), elapsed, latencies, github, calls_before)
+
+
+SCENARIOS = {
+    "callback": bench_github_callback,
+    "poll": bench_listener_poll,
+    "lambda": bench_lambda_handler,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=1000,
+                        help="events per scenario (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0.005,
+                        help="fake Github latency in seconds (default: %(default)s)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of Github requests which fail with a 502")
+    parser.add_argument("--workers", type=int, default=snooze.constants.CALLBACK_WORKERS,
+                        help="listener callback workers (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run; may be repeated (default: all)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    github = FakeGithub(latency=args.latency, error_rate=args.error_rate,
+                        members=MEMBERS, seed=args.seed).start()
+    try:
+        results = [SCENARIOS[name](github, args)
+                   for name in args.scenario or ["callback", "poll", "lambda"]]
+    finally:
+        github.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return True
+    print("{:<26}{:>8}{:>12}{:>10}{:>10}{:>14}".format(
+        "scenario", "events", "events/s", "p50 ms", "p99 ms", "calls/event"))
+    for r in results:
+        print("{scenario:<26}{events:>8}{events_per_sec:>12.1f}{p50_ms:>10.2f}"
+              "{p99_ms:>10.2f}{github_calls_per_event:>14.2f}".format(**r))
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(not main())
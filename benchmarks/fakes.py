@@ -0,0 +1,234 @@
+"""In-process stand-ins for the Github API and AWS SNS/SQS.
+
+FakeGithub is a real HTTP server on localhost, so benchmarks exercise the
+same connection pooling, retries and rate limiting as production. FakeQueue
+and FakeTopic implement the parts of the boto3 SQS and SNS interfaces that
+snooze uses, without any network round trips.
+"""
+from __future__ import absolute_import, division
+
+import collections
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+
+
+LABEL_RE = re.compile(r"^/repos/([^/]+/[^/]+)/issues/(\d+)/labels/([^/?]+)$")
+ISSUE_RE = re.compile(r"^/repos/([^/]+/[^/]+)/issues/(\d+)$")
+MEMBER_RE = re.compile(r"^/orgs/([^/]+)/members/([^/?]+)$")
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately; don't let Nagle delay the body
+    disable_nagle_algorithm = True
+
+    def _respond(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        status, payload = self.server.fake.handle(self.command, self.path, body)
+        data = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeGithub(object):
+    """A local fake of the Github API endpoints snooze calls.
+
+    It keeps the labels of each issue, so removing a label that is already
+    gone returns 404 like Github does.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, members=(), seed=0):
+        """Instantiates a FakeGithub.
+
+        Args:
+            latency (float): seconds to wait before answering each request
+            error_rate (float): fraction of requests answered with a 502
+            members (iterable<str>): logins which are members of every
+                organization
+            seed (int): seed for the error generator
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.members = set(members)
+        self.labels = {}
+        self.calls = collections.Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self.url = None
+
+    def start(self):
+        self._server = _ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.fake = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = "http://127.0.0.1:{}".format(self._server.server_address[1])
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.labels.clear()
+            self.calls.clear()
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def issue_key(self, repository_name, number):
+        return "{}#{}".format(repository_name, number)
+
+    def handle(self, method, path, body):
+        with self._lock:
+            self.calls[method] += 1
+            failed = self._random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            return 502, {"message": "Server Error"}
+
+        match = LABEL_RE.match(path)
+        if match and method == "DELETE":
+            key = self.issue_key(match.group(1), match.group(2))
+            label = unquote(match.group(3))
+            with self._lock:
+                labels = self.labels.get(key, set())
+                if label not in labels:
+                    return 404, {"message": "Label does not exist"}
+                labels.discard(label)
+                return 200, [{"name": name} for name in sorted(labels)]
+
+        match = ISSUE_RE.match(path)
+        if match:
+            key = self.issue_key(match.group(1), match.group(2))
+            with self._lock:
+                if method == "PATCH":
+                    self.labels[key] = set(json.loads(body.decode("utf-8"))["labels"])
+                labels = sorted(self.labels.get(key, set()))
+            return 200, {"url": path, "html_url": path,
+                         "labels": [{"name": name} for name in labels]}
+
+        match = MEMBER_RE.match(path)
+        if match and method == "GET":
+            return (204 if match.group(2) in self.members else 404), None
+
+        return 404, {"message": "Not Found"}
+
+
+class FakeMessage(object):
+    def __init__(self, body, sent_at):
+        self.body = body
+        self.sent_at = sent_at
+        self.receive_count = 0
+        self.receipt_handle = None
+
+    @property
+    def attributes(self):
+        return {"ApproximateReceiveCount": str(self.receive_count)}
+
+
+class FakeQueue(object):
+    """An in-memory SQS queue.
+
+    Deferred messages (change_message_visibility_batch) are requeued at once
+    rather than after their visibility timeout. The time from send to delete
+    of every message is recorded in latencies.
+    """
+
+    url = "fake://snooze__benchmark"
+
+    def __init__(self):
+        self.latencies = []
+        self.receives = 0
+        self.redeliveries = 0
+        self._messages = collections.deque()
+        self._in_flight = {}
+        self._handles = itertools.count()
+        self._lock = threading.Lock()
+
+    def send_message(self, MessageBody):
+        with self._lock:
+            self._messages.append(FakeMessage(MessageBody, time.time()))
+
+    def receive_messages(self, MaxNumberOfMessages=1, WaitTimeSeconds=0, **_):
+        with self._lock:
+            self.receives += 1
+            batch = []
+            while self._messages and len(batch) < MaxNumberOfMessages:
+                message = self._messages.popleft()
+                message.receive_count += 1
+                message.receipt_handle = str(next(self._handles))
+                self._in_flight[message.receipt_handle] = message
+                batch.append(message)
+            return batch
+
+    def delete_messages(self, Entries):
+        now = time.time()
+        with self._lock:
+            for entry in Entries:
+                message = self._in_flight.pop(entry["ReceiptHandle"])
+                self.latencies.append(now - message.sent_at)
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+    def change_message_visibility_batch(self, Entries):
+        with self._lock:
+            for entry in Entries:
+                self._messages.append(self._in_flight.pop(entry["ReceiptHandle"]))
+                self.redeliveries += 1
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+
+class FakeTopic(object):
+    """An in-memory SNS topic which wraps Github events the way the Github
+    Amazon SNS service does."""
+
+    def __init__(self, queue=None):
+        self.queue = queue
+
+    def notification(self, event_type, payload):
+        return {
+            "Type": "Notification",
+            "MessageId": str(uuid.uuid4()),
+            "Message": payload,
+            "MessageAttributes": {
+                "X-Github-Event": {"Type": "String", "Value": event_type},
+            },
+        }
+
+    def publish(self, event_type, payload):
+        self.queue.send_message(MessageBody=json.dumps(self.notification(event_type, payload)))
+
+    def lambda_event(self, event_type, payload):
+        return {"Records": [{"EventSource": "aws:sns",
+                             "Sns": self.notification(event_type, payload)}]}
@@ -1,5 +1,34 @@
 # flake8:noqa
-from .snooze import *
-from .repository_listener import *
-from .config import *
+import importlib
+import sys
+
 from .version import __version__
+
+# The package re-exports the public names of these modules. On Python 3.7+
+# they are imported on first use, so that importing a single submodule (as
+# the Lambda handler does) doesn't also import boto3 and the listener.
+_EXPORTING_MODULES = ("config", "repository_listener", "snooze")
+
+if sys.version_info < (3, 7):
+    from .snooze import *
+    from .repository_listener import *
+    from .config import *
+else:
+    def __getattr__(name):
+        if not name.startswith("_"):
+            for module_name in _EXPORTING_MODULES:
+                module = importlib.import_module("." + module_name, __name__)
+                if name in vars(module):
+                    globals()[name] = value = getattr(module, name)
+                    return value
+        if name in globals():
+            # a submodule imported as a side effect of the search above
+            return globals()[name]
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    def __dir__():
+        names = set(globals())
+        for module_name in _EXPORTING_MODULES:
+            module = importlib.import_module("." + module_name, __name__)
+            names.update(name for name in vars(module) if not name.startswith("_"))
+        return sorted(names)
@@ -0,0 +1,102 @@
+"""Polls many repositories' queues from a single asyncio event loop.
+
+boto3 and requests are blocking libraries, so each poll (the SQS receive and
+the Github calls made by the callbacks) runs on a thread pool whose size is
+the concurrency limit. However many repositories are configured, the loop
+only ever uses that many threads. This module requires Python 3.5 or later,
+but is written without coroutine syntax so the package still byte-compiles
+on Python 2.7.
+"""
+from __future__ import absolute_import
+
+import asyncio
+import concurrent.futures
+import functools
+import logging
+
+from snooze.constants import ASYNC_IDLE_BACKOFF, ASYNC_MAX_IDLE_BACKOFF
+
+
+def idle_delay(previous, idle_backoff=ASYNC_IDLE_BACKOFF,
+               max_idle_backoff=ASYNC_MAX_IDLE_BACKOFF):
+    """Returns how long to wait after an empty short poll.
+
+    Args:
+        previous (float): the delay after the previous poll, 0 if it
+            received messages
+        idle_backoff (float): the delay after the first empty poll
+        max_idle_backoff (float): the longest delay
+
+    Returns: seconds (float)
+    """
+    return min(max(previous * 2, idle_backoff), max_idle_backoff)
+
+
+def schedule_poll(loop, listener, wait, poll_interval, failed, backoff=(0, ASYNC_IDLE_BACKOFF)):
+    """Polls a listener on the executor and reschedules it when done.
+
+    Args:
+        loop (asyncio.AbstractEventLoop): the running event loop
+        listener (RepositoryListener): listener to poll
+        wait (bool): whether to long-poll the queue
+        poll_interval (float): seconds to sleep between polls
+        failed (asyncio.Future): resolved with the exception of the first
+            poll to fail
+        backoff ((float, float)): the delay after the previous poll if it
+            was an empty short poll, otherwise 0; and the delay after the
+            first empty short poll (see idle_delay)
+    """
+    def on_done(future):
+        if failed.done():
+            return
+        if future.exception() is not None:
+            failed.set_result(future.exception())
+            return
+        idle = 0
+        if not wait and not future.result():
+            idle = idle_delay(backoff[0], backoff[1])
+        delay = max(poll_interval, idle)
+        logging.debug("Waiting {}s before polling {}".
+                      format(delay, listener.repository_name))
+        loop.call_later(delay, schedule_poll,
+                        loop, listener, wait, poll_interval, failed, (idle, backoff[1]))
+
+    # a short-polled queue gives up its slot after each batch, so that busy
+    # queues can't keep the others from being polled
+    future = loop.run_in_executor(
+        None, functools.partial(listener.poll, wait=wait, drain=wait))
+    future.add_done_callback(on_done)
+
+
+def run_pollers(pollers, concurrency, idle_backoff=ASYNC_IDLE_BACKOFF):
+    """Polls repositories until one of the pollers fails.
+
+    When there are more repositories than concurrency slots, queues are
+    short-polled so that an idle queue never holds a slot for the duration of
+    a 20-second long poll, one batch per turn so that slots rotate between
+    queues. A queue whose short polls come back empty is
+    polled less and less often (see idle_delay), until it receives messages
+    again.
+
+    Args:
+        pollers (list<(RepositoryListener, float)>): listeners and the time in
+            seconds to sleep between their polls
+        concurrency (int): maximum number of polls in flight at once
+        idle_backoff (float): delay after the first empty short poll
+
+    Returns: False
+    """
+    loop = asyncio.new_event_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    loop.set_default_executor(executor)
+    wait = concurrency >= len(pollers)
+    failed = loop.create_future()
+    for listener, poll_interval in pollers:
+        schedule_poll(loop, listener, wait, poll_interval, failed, (0, idle_backoff))
+    try:
+        exception = loop.run_until_complete(failed)
+        logging.error("Polling task quit: {!r}".format(exception))
+    finally:
+        executor.shutdown(wait=False)
+        loop.close()
+    return False
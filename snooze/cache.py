@@ -0,0 +1,141 @@
+from __future__ import absolute_import
+
+import collections
+import logging
+import threading
+import time
+
+import snooze.constants as constants
+from snooze.github import get_client
+
+
+class TTLCache(object):
+    """A thread-safe, size-bounded LRU cache whose entries expire.
+
+    Each entry carries its own expiry time, so different kinds of results can
+    be cached for different lengths of time. When the cache is full, the least
+    recently used entry is evicted.
+    """
+
+    def __init__(self, maxsize, ttl, clock=time.time):
+        """Instantiates a TTLCache.
+
+        Args:
+            maxsize (int): maximum number of entries to hold
+            ttl (float): default lifetime of an entry, in seconds
+            clock (function()): returns the current time in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the cached value for key, or default if it is missing or
+        expired."""
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires <= self._clock():
+                self.misses += 1
+                return default
+            # reinsert to mark as most recently used
+            self._data[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Caches value for key for ttl seconds (default: the cache's ttl)."""
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (self._clock() + ttl, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MembershipCache(object):
+    """Caches answers to "is this user a member of this organization?".
+
+    Positive and negative answers expire separately, so that a new member
+    stops being able to unsnooze issues soon after joining while established
+    members rarely cost a Github API call.
+    """
+
+    def __init__(self, maxsize=constants.MEMBERSHIP_CACHE_SIZE,
+                 ttl=constants.MEMBERSHIP_TTL,
+                 negative_ttl=constants.MEMBERSHIP_NEGATIVE_TTL):
+        """Instantiates a MembershipCache.
+
+        Args:
+            maxsize (int): maximum number of (organization, user) pairs to hold
+            ttl (float): lifetime of a positive result, in seconds
+            negative_ttl (float): lifetime of a negative result, in seconds
+        """
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(maxsize, ttl)
+
+    @property
+    def hits(self):
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        return self._cache.misses
+
+    def lookup(self, organization, user):
+        """Returns True or False if membership is cached, otherwise None."""
+        return self._cache.get((organization.lower(), user.lower()))
+
+    def store(self, organization, user, is_member):
+        ttl = None if is_member else self.negative_ttl
+        self._cache.set((organization.lower(), user.lower()), is_member, ttl)
+
+    def prewarm(self, github_auth, organization):
+        """Caches every member of an organization with one paginated listing.
+
+        Only members visible to the credentials are listed; anyone else is
+        looked up individually as usual.
+
+        Args:
+            github_auth (GithubClient | tuple): Github client or credentials
+            organization (str): name of a Github organization
+
+        Returns: number of members cached (int)
+        """
+        github = get_client(github_auth)
+        url = "{}/orgs/{}/members?per_page=100".format(github.api_url, organization)
+        count = 0
+        while url:
+            r = github.get(url)
+            r.raise_for_status()
+            for member in r.json():
+                self.store(organization, member["login"], True)
+                count += 1
+            url = r.links.get("next", {}).get("url")
+        logging.debug("Prewarmed membership cache with {} members of {}".
+                      format(count, organization))
+        return count
+
+    def clear(self):
+        self._cache.clear()
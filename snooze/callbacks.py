@@ -1,80 +1,292 @@
 from __future__ import absolute_import
 
+import calendar
+import collections
 import logging
+import time
 
 import requests
 
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
 import snooze.constants as constants
+import snooze.metrics as metrics
+from snooze.cache import MembershipCache, TTLCache
+from snooze.github import get_client
+
+# shared by every repository, since most comments come from a few people
+membership_cache = MembershipCache()
+
+# (issue url, snooze label) -> when the label was cleared, for issues whose
+# label was cleared recently, so that the rest of a burst of events for the
+# issue can be coalesced
+cleared_issues = TTLCache(constants.COALESCE_CACHE_SIZE, constants.COALESCE_WINDOW)
+
+# (issue url, snooze label) -> whether the issue carries the label, so that
+# events whose payloads don't include labels can skip unsnoozed issues
+label_state = TTLCache(constants.LABEL_STATE_CACHE_SIZE, constants.LABEL_STATE_TTL)
+
+# counts of Github API calls avoided
+stats = collections.Counter()
+
+metrics.registry.function(
+    "snooze_membership_cache_hits_total", "Organization membership cache hits",
+    "counter", lambda: membership_cache.hits)
+metrics.registry.function(
+    "snooze_membership_cache_misses_total", "Organization membership cache misses",
+    "counter", lambda: membership_cache.misses)
+metrics.registry.function(
+    "snooze_pr_issue_fetches_avoided_total", "Pull request issue fetches avoided",
+    "counter", lambda: stats["pr_issue_fetches_avoided"])
+metrics.registry.function(
+    "snooze_label_checks_avoided_total", "Label removals skipped because of known label state",
+    "counter", lambda: stats["label_checks_avoided"])
+
 
+def record_label_state(issue, snooze_label, cache=label_state):
+    """Remembers whether an issue carries the snooze label, if the issue
+    (from a webhook payload) includes its labels.
 
-def clear_snooze_label_if_set(github_auth, issue, snooze_label):
-    issue_labels = {label["name"] for label in issue.get("labels", [])}
-    if snooze_label not in issue_labels:
+    Returns: whether the issue is snoozed (bool), or None if it has no labels
+    """
+    if "labels" not in issue:
+        return None
+    snoozed = snooze_label in {label["name"] for label in issue["labels"]}
+    if cache is not None:
+        cache.set((issue["url"], snooze_label), snoozed)
+    return snoozed
+
+
+def clear_snooze_label_if_set(github_auth, issue, snooze_label, cache=label_state):
+    """Removes the snooze label from an issue.
+
+    If the issue carries no "labels", the label state cache is consulted;
+    failing that, the label is removed blindly and Github's 404 for a
+    missing label is treated as "not set".
+    """
+    key = (issue["url"], snooze_label)
+    snoozed = record_label_state(issue, snooze_label, cache)
+    if snoozed is None and cache is not None and cache.get(key) is False:
+        stats["label_checks_avoided"] += 1
+        snoozed = False
+    if snoozed is False:
         logging.debug(
             "clear_snooze_label_if_set: Label {} not set on {}".
             format(snooze_label, issue["html_url"]))
         return False
-    issue_labels.remove(snooze_label)
-    auth = requests.auth.HTTPBasicAuth(*github_auth)
-    r = requests.patch(issue["url"], auth=auth,
-                       json={"labels": list(issue_labels)},
-                       headers=constants.GITHUB_HEADERS)
+    url = "{}/labels/{}".format(issue["url"], quote(snooze_label, safe=""))
+    r = get_client(github_auth).delete(url)
+    if r.status_code == 404:
+        logging.debug(
+            "clear_snooze_label_if_set: Label {} already removed from {}".
+            format(snooze_label, issue["html_url"]))
+        if cache is not None:
+            cache.set(key, False)
+        return False
     r.raise_for_status()
+    if cache is not None:
+        cache.set(key, False)
     logging.debug(
         "clear_snooze_label_if_set: Removed snooze label from {}".
         format(issue["html_url"]))
     return True
 
 
-def fetch_pr_issue(github_auth, pull_request):
-    auth = requests.auth.HTTPBasicAuth(*github_auth)
-    r = requests.get(pull_request["issue_url"], auth=auth,
-                     headers=constants.GITHUB_HEADERS)
-    r.raise_for_status()
-    return r.json()
+def pr_issue(pull_request):
+    """Returns the issue behind a pull request without fetching it.
+
+    The labels are included only if the payload carries them, which is when
+    a fetch of the issue's labels is avoided.
+    """
+    if "labels" in pull_request:
+        stats["pr_issue_fetches_avoided"] += 1
+    issue = {"url": pull_request["issue_url"],
+             "html_url": pull_request["html_url"]}
+    for key in ("labels", "updated_at"):
+        if key in pull_request:
+            issue[key] = pull_request[key]
+    return issue
 
 
-def is_member_of(github_auth, user, organization):
-    auth = requests.auth.HTTPBasicAuth(*github_auth)
-    url = "https://api.github.com/orgs/{}/members/{}".format(organization, user)
-    r = requests.get(url, auth=auth, headers=constants.GITHUB_HEADERS)
+def is_member_of(github_auth, user, organization, cache=membership_cache):
+    if cache is not None:
+        cached = cache.lookup(organization, user)
+        if cached is not None:
+            return cached
+    github = get_client(github_auth)
+    url = "{}/orgs/{}/members/{}".format(github.api_url, organization, user)
+    r = github.get(url)
     if r.status_code == 204:
-        return True
+        is_member = True
     elif r.status_code == 404:
-        return False
+        is_member = False
     else:
         raise requests.exceptions.HTTPError(
             "Unexpected HTTP status %d" % r.status_code,
             response=r)
+    if cache is not None:
+        cache.store(organization, user, is_member)
+    return is_member
+
+
+# the actions of each event github_callback acts on; None means every action
+EVENT_ACTIONS = {
+    "issue_comment": None,
+    "issues": frozenset(["labeled", "unlabeled"]),
+    "pull_request": frozenset(["synchronize", "labeled", "unlabeled"]),
+    "pull_request_review_comment": None,
+}
+
+
+def wants_event(event, action=None):
+    """Returns whether github_callback acts on an event, so that listeners
+    can drop other events without decoding their payloads.
+
+    Args:
+        event (str): Github webhook event type
+        action (str): the payload's action, or None if it is unknown
+    """
+    if event not in EVENT_ACTIONS:
+        return False
+    actions = EVENT_ACTIONS[event]
+    return actions is None or action is None or action in actions
+
+
+def issue_url(message):
+    """Returns the API URL of the issue a webhook payload concerns, or None."""
+    if "issue" in message:
+        return message["issue"].get("url")
+    if "pull_request" in message:
+        return message["pull_request"].get("issue_url")
+    return None
+
 
+def repository_name(message):
+    """Returns the full name of the repository a webhook payload concerns."""
+    return ((message or {}).get("repository") or {}).get("full_name", "")
 
-def github_callback(event, message, github_auth, snooze_label, ignore_members_of):
+
+def note_label_change(issue_url, item, snooze_label):
+    """Records the labels of an issue or pull request from an event which
+    changed it. If it is snoozed, events for it are no longer coalesced."""
+    issue = {"url": issue_url}
+    if "labels" in item:
+        issue["labels"] = item["labels"]
+    if record_label_state(issue, snooze_label):
+        cleared_issues.discard((issue_url, snooze_label))
+
+
+def is_ignored_author(message, github_auth, ignore_members_of):
+    """Returns whether a comment's author belongs to ignore_members_of."""
+    author = message["comment"]["user"]["login"]
+    if ignore_members_of and is_member_of(github_auth, author, ignore_members_of):
+        metrics.ignored_members.inc(repository=repository_name(message))
+        return True
+    return False
+
+
+def resnoozed_since(issue, snooze_label, cleared_at):
+    """Returns whether a payload shows the snooze label put back on an issue
+    after it was cleared, as when the labeled event went to another process.
+
+    An issue is taken to be re-snoozed if its payload lists the label and
+    was updated no earlier than the second the label was cleared, or has no
+    updated_at.
+
+    Args:
+        issue (dict): issue or pull request from a webhook payload
+        snooze_label (str): name of the snooze label
+        cleared_at (float): when the label was cleared, in seconds since
+            the epoch
+    """
+    if snooze_label not in {label["name"] for label in issue.get("labels", ())}:
+        return False
+    try:
+        updated_at = calendar.timegm(time.strptime(issue["updated_at"], "%Y-%m-%dT%H:%M:%SZ"))
+    except (KeyError, TypeError, ValueError):
+        return True
+    return updated_at >= int(cleared_at)
+
+
+def clear_snooze_label_coalesced(github_auth, issue, snooze_label, coalesce_window,
+                                 repository):
+    """Removes the snooze label from an issue unless it was removed in the
+    last coalesce_window seconds and hasn't been put back since."""
+    key = (issue["url"], snooze_label)
+    cleared_at = cleared_issues.get(key) if coalesce_window else None
+    if cleared_at is not None and not resnoozed_since(issue, snooze_label, cleared_at):
+        logging.debug("Coalescing event for {}".format(issue["html_url"]))
+        stats["coalesced_events"] += 1
+        metrics.coalesced_events.inc(repository=repository)
+        return False
+    removed = clear_snooze_label_if_set(github_auth, issue, snooze_label)
+    if removed:
+        metrics.label_removals.inc(repository=repository)
+        if coalesce_window:
+            cleared_issues.set(key, time.time(), ttl=coalesce_window)
+    return removed
+
+
+def github_callback(event, message, github_auth, snooze_label, ignore_members_of,
+                    coalesce_window=constants.COALESCE_WINDOW):
+    """Removes the snooze label from the issue a webhook event concerns.
+
+    Once the label has been removed, further events for the issue within
+    coalesce_window seconds are skipped without asking Github, since a burst
+    of events (such as a busy review) would otherwise each try to remove it.
+    Events whose payloads show the label put back since are not skipped.
+
+    issues events, and pull_request events other than synchronize, only
+    update the label state cache; labeling an issue with the snooze label
+    ends coalescing for it.
+
+    Args:
+        event (str): Github webhook event type
+        message (Object): decoded webhook payload
+        github_auth (GithubClient | tuple): Github client or credentials
+        snooze_label (str): name of the snooze label
+        ignore_members_of (str): organization whose members' comments are
+            ignored, or None
+        coalesce_window (float): seconds to coalesce events after a removal;
+            0 disables coalescing
+
+    Returns: whether the label was removed (bool)
+    """
+    repository = repository_name(message)
+    metrics.events.inc(repository=repository, event=event)
     if event == "issue_comment":
         issue = message["issue"]
         logging.debug("Incoming issue: {}".format(issue["html_url"]))
-        author = message["comment"]["user"]["login"]
-        if ignore_members_of and is_member_of(github_auth, author, ignore_members_of):
+        if is_ignored_author(message, github_auth, ignore_members_of):
             return False
-        return clear_snooze_label_if_set(github_auth, issue, snooze_label)
 
     elif event == "pull_request_review_comment":
         pull_request = message["pull_request"]
         logging.debug("Incoming PR comment hook: {}".format(pull_request["html_url"]))
-        author = message["comment"]["user"]["login"]
-        issue = fetch_pr_issue(github_auth, pull_request)
-        if ignore_members_of and is_member_of(github_auth, author, ignore_members_of):
+        if is_ignored_author(message, github_auth, ignore_members_of):
             return False
-        return clear_snooze_label_if_set(github_auth, issue, snooze_label)
+        issue = pr_issue(pull_request)
+
+    elif event == "issues":
+        # labeled, unlabeled and other changes to the issue itself
+        note_label_change(message["issue"]["url"], message["issue"], snooze_label)
+        return False
 
     elif event == "pull_request":
         pull_request = message["pull_request"]
         if message["action"] != "synchronize":
+            note_label_change(pull_request["issue_url"], pull_request, snooze_label)
             return False
         logging.debug("Incoming PR hook: {} {}".
                       format(message["action"], pull_request["html_url"]))
-        issue = fetch_pr_issue(github_auth, pull_request)
-        return clear_snooze_label_if_set(github_auth, issue, snooze_label)
+        issue = pr_issue(pull_request)
 
     else:
         logging.warning("Ignoring event type {}".format(event))
-    return False
+        return False
+
+    return clear_snooze_label_coalesced(
+        github_auth, issue, snooze_label, coalesce_window, repository)
@@ -3,13 +3,17 @@ try:
 except ImportError:
     import ConfigParser as configparser
 
+from snooze.constants import CALLBACK_WORKERS, COALESCE_WINDOW, LISTEN_EVENTS, MAX_RECEIVE_COUNT
 
-def parse_config(filename):
+
+def parse_config(filename, aws=True):
     """Parses github-snooze-button configuration files.
 
     Args:
         filename: The name of a file in ConfigParser .ini format, described
             below.
+        aws (bool): whether aws_key and aws_secret are required; they aren't
+            used by snooze_webhook, which receives events without AWS.
 
     Returns:
         A dictionary of dictionaries, one inner dictionary per repository.
@@ -38,29 +42,70 @@ def parse_config(filename):
     to us-west-2. Defining poll_interval (the time in seconds between 20-second
     long polls) is optional; it defaults to 0. ignore_members_of is optional; it
     will ignore comments from members of the specified organization.
+    prewarm_membership is optional; if true, the members of ignore_members_of
+    are listed once at startup to fill the membership cache. It defaults to
+    false. shared_queue is optional; repositories with the same shared_queue
+    deliver their events to one SQS queue named snooze__<shared_queue>, which
+    snooze_listen polls once for all of them. callback_workers is optional; it
+    sets how many events snooze_listen handles at once for the repository (or
+    shared queue), and defaults to 4. max_receive_count is optional; it sets
+    how many times a failing event is retried before it is moved to the
+    snooze__<repository>__dead queue, and defaults to 10. dedup_store is
+    optional; it names a SQLite database file in which snooze_listen remembers
+    the events it has processed, so that redelivered events are skipped even
+    after a restart. Without it, recent events are remembered in memory.
+    coalesce_window is optional; once the snooze label is removed from an
+    issue, further events for the issue are skipped for this many seconds. It
+    defaults to 30; 0 handles every event. listen_events is optional; it is a
+    comma-separated list of the Github webhook events to subscribe the
+    repository to, and defaults to issue_comment, pull_request and
+    pull_request_review_comment. Add issues to track which issues are
+    snoozed from labeled and unlabeled events. Other events are filtered out
+    by SNS. webhook_secret is optional; it is
+    the secret of the repository's webhook, which snooze_webhook uses to
+    verify that events come from Github. snooze_webhook requires it.
     """
     config = {}
     defaults = {"aws_region": "us-west-2",
                 "poll_interval": 0,
-                "ignore_members_of": None}
+                "ignore_members_of": None,
+                "prewarm_membership": False,
+                "shared_queue": None,
+                "callback_workers": CALLBACK_WORKERS,
+                "max_receive_count": MAX_RECEIVE_COUNT,
+                "dedup_store": None,
+                "coalesce_window": COALESCE_WINDOW,
+                "listen_events": LISTEN_EVENTS,
+                "webhook_secret": None}
+    if not aws:
+        defaults.update(aws_key=None, aws_secret=None)
     string_options = (["github_username", "github_token",
                        "aws_key", "aws_secret", "aws_region",
-                       "poll_interval", "snooze_label", "ignore_members_of"])
+                       "poll_interval", "snooze_label", "ignore_members_of",
+                       "shared_queue", "callback_workers", "max_receive_count",
+                       "dedup_store", "coalesce_window", "webhook_secret"])
+    boolean_options = ["prewarm_membership"]
+    list_options = ["listen_events"]
     parser = configparser.SafeConfigParser()
     parser.read(filename)
+    getters = dict.fromkeys(string_options, parser.get)
+    getters.update(dict.fromkeys(boolean_options, parser.getboolean))
+    getters.update(dict.fromkeys(
+        list_options,
+        lambda section, option: parser.get(section, option).replace(",", " ").split()))
     sections = parser.sections()
     if "default" in sections:
         for option in parser.options("default"):
-            if option not in string_options:
+            if option not in getters:
                 continue
-            defaults[option] = parser.get("default", option)
+            defaults[option] = getters[option]("default", option)
     for section in sections:
         if section == "default":
             continue
         this_section = {"repository_name": section}
-        for option in string_options:
+        for option, getter in getters.items():
             if option in parser.options(section):
-                this_section[option] = parser.get(section, option)
+                this_section[option] = getter(section, option)
             elif option in defaults:
                 this_section[option] = defaults[option]
             else:
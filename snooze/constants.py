@@ -1,5 +1,95 @@
+GITHUB_API_URL = "https://api.github.com"
 GITHUB_HEADERS = {"Accept": "application/vnd.github.v3+json"}
 
+# connection pooling and retries for the shared Github client
+GITHUB_POOL_SIZE = 10
+GITHUB_RETRIES = 3
+GITHUB_BACKOFF_FACTOR = 0.5
+GITHUB_RETRY_STATUSES = [500, 502, 503, 504]
+
+# pacing of Github requests per user; requests are only paced once fewer than
+# RATE_LIMIT_LOW_WATER remain before the reset, and requests which would wait
+# longer than RATE_LIMIT_MAX_WAIT seconds are deferred instead
+RATE_LIMIT_BURST = 50
+RATE_LIMIT_LOW_WATER = 500
+RATE_LIMIT_MAX_WAIT = 5
+
+# organization membership lookups (ignore_members_of)
+MEMBERSHIP_CACHE_SIZE = 1024
+MEMBERSHIP_TTL = 60 * 60
+MEMBERSHIP_NEGATIVE_TTL = 5 * 60
+
+# events for an issue whose snooze label was cleared in the last
+# COALESCE_WINDOW seconds are coalesced, for up to COALESCE_CACHE_SIZE issues
+COALESCE_WINDOW = 30
+COALESCE_CACHE_SIZE = 4096
+
+# whether issues carry the snooze label, as last seen in a webhook payload or
+# Github response, is remembered for LABEL_STATE_TTL seconds
+LABEL_STATE_CACHE_SIZE = 4096
+LABEL_STATE_TTL = 60 * 60
+
+# the most messages SQS will receive or delete in one request
+SQS_BATCH_SIZE = 10
+# the longest SQS will hide a received message, in seconds
+SQS_MAX_VISIBILITY_TIMEOUT = 12 * 60 * 60
+
+# failed messages are retried after SQS_RETRY_BACKOFF seconds, doubling with
+# each receive, and dead-lettered after MAX_RECEIVE_COUNT receives
+SQS_RETRY_BACKOFF = 30
+MAX_RECEIVE_COUNT = 10
+DEAD_LETTER_RETENTION = 14 * 24 * 60 * 60
+
+# processed webhook deliveries are remembered for DEDUP_TTL seconds, up to
+# DEDUP_WINDOW_SIZE of them in memory, so that redeliveries are skipped
+DEDUP_WINDOW_SIZE = 10000
+DEDUP_TTL = 24 * 60 * 60
+
+# snooze_webhook: deliveries waiting to be handled are bounded by
+# WEBHOOK_QUEUE_SIZE; more are refused until the workers catch up. Github
+# doesn't send payloads larger than WEBHOOK_MAX_BODY bytes.
+WEBHOOK_PORT = 8080
+WEBHOOK_WORKERS = 8
+WEBHOOK_QUEUE_SIZE = 1000
+WEBHOOK_MAX_BODY = 25 * 1024 * 1024
+# events whose callbacks fail are retried after WEBHOOK_RETRY_BACKOFF seconds,
+# doubling with each attempt, or when the Github rate limit resets, and
+# dropped after WEBHOOK_MAX_ATTEMPTS attempts
+WEBHOOK_RETRY_BACKOFF = 5
+WEBHOOK_MAX_ATTEMPTS = 5
+
+# the most queues snooze_listen --asyncio polls at once
+ASYNC_CONCURRENCY = 16
+# when it has more queues than slots, snooze_listen --asyncio short-polls;
+# after an empty poll a queue waits ASYNC_IDLE_BACKOFF seconds, doubling with
+# each empty poll up to the length of a long poll, so idle queues cost about
+# as many receives as long polling them would
+ASYNC_IDLE_BACKOFF = 1
+ASYNC_MAX_IDLE_BACKOFF = 20
+
+# threads each listener uses to run callbacks, unless it is given an executor
+CALLBACK_WORKERS = 4
+# with more than SHARED_EXECUTOR_THRESHOLD repositories, snooze_listen runs
+# every repository's callbacks on one pool of SHARED_CALLBACK_WORKERS threads,
+# as many as that many repositories would have had between them
+SHARED_EXECUTOR_THRESHOLD = 8
+SHARED_CALLBACK_WORKERS = SHARED_EXECUTOR_THRESHOLD * CALLBACK_WORKERS
+# threads the Lambda handler uses to process the records of one invocation
+LAMBDA_WORKERS = 4
+
+# repositories snooze_deploy configures at once
+DEPLOY_WORKERS = 8
+# cached installations of snooze's requirements are reinstalled after this
+# many seconds, so that deployment packages pick up new releases
+REQUIREMENTS_CACHE_TTL = 24 * 60 * 60
+# repositories whose Github hooks snooze_listen registers at once
+HOOK_WORKERS = 8
+# pages of hook listings remembered with their ETags, so that unchanged
+# listings are revalidated with conditional requests
+HOOK_PAGE_CACHE_SIZE = 1024
+HOOK_PAGE_TTL = 24 * 60 * 60
+
+# issues events are opt-in through listen_events; they only track labels
 LISTEN_EVENTS = [
     "issue_comment",
     "pull_request",
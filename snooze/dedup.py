@@ -0,0 +1,119 @@
+from __future__ import absolute_import
+
+import logging
+import sqlite3
+import threading
+import time
+
+import snooze.constants as constants
+from snooze.cache import TTLCache
+
+
+def delivery_id(notification):
+    """Returns the key identifying one delivery of a webhook event, or None.
+
+    Github's delivery GUID is used if the notification carries it as an
+    X-Github-Delivery message attribute, so redeliveries of a hook are
+    recognized; otherwise the SNS MessageId, which is shared by every copy
+    SQS or Lambda delivers of one notification.
+
+    Args:
+        notification (dict): decoded SNS notification
+    """
+    attributes = notification.get("MessageAttributes") or {}
+    delivery = (attributes.get("X-Github-Delivery") or {}).get("Value")
+    return delivery or notification.get("MessageId")
+
+
+class SQLiteDeliveryStore(object):
+    """Remembers processed deliveries in a SQLite database, so that they are
+    recognized after a restart and by other processes sharing the file."""
+
+    def __init__(self, filename, ttl=constants.DEDUP_TTL, clock=time.time):
+        """Instantiates a SQLiteDeliveryStore.
+
+        Args:
+            filename (str): path of the database, which is created if missing
+            ttl (float): how long to remember a delivery, in seconds
+            clock (function()): returns the current time in seconds
+        """
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False, timeout=30)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS deliveries "
+                "(id TEXT PRIMARY KEY, expires REAL NOT NULL)")
+            self._connection.execute(
+                "DELETE FROM deliveries WHERE expires <= ?", (self._clock(),))
+
+    def __contains__(self, key):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM deliveries WHERE id = ? AND expires > ?",
+                (key, self._clock())).fetchone()
+        return row is not None
+
+    def add(self, key):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO deliveries (id, expires) VALUES (?, ?)",
+                (key, self._clock() + self.ttl))
+
+    def close(self):
+        self._connection.close()
+
+
+class Deduplicator(object):
+    """Recognizes webhook deliveries which have already been processed.
+
+    Deliveries are remembered in a bounded in-memory window and, optionally,
+    in a persistent store. A delivery is only recorded once it has been
+    processed successfully, so failed deliveries are still retried.
+    """
+
+    def __init__(self, store=None, maxsize=constants.DEDUP_WINDOW_SIZE,
+                 ttl=constants.DEDUP_TTL):
+        """Instantiates a Deduplicator.
+
+        Args:
+            store: persistent store of delivery ids, supporting `in` and
+                add(), such as a SQLiteDeliveryStore; or None
+            maxsize (int): number of deliveries to remember in memory
+            ttl (float): how long to remember a delivery in memory, in seconds
+        """
+        self.store = store
+        self.duplicates = 0
+        self._recent = TTLCache(maxsize, ttl)
+
+    def seen(self, key):
+        """Returns whether a delivery has been processed, counting it as a
+        duplicate if so. A key of None is never a duplicate."""
+        if key is None:
+            return False
+        if self._recent.get(key) is None:
+            if self.store is None or key not in self.store:
+                return False
+            self._recent.set(key, True)
+        self.duplicates += 1
+        logging.debug("Skipping duplicate delivery {}".format(key))
+        return True
+
+    def record(self, key):
+        """Remembers that a delivery has been processed."""
+        if key is None:
+            return
+        self._recent.set(key, True)
+        if self.store is not None:
+            self.store.add(key)
+
+    def clear(self):
+        self._recent.clear()
+        self.duplicates = 0
+
+
+def make_deduplicator(dedup_store=None):
+    """Returns a Deduplicator, persisted to the SQLite database at dedup_store
+    if that is set."""
+    return Deduplicator(SQLiteDeliveryStore(dedup_store) if dedup_store else None)
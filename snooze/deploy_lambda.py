@@ -1,13 +1,21 @@
 from __future__ import absolute_import
 
 import argparse
-import glob
+import base64
+import collections
+import compileall
+import concurrent.futures
+import contextlib
+import hashlib
 import logging
 import os
 import shutil
 import subprocess as sp
 import sys
 import tempfile
+import threading
+import time
+import zipfile
 from textwrap import dedent
 
 import boto3
@@ -15,6 +23,8 @@ from botocore.exceptions import ClientError
 import pkg_resources
 
 import snooze
+from snooze.constants import DEPLOY_WORKERS, REQUIREMENTS_CACHE_TTL
+from snooze.repository_listener import subscription_filter_policy
 
 
 LAMBDA_ROLE_TRUST_POLICY = """\
@@ -32,44 +42,455 @@ LAMBDA_ROLE_TRUST_POLICY = """\
 }
 """
 
+# name of the Lambda function shared by every repository in a region
+SHARED_FUNCTION_NAME = "snooze__shared"
 
-def create_or_get_lambda_role():
-    """Creates the Lambda execution role for github-snooze-button.
+# the parts of the snooze package which lambda_handler imports
+LAMBDA_MODULES = [
+    "cache.py",
+    "callbacks.py",
+    "constants.py",
+    "dedup.py",
+    "executor.py",
+    "github.py",
+    "lambda_handler.py",
+    "metrics.py",
+    "payload.py",
+    "version.py",
+]
 
-    Args: None
-    Returns: None
+# replaces snooze/__init__.py in lean packages, so that the package init
+# doesn't import the listener (and boto3) or the deployment tools
+LAMBDA_PACKAGE_INIT = "from .version import __version__\n"
+
+# modification time given to every file in a deployment package (1980-01-02,
+# since zip timestamps can't be earlier than 1980)
+PACKAGE_MTIME = 315619200
+
+# where Lambda unpacks deployment packages; bytecode records source paths
+# relative to it instead of the build directory
+LAMBDA_TASK_ROOT = "/var/task"
+
+BUILD_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "github-snooze-button")
+
+IMPORT_TIME_SCRIPT = ("import time; start = time.time(); import lambda_handler; "
+                      "print(time.time() - start)")
+
+LAMBDA_ROLE_PATH = "/tdsmith/github-snooze-button/"
+LAMBDA_ROLE_NAME = "snooze_lambda_role"
+
+
+class AwsCache(object):
+    """AWS clients and resource ARNs shared by every step of one deploy.
+
+    Clients are created once per service and region. boto3 clients may be
+    used from several threads, but sessions may not, so clients are
+    created under a lock.
+    """
+
+    def __init__(self, session=None):
+        """Instantiates an AwsCache.
+
+        Args:
+            session (boto3.session.Session): session to create clients from;
+                defaults to a new session
+        """
+        self._session = session or boto3.session.Session()
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._arns = {}
+
+    def client(self, service_name, region_name=None):
+        """Returns the client for an AWS service in a region."""
+        key = (service_name, region_name)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = self._session.client(service_name, region_name=region_name)
+            return self._clients[key]
+
+    def arn(self, key):
+        """Returns the ARN remembered for key, or None."""
+        with self._lock:
+            return self._arns.get(key)
+
+    def remember_arn(self, key, arn):
+        """Remembers the ARN of a resource found or created during the deploy.
+
+        Args:
+            key (tuple): (service name, region name, resource name)
+            arn (str): the resource's ARN
+        """
+        with self._lock:
+            self._arns[key] = arn
+
+
+class PhaseTimer(object):
+    """Adds up how long each phase of a deploy takes.
+
+    Phases of different repositories overlap, so the time reported for a
+    per-repository phase is the sum over every repository.
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        # phase -> [total seconds, count, longest seconds]
+        self.phases = collections.OrderedDict()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            totals = self.phases.setdefault(phase, [0.0, 0, 0.0])
+            totals[0] += seconds
+            totals[1] += 1
+            totals[2] = max(totals[2], seconds)
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        """Times the body of a with statement as one run of a phase."""
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.add(phase, self._clock() - start)
+
+    def stepper(self):
+        """Returns a function which starts timing the phase it is called
+        with, ending the phase it was last called with; call it with None to
+        end the last phase."""
+        current = [None, None]
+
+        def step(phase):
+            now = self._clock()
+            if current[0] is not None:
+                self.add(current[0], now - current[1])
+            current[:] = [phase, now]
+        return step
+
+    def report(self):
+        """Logs the time taken by each phase."""
+        logging.info("Deploy timings:")
+        for phase, (total, count, longest) in self.phases.items():
+            logging.info("  %-28s %8.2fs over %d (longest %.2fs)" % (phase, total, count, longest))
+
+
+def _error_code(error):
+    return error.response.get("Error", {}).get("Code")
+
+
+def create_or_get_lambda_role(aws=None):
+    """Creates the Lambda execution role for github-snooze-button, or looks
+    up the existing role by name.
+
+    Args:
+        aws (AwsCache): clients and ARNs of the current deploy
+
+    Returns: role_arn (str)
     """
-    lambda_role_path = "/tdsmith/github-snooze-button/"
-    lambda_role_name = "snooze_lambda_role"
+    aws = aws or AwsCache()
+    key = ("iam", None, LAMBDA_ROLE_NAME)
+    role_arn = aws.arn(key)
+    if role_arn:
+        return role_arn
 
-    iam = boto3.resource("iam")
-    roles = iam.roles.all()
-    for role in roles:
-        if role.path == lambda_role_path and role.name == lambda_role_name:
-            return role
+    iam = aws.client("iam")
+    try:
+        role_arn = iam.get_role(RoleName=LAMBDA_ROLE_NAME)["Role"]["Arn"]
+    except ClientError as e:
+        if _error_code(e) != "NoSuchEntity":
+            raise
+        role_arn = iam.create_role(
+            Path=LAMBDA_ROLE_PATH,
+            RoleName=LAMBDA_ROLE_NAME,
+            AssumeRolePolicyDocument=LAMBDA_ROLE_TRUST_POLICY)["Role"]["Arn"]
+        iam.attach_role_policy(
+            RoleName=LAMBDA_ROLE_NAME,
+            PolicyArn="arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole")
+    aws.remember_arn(key, role_arn)
+    return role_arn
+
+
+def _package_files(lean):
+    """Lists the files of the snooze package which go into a deployment
+    package, relative to the package directory."""
+    if lean:
+        return list(LAMBDA_MODULES)
+    source = os.path.dirname(os.path.abspath(__file__))
+    files = []
+    for root, dirs, names in os.walk(source):
+        dirs[:] = [name for name in dirs if name != "__pycache__"]
+        files.extend(os.path.relpath(os.path.join(root, name), source)
+                     for name in names if not name.endswith((".pyc", ".pyo")))
+    return sorted(files)
+
+
+def _copy_package(tmpdir, lean):
+    """Copies the snooze package into a deployment package directory."""
+    source = os.path.dirname(os.path.abspath(__file__))
+    destination = os.path.join(tmpdir, "snooze")
+    for name in _package_files(lean):
+        if not os.path.isdir(os.path.dirname(os.path.join(destination, name))):
+            os.makedirs(os.path.dirname(os.path.join(destination, name)))
+        shutil.copy(os.path.join(source, name), os.path.join(destination, name))
+    if lean:
+        with open(os.path.join(destination, "__init__.py"), "w") as f:
+            f.write(LAMBDA_PACKAGE_INIT)
+
+
+def _strip_package(tmpdir):
+    """Removes tests and stale bytecode from a deployment package directory."""
+    for root, dirs, files in os.walk(tmpdir):
+        for name in list(dirs):
+            if name in ("test", "tests", "__pycache__"):
+                shutil.rmtree(os.path.join(root, name))
+                dirs.remove(name)
+        for name in files:
+            if name.endswith((".pyc", ".pyo")):
+                os.remove(os.path.join(root, name))
+
+
+def _normalize_mtimes(path):
+    """Sets the modification time of every file under path to
+    PACKAGE_MTIME, so that bytecode and zips don't depend on when the files
+    were written."""
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            os.utime(os.path.join(root, name), (PACKAGE_MTIME, PACKAGE_MTIME))
+
+
+def write_zip(source, zip_filename, include_bytecode=False):
+    """Zips a directory deterministically.
+
+    Files are added in sorted order with fixed timestamps and permissions, so
+    the same files always produce the same zip (and the same CodeSha256).
 
-    role = iam.create_role(
-        Path=lambda_role_path,
-        RoleName=lambda_role_name,
-        AssumeRolePolicyDocument=LAMBDA_ROLE_TRUST_POLICY)
-    role.attach_policy(
-        PolicyArn="arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole")
-    return role
+    Args:
+        source (str): directory to zip; its contents go at the root of the zip
+        zip_filename (str): path of the zip file to write
+        include_bytecode (bool): whether to include .pyc files
+    """
+    date_time = time.gmtime(PACKAGE_MTIME)[:6]
+    with zipfile.ZipFile(zip_filename, "w", zipfile.ZIP_DEFLATED) as package:
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            if not include_bytecode and "__pycache__" in dirs:
+                dirs.remove("__pycache__")
+            for name in sorted(files):
+                if not include_bytecode and name.endswith((".pyc", ".pyo")):
+                    continue
+                path = os.path.join(root, name)
+                info = zipfile.ZipInfo(os.path.relpath(path, source).replace(os.sep, "/"),
+                                       date_time)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                mode = 0o755 if os.access(path, os.X_OK) else 0o644
+                info.external_attr = (0o100000 | mode) << 16
+                with open(path, "rb") as f:
+                    package.writestr(info, f.read())
+
+
+def code_sha256(data):
+    """Returns the CodeSha256 which Lambda reports for a deployment package."""
+    return base64.b64encode(hashlib.sha256(data).digest()).decode("ascii")
+
+
+def _hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _source_hash(lean):
+    """Hashes the snooze package files which go into a deployment package."""
+    source = os.path.dirname(os.path.abspath(__file__))
+    parts = []
+    for name in _package_files(lean):
+        with open(os.path.join(source, name), "rb") as f:
+            parts.extend([name, f.read()])
+    return _hash(*parts)
+
+
+def _pip_install(requires, target):
+    devnull = open(os.devnull, "w")
+    try:
+        sp.check_call([sys.executable, "-m", "pip", "install", "--target", target] + requires,
+                      stdout=devnull, stderr=sp.STDOUT)
+    finally:
+        devnull.close()
 
 
-def create_deployment_packages(config):
+def _cached_requirements(requires, cache_dir, ttl=REQUIREMENTS_CACHE_TTL):
+    """Returns a directory in cache_dir holding requires installed for this
+    Python version. The requirements are installed again once the
+    installation is older than ttl seconds, so that new releases of them are
+    picked up."""
+    key = _hash(sys.version.split()[0], *sorted(requires))
+    cached = os.path.join(cache_dir, "requirements-{}".format(key))
+    if os.path.isdir(cached) and time.time() - os.path.getmtime(cached) < ttl:
+        return cached
+    staging = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        site = os.path.join(staging, "site")
+        _pip_install(requires, site)
+        os.utime(site, None)
+        try:
+            if os.path.isdir(cached):
+                os.rename(cached, os.path.join(staging, "expired"))
+            os.rename(site, cached)
+        except OSError:
+            # another build cached the same requirements first
+            pass
+    finally:
+        shutil.rmtree(staging)
+    return cached
+
+
+def _installed_versions(path):
+    """Returns the names and versions of the distributions installed in a
+    directory, from their metadata directories."""
+    return sorted(name for name in os.listdir(path)
+                  if name.endswith((".dist-info", ".egg-info")))
+
+
+def _install_requirements(requires, tmpdir, cache_dir):
+    """Installs requirements into tmpdir, reusing a recent installation from
+    cache_dir if one exists for the same requirements and Python version."""
+    if not cache_dir:
+        _pip_install(requires, tmpdir)
+        return
+    cached = _cached_requirements(requires, cache_dir)
+    os.rmdir(tmpdir)
+    shutil.copytree(cached, tmpdir)
+
+
+def measure_import_time(tmpdir):
+    """Measures how long lambda_handler takes to import from a package
+    directory, in a fresh interpreter.
+
+    Returns: seconds (float), or None if the handler could not be imported
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    try:
+        output = sp.check_output([sys.executable, "-c", IMPORT_TIME_SCRIPT],
+                                 cwd=tmpdir, env=env, stderr=sp.STDOUT)
+    except sp.CalledProcessError as e:
+        logging.warning("Could not import lambda_handler from the deployment package: %s" %
+                        e.output.decode("utf-8", "replace").strip())
+        return None
+    return float(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def _prepare_package_dir(tmpdir, requires, lean, cache_dir):
+    """Fills tmpdir with everything a deployment package holds except
+    lambda_config."""
+    _install_requirements(requires, tmpdir, cache_dir)
+    _copy_package(tmpdir, lean)
+    shutil.copy(
+        os.path.join(os.path.dirname(__file__), "lambda_handler.py"),
+        tmpdir
+    )
+    if lean:
+        _strip_package(tmpdir)
+    _normalize_mtimes(tmpdir)
+    if lean:
+        compileall.compile_dir(tmpdir, ddir=LAMBDA_TASK_ROOT, quiet=1)
+
+
+def render_lambda_config(repo):
+    """Returns the source of the lambda_config module for a repository."""
+    return dedent("""\
+        github_auth = (%r, %r)
+        snooze_label = %r
+        ignore_members_of = %r
+        """) % (repo["github_username"],
+                repo["github_token"],
+                repo["snooze_label"],
+                repo["ignore_members_of"])
+
+
+def render_routes_config(repos):
+    """Returns the source of the lambda_config module for a function shared
+    by several repositories.
+
+    Args:
+        repos (dict): repository configurations by repository name
+    """
+    routes = ["    %r: ((%r, %r), %r, %r),\n" % (
+        repository_name,
+        repo["github_username"],
+        repo["github_token"],
+        repo["snooze_label"],
+        repo["ignore_members_of"]) for repository_name, repo in sorted(repos.items())]
+    return "routes = {\n" + "".join(routes) + "}\n"
+
+
+def create_deployment_packages(config, lean=False, cache_dir=BUILD_CACHE_DIR, shared=False):
     """Builds deployment packages for each configured repository.
 
     This function does not touch AWS. Deployment packages are saved as .zip
     files in the current working directory. The filenames of the deployment
     packages are saved as "zip_filename" keys on the config object.
 
-    Assumes that `zip` exists in PATH and `pip` is installed to the current
-    environment.
+    A lean package holds only the modules lambda_handler needs, without tests
+    and with precompiled bytecode, so that Lambda cold starts import less.
+    Bytecode is compiled by the current interpreter, which should match the
+    Lambda runtime.
+
+    Packages are built deterministically and cached in cache_dir, keyed by a
+    hash of the requirements, the snooze source and the repository's
+    settings, so unchanged packages aren't rebuilt. The installed
+    requirements are cached too. The cache holds Github credentials, like
+    the packages themselves, so it is only readable by the current user.
+
+    Assumes that `pip` is installed to the current environment.
 
     Args:
         config (dict): Configuration dictionary from parse_config. Modified
             in-place by addition of a "zip_filename" key.
+        lean (bool): whether to build lean packages
+        cache_dir (str): directory to cache builds in, or None to disable
+            the cache
+        shared (bool): whether to build one package per AWS region, shared
+            by every repository in the region, instead of one per repository
+
+    Returns: None
+    """
+    packages = []
+    if shared:
+        regions = {}
+        for repository_name, repo in config.items():
+            regions.setdefault(repo["aws_region"], {})[repository_name] = repo
+        for region, repos in sorted(regions.items()):
+            zip_filename = "lambda_deploy-shared-{}.zip".format(region)
+            for repo in repos.values():
+                repo["zip_filename"] = zip_filename
+            packages.append((region, zip_filename, render_routes_config(repos)))
+    else:
+        for repository_name, repo in config.items():
+            repo["zip_filename"] = "lambda_deploy-{}.zip".format(repository_name.replace("/", "_"))
+            packages.append((repository_name, repo["zip_filename"], render_lambda_config(repo)))
+    build_packages(packages, lean, cache_dir)
+
+
+def _build_key(requires, lean, cache_dir):
+    """Returns the part of a cached package's key shared by every package of
+    a build. It includes the versions of the requirements actually installed,
+    so that packages are rebuilt when the cached requirements pick up new
+    releases."""
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, 0o700)
+    installed = _installed_versions(_cached_requirements(requires, cache_dir))
+    return _hash(sys.version.split()[0], str(lean), _source_hash(lean), *installed)
+
+
+def build_packages(packages, lean=False, cache_dir=BUILD_CACHE_DIR):
+    """Builds deployment packages; see create_deployment_packages.
+
+    Args:
+        packages (list<(str name, str zip_filename, str lambda_config)>):
+            packages to build, with the source of their lambda_config modules
+        lean (bool): whether to build lean packages
+        cache_dir (str): directory to cache builds in, or None
 
     Returns: None
     """
@@ -80,79 +501,85 @@ def create_deployment_packages(config):
     # Amazon provides boto3
     requires = [i for i in requires if not i.startswith("boto3")]
 
+    build_key = _build_key(requires, lean, cache_dir) if cache_dir else None
+
+    pending = []
+    for name, zip_filename, lambda_config in packages:
+        cached = None
+        if cache_dir:
+            cached = os.path.join(cache_dir, "lambda-{}.zip".format(_hash(build_key, lambda_config)))
+            if os.path.exists(cached):
+                logging.info("Deployment package for %s is up to date" % name)
+                shutil.copyfile(cached, zip_filename)
+                continue
+        pending.append((name, zip_filename, lambda_config, cached))
+    if not pending:
+        return
+
     tmpdir = tempfile.mkdtemp()
     try:
-        devnull = open(os.devnull, "w")
-        sp.check_call([
-            sys.executable, "-m", "pip",
-            "install",
-            "--target", tmpdir] + requires,
-            stdout=devnull, stderr=sp.STDOUT)
-        shutil.copytree(
-            os.path.dirname(__file__),
-            os.path.join(tmpdir, "snooze"))
-        shutil.copy(
-            os.path.join(os.path.dirname(__file__), "lambda_handler.py"),
-            tmpdir
-        )
-        for repository_name, repo in config.items():
-            logging.info("Building deployment package for %s" % repository_name)
-            lambda_config = dedent("""\
-                github_auth = (%r, %r)
-                snooze_label = %r
-                ignore_members_of = %r
-                """) % (repo["github_username"],
-                        repo["github_token"],
-                        repo["snooze_label"],
-                        repo["ignore_members_of"])
-            with open(os.path.join(tmpdir, "snooze", "lambda_config.py"), "w") as f:
+        _prepare_package_dir(tmpdir, requires, lean, cache_dir)
+        for name, zip_filename, lambda_config, cached in pending:
+            logging.info("Building deployment package for %s" % name)
+            lambda_config_filename = os.path.join(tmpdir, "snooze", "lambda_config.py")
+            with open(lambda_config_filename, "w") as f:
                 f.write(lambda_config)
-            repo["zip_filename"] = "lambda_deploy-{}.zip".format(repository_name.replace("/", "_"))
-            curdir = os.getcwd()
-            os.chdir(tmpdir)
-            zip_list = glob.glob("*")
-            sp.check_call((["zip", "-r", os.path.join(curdir, repo["zip_filename"])] +
-                           zip_list +
-                           ["--exclude", "*.pyc"]),
-                          stdout=devnull, stderr=sp.STDOUT)
-            os.chdir(curdir)
+            os.utime(lambda_config_filename, (PACKAGE_MTIME, PACKAGE_MTIME))
+            if lean:
+                compileall.compile_file(lambda_config_filename, force=True, quiet=1,
+                                        ddir=LAMBDA_TASK_ROOT + "/snooze")
+            write_zip(tmpdir, zip_filename, include_bytecode=lean)
+            if cached:
+                shutil.copyfile(zip_filename, cached)
+            import_time = measure_import_time(tmpdir)
+            logging.info("Deployment package %s: %.1f kB, lambda_handler imports in %s" % (
+                zip_filename,
+                os.path.getsize(zip_filename) / 1024.0,
+                "?" if import_time is None else "%.0f ms" % (import_time * 1000)))
     finally:
         shutil.rmtree(tmpdir)
-        devnull.close()
 
 
-def create_or_update_lambda_function(execution_role, function_name, repo):
+def create_or_update_lambda_function(execution_role_arn, function_name, repo, aws=None):
     """Uploads Lambda deployment package to AWS.
 
     Args:
-        execution_role (boto3.IAM.Role): IAM role to use as the execution
+        execution_role_arn (str): ARN of the IAM role to use as the execution
             context for the Lambda function.
         function_name (str): Name to use for the function in AWS
         repo (dict): Repository configuration object; one of the values of the
             configuration dictionary returned from parse_config. `repo` is
             expected to contain a "zip_filename" key, added by create_deployment_packages.
+        aws (AwsCache): clients of the current deploy
 
     Returns: function_arn (str)
     """
+    aws = aws or AwsCache()
     with open(repo["zip_filename"], "rb") as f:
         package_zip = f.read()
-    client = boto3.client("lambda", region_name=repo["aws_region"])
-    function_arn = None
-    for page in client.get_paginator("list_functions").paginate():
-        for f in page["Functions"]:
-            if f["FunctionName"] == function_name:
-                function_arn = f["FunctionArn"]
-                break
+    client = aws.client("lambda", repo["aws_region"])
+    function_arn = current_sha256 = None
+    try:
+        function = client.get_function(FunctionName=function_name)["Configuration"]
+    except ClientError as e:
+        if _error_code(e) != "ResourceNotFoundException":
+            raise
+    else:
+        function_arn = function["FunctionArn"]
+        current_sha256 = function.get("CodeSha256")
 
     if function_arn:
-        client.update_function_code(
-            FunctionName=function_name,
-            ZipFile=package_zip)
+        if current_sha256 == code_sha256(package_zip):
+            logging.info("Lambda function %s is up to date" % function_name)
+        else:
+            client.update_function_code(
+                FunctionName=function_name,
+                ZipFile=package_zip)
     else:
         response = client.create_function(
             FunctionName=function_name,
             Runtime="python2.7",
-            Role=execution_role.arn,
+            Role=execution_role_arn,
             Handler="lambda_handler.lambda_handler",
             Code={"ZipFile": package_zip},
             Timeout=10,
@@ -162,6 +589,208 @@ def create_or_update_lambda_function(execution_role, function_name, repo):
     return function_arn
 
 
+def allow_sns_invoke(lambda_client, function_name, statement_id, source_arn):
+    """Gives SNS topics matching source_arn permission to invoke a Lambda
+    function, unless a statement with the same id already exists."""
+    try:
+        lambda_client.add_permission(
+            FunctionName=function_name,
+            StatementId=statement_id,
+            Action="lambda:InvokeFunction",
+            Principal="sns.amazonaws.com",
+            SourceArn=source_arn
+        )
+    except ClientError as e:
+        if _error_code(e) != "ResourceConflictException":
+            raise
+        logging.debug("Permission {} for {} already exists".format(statement_id, function_name))
+
+
+def _function_name(function_arn):
+    # arn:aws:lambda:region:account:function:name[:qualifier]
+    parts = function_arn.split(":")
+    return parts[6] if len(parts) > 6 else None
+
+
+def unsubscribe_other_functions(sns, topic_arn, function_arn):
+    """Unsubscribes snooze's other Lambda functions from a topic, so that a
+    repository which moves to or from the shared function isn't handled by
+    both.
+
+    Lambda functions which snooze didn't deploy are left subscribed.
+
+    Args:
+        sns: boto3 SNS client
+        topic_arn (str): ARN of the repository's SNS topic
+        function_arn (str): ARN of the function which should stay subscribed
+
+    Returns: list of the unsubscribed function ARNs
+    """
+    unsubscribed = []
+    for page in sns.get_paginator("list_subscriptions_by_topic").paginate(TopicArn=topic_arn):
+        for subscription in page["Subscriptions"]:
+            endpoint = subscription["Endpoint"]
+            if (subscription["Protocol"] != "lambda" or endpoint == function_arn or
+                    not (_function_name(endpoint) or "").startswith("snooze__")):
+                continue
+            sns.unsubscribe(SubscriptionArn=subscription["SubscriptionArn"])
+            logging.info("Unsubscribed {} from {}".format(endpoint, topic_arn))
+            unsubscribed.append(endpoint)
+    return unsubscribed
+
+
+def deploy_repository(role_arn, repository_name, repo, aws=None, progress=None,
+                      shared_function_arn=None):
+    """Connects a repository to a Lambda function through SNS.
+
+    Creates or reuses the repository's SNS topic, points the repository's
+    hook at it, uploads the repository's deployment package and subscribes
+    the function to the topic. With shared_function_arn, the repository is
+    subscribed to that function instead, which is already uploaded. Either
+    way, snooze's other functions are then unsubscribed from the topic.
+
+    Args:
+        role_arn (str): ARN of the execution role for the Lambda function
+        repository_name (str): name of the Github repository
+        repo (dict): repository configuration, with a "zip_filename" key
+            added by create_deployment_packages
+        aws (AwsCache): clients and ARNs of the current deploy
+        progress (function(str)): called with the name of each step as it
+            starts
+        shared_function_arn (str): ARN of the function shared by every
+            repository in the region, or None
+
+    Returns: function_arn (str)
+    """
+    aws = aws or AwsCache()
+    progress = progress or (lambda step: None)
+
+    # set up SNS topic and connect Github
+    progress("creating SNS topic")
+    sns = aws.client("sns", repo["aws_region"])
+    topic_arn = sns.create_topic(Name=repository_name.replace("/", "__"))["TopicArn"]
+    progress("connecting Github")
+    snooze.connect_github_to_sns(
+        sns_topic_arn=topic_arn,
+        events=repo["listen_events"],
+        **repo)
+
+    if shared_function_arn:
+        # deploy_shared_functions already let the region's topics invoke it
+        function_arn = shared_function_arn
+    else:
+        # upload a Lambda package
+        progress("uploading Lambda function")
+        function_name = "snooze__{}".format(repo["repository_name"].replace("/", "__"))
+        function_arn = create_or_update_lambda_function(role_arn, function_name, repo, aws)
+        allow_sns_invoke(aws.client("lambda", repo["aws_region"]), function_name, "1", topic_arn)
+
+    progress("subscribing Lambda function")
+
+    # connect the SNS topic to the Lambda function
+    subscription_arn = sns.subscribe(
+        TopicArn=topic_arn,
+        Protocol="lambda",
+        Endpoint=function_arn
+    )["SubscriptionArn"]
+    sns.set_subscription_attributes(
+        SubscriptionArn=subscription_arn,
+        AttributeName="FilterPolicy",
+        AttributeValue=subscription_filter_policy(repo["listen_events"]))
+    unsubscribe_other_functions(sns, topic_arn, function_arn)
+    return function_arn
+
+
+def deploy_shared_functions(role_arn, config, aws=None):
+    """Uploads the function shared by the repositories of each AWS region.
+
+    Each function gets a single permission for every SNS topic in its region
+    and account, since a permission per topic would soon outgrow the
+    function's policy size limit.
+
+    Args:
+        role_arn (str): ARN of the execution role for the Lambda functions
+        config (dict): configuration dictionary from parse_config, after
+            create_deployment_packages(shared=True)
+        aws (AwsCache): clients and ARNs of the current deploy
+
+    Returns: dict<str aws_region, str function_arn>
+    """
+    aws = aws or AwsCache()
+    function_arns = {}
+    for repo in config.values():
+        region = repo["aws_region"]
+        if region not in function_arns:
+            logging.info("Uploading shared Lambda function for %s" % region)
+            function_arn = create_or_update_lambda_function(
+                role_arn, SHARED_FUNCTION_NAME, repo, aws)
+            account = function_arn.split(":")[4]
+            allow_sns_invoke(aws.client("lambda", region), SHARED_FUNCTION_NAME, "sns",
+                             "arn:aws:sns:{}:{}:*".format(region, account))
+            function_arns[region] = function_arn
+    return function_arns
+
+
+def deploy_repositories(role_arn, config, workers=DEPLOY_WORKERS, shared_function_arns=None,
+                        aws=None, timer=None):
+    """Deploys every configured repository on a pool of worker threads,
+    logging each step and a summary.
+
+    Args:
+        role_arn (str): ARN of the execution role for the Lambda functions
+        config (dict): configuration dictionary from parse_config, after
+            create_deployment_packages
+        workers (int): the most repositories to deploy at once
+        shared_function_arns (dict<str, str>): ARNs of the shared function
+            in each region, from deploy_shared_functions, or None to deploy
+            a function per repository
+        aws (AwsCache): clients and ARNs of the current deploy
+        timer (PhaseTimer): timer to add the time of each step to
+
+    Returns: dict<str repository_name, Exception> of failed repositories
+    """
+    aws = aws or AwsCache()
+    timer = timer or PhaseTimer()
+    total = len(config)
+    lock = threading.Lock()
+    done = [0]
+    failures = {}
+
+    def deploy(repository_name, repo):
+        step = timer.stepper()
+
+        def progress(name):
+            logging.info("%s: %s" % (repository_name, name))
+            step(name)
+        try:
+            deploy_repository(
+                role_arn, repository_name, repo, aws, progress,
+                shared_function_arn=(shared_function_arns or {}).get(repo["aws_region"]))
+        except Exception as e:
+            logging.error("%s: failed: %s: %s" % (repository_name, e.__class__.__name__, e))
+            with lock:
+                failures[repository_name] = e
+        finally:
+            step(None)
+        with lock:
+            done[0] += 1
+            logging.info("Finished %d/%d repositories (%d failed)" %
+                         (done[0], total, len(failures)))
+
+    pool = concurrent.futures.ThreadPoolExecutor(max(1, min(workers, total)))
+    try:
+        for future in [pool.submit(deploy, repository_name, repo)
+                       for repository_name, repo in config.items()]:
+            future.result()
+    finally:
+        pool.shutdown()
+
+    logging.info("Deployed %d of %d repositories" % (total - len(failures), total))
+    for repository_name in sorted(failures):
+        logging.error("Failed to deploy %s: %s" % (repository_name, failures[repository_name]))
+    return failures
+
+
 def main():
     if sys.version_info[:2] != (2, 7):
         logging.error("Must execute with Python 2.7")
@@ -169,47 +798,45 @@ def main():
 
     parser = argparse.ArgumentParser()
     parser.add_argument("config")
+    parser.add_argument(
+        "--lean", action="store_true",
+        help="package only the modules the Lambda handler needs, with precompiled "
+             "bytecode, to reduce cold start time")
+    parser.add_argument(
+        "--build-cache", default=BUILD_CACHE_DIR,
+        help="directory to cache deployment packages in (default: %(default)s)")
+    parser.add_argument(
+        "--no-build-cache", dest="build_cache", action="store_const", const=None,
+        help="always rebuild deployment packages")
+    parser.add_argument(
+        "--shared-function", action="store_true",
+        help="deploy one Lambda function per AWS region for all repositories, "
+             "instead of one per repository")
+    parser.add_argument(
+        "--workers", type=int, default=DEPLOY_WORKERS,
+        help="the most repositories to deploy at once (default: %(default)s)")
     args = parser.parse_args()
 
     config = snooze.parse_config(args.config)
-    create_deployment_packages(config)
-    iam_role = create_or_get_lambda_role()
-
-    for repository_name, repo in config.items():
-        logging.info("Configuring repository %s" % repository_name)
-        # set up SNS topic and connect Github
-        sns = boto3.resource("sns", region_name=repo["aws_region"])
-        topic = sns.create_topic(Name=repository_name.replace("/", "__"))
-        snooze.connect_github_to_sns(
-            sns_topic_arn=topic.arn,
-            events=snooze.constants.LISTEN_EVENTS,
-            **repo)
-
-        # upload a Lambda package
-        function_name = "snooze__{}".format(repo["repository_name"].replace("/", "__"))
-        function_arn = create_or_update_lambda_function(iam_role, function_name, repo)
-
-        lambda_client = boto3.client("lambda", region_name=repo["aws_region"])
-        try:
-            # give the SNS topic permission to invoke the Lambda function
-            lambda_client.add_permission(
-                FunctionName=function_name,
-                StatementId="1",
-                Action="lambda:InvokeFunction",
-                Principal="sns.amazonaws.com",
-                SourceArn=topic.arn
-            )
-        except ClientError:
-            logging.debug("Received ClientError; permission probably already exists")
-
-        # connect the SNS topic to the Lambda function
-        topic.subscribe(
-            Protocol="lambda",
-            Endpoint=function_arn
-        )
-
-        logging.info("Connected repository %s" % repository_name)
+    aws = AwsCache()
+    timer = PhaseTimer()
+    try:
+        with timer.phase("building packages"):
+            create_deployment_packages(config, lean=args.lean, cache_dir=args.build_cache,
+                                       shared=args.shared_function)
+        with timer.phase("looking up IAM role"):
+            role_arn = create_or_get_lambda_role(aws)
+        shared_function_arns = None
+        if args.shared_function:
+            with timer.phase("uploading shared functions"):
+                shared_function_arns = deploy_shared_functions(role_arn, config, aws)
+        with timer.phase("deploying repositories"):
+            failures = deploy_repositories(role_arn, config, args.workers, shared_function_arns,
+                                           aws, timer)
+    finally:
+        timer.report()
+    return not failures
 
 
 if __name__ == "__main__":
-    sys.exit(main() is True)
+    sys.exit(not main())
@@ -0,0 +1,44 @@
+from __future__ import absolute_import
+
+import concurrent.futures
+import itertools
+import threading
+
+
+class ShardedExecutor(object):
+    """Runs tasks concurrently while keeping tasks with the same key in order.
+
+    Tasks are spread over single-threaded shards by the hash of their key, so
+    two tasks for the same key always run on the same shard, one after the
+    other, while tasks for different keys run in parallel. Tasks without a key
+    are spread over the shards in turn.
+    """
+
+    def __init__(self, workers):
+        """Instantiates a ShardedExecutor.
+
+        Args:
+            workers (int): number of shards, i.e. the most tasks that can run
+                at once. Threads are only started once tasks arrive.
+        """
+        self.workers = workers
+        self._shards = [concurrent.futures.ThreadPoolExecutor(max_workers=1)
+                        for _ in range(workers)]
+        self._next_shard = itertools.cycle(range(workers))
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Schedules fn(*args, **kwargs) on the shard for key.
+
+        Returns: concurrent.futures.Future
+        """
+        if key is None:
+            with self._lock:
+                shard = next(self._next_shard)
+        else:
+            shard = hash(key) % self.workers
+        return self._shards[shard].submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        for shard in self._shards:
+            shard.shutdown(wait=wait)
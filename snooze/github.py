@@ -0,0 +1,267 @@
+from __future__ import absolute_import
+
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import snooze.constants as constants
+import snooze.metrics as metrics
+
+REPOSITORY_RE = re.compile(r"/repos/([^/]+/[^/?#]+)")
+
+
+def _retry_policy(retries, backoff_factor):
+    """Builds a urllib3 Retry policy for transient Github failures.
+
+    Args:
+        retries (int): maximum number of retries per request
+        backoff_factor (float): exponential backoff factor between retries,
+            in seconds
+
+    Returns: urllib3.util.retry.Retry
+    """
+    kwargs = {
+        "total": retries,
+        "backoff_factor": backoff_factor,
+        "status_forcelist": constants.GITHUB_RETRY_STATUSES,
+        "raise_on_status": False,
+    }
+    methods = frozenset(["GET", "PATCH", "DELETE"])
+    try:
+        return Retry(allowed_methods=methods, **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=methods, **kwargs)
+
+
+class RateLimitExceeded(requests.exceptions.HTTPError):
+    """Raised when a Github request must wait for the rate limit to reset.
+
+    Attributes:
+        retry_after (float): seconds until the request may be retried
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.retry_after = kwargs.pop("retry_after")
+        super(RateLimitExceeded, self).__init__(*args, **kwargs)
+
+
+class RateLimiter(object):
+    """Paces requests made with one Github credential to fit its rate limit.
+
+    Requests aren't paced while the remaining quota (X-RateLimit-Remaining)
+    is above a low-water mark. Below it, the limiter is a token bucket which
+    refills at the rate that would spend the remaining quota exactly when the
+    quota resets (X-RateLimit-Reset). After a secondary rate limit response,
+    all requests wait for its Retry-After period.
+    """
+
+    def __init__(self, burst=constants.RATE_LIMIT_BURST,
+                 low_water=constants.RATE_LIMIT_LOW_WATER,
+                 max_wait=constants.RATE_LIMIT_MAX_WAIT,
+                 clock=time.time, sleep=time.sleep):
+        """Instantiates a RateLimiter.
+
+        Args:
+            burst (int): the most requests to allow back to back once
+                requests are paced
+            low_water (int): the remaining quota below which requests are
+                paced
+            max_wait (float): the longest acquire will block, in seconds;
+                requests which would wait longer raise RateLimitExceeded so
+                the work can be deferred instead of holding a thread
+            clock (function()): returns the current time in seconds
+            sleep (function(float)): sleeps for some seconds
+        """
+        self.burst = burst
+        self.low_water = low_water
+        self.max_wait = max_wait
+        self.remaining = None
+        self.reset = None
+        self._tokens = float(burst)
+        self._last = clock()
+        self._blocked_until = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def _delay(self, now):
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self.remaining is None or self.reset is None or self.reset <= now:
+            return 0
+        if self.remaining <= 0:
+            return self.reset - now
+        if self.remaining > self.low_water:
+            self._tokens = float(self.burst)
+            self._last = now
+            return 0
+        rate = self.remaining / (self.reset - now)
+        self._tokens = min(self.burst, self._tokens + rate * (now - self._last))
+        self._last = now
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / rate
+
+    def acquire(self):
+        """Blocks until a request may be sent.
+
+        Raises: RateLimitExceeded if the request would wait longer than
+            max_wait
+        """
+        with self._lock:
+            now = self._clock()
+            delay = self._delay(now)
+            if delay > self.max_wait:
+                raise RateLimitExceeded(
+                    "Github rate limit reached; retry in {:.0f}s".format(delay),
+                    retry_after=delay)
+            self._tokens -= 1
+            if self.remaining is not None:
+                self.remaining -= 1
+        if delay > 0:
+            self._sleep(delay)
+
+    def update(self, response):
+        """Records the rate limit state reported by a Github response.
+
+        Returns: seconds to wait before retrying (float) if the response was
+            rejected by a rate limit, otherwise None
+        """
+        headers = response.headers
+        now = self._clock()
+        with self._lock:
+            if "X-RateLimit-Remaining" in headers and "X-RateLimit-Reset" in headers:
+                self.remaining = int(headers["X-RateLimit-Remaining"])
+                self.reset = float(headers["X-RateLimit-Reset"])
+            if response.status_code not in (403, 429):
+                return None
+            if "Retry-After" in headers:
+                self._blocked_until = now + float(headers["Retry-After"])
+            elif self.remaining == 0 and self.reset is not None:
+                self._blocked_until = self.reset
+            else:
+                return None
+            return max(self._blocked_until - now, 0)
+
+
+class GithubClient(object):
+    """A reusable, connection-pooled client for the Github API.
+
+    All requests made through a GithubClient share one requests.Session, so
+    connections to api.github.com are kept alive and reused between webhook
+    events instead of paying for a new TCP and TLS handshake each time.
+    """
+
+    def __init__(self, github_username, github_token,
+                 pool_size=constants.GITHUB_POOL_SIZE,
+                 retries=constants.GITHUB_RETRIES,
+                 backoff_factor=constants.GITHUB_BACKOFF_FACTOR,
+                 rate_limiter=None,
+                 api_url=constants.GITHUB_API_URL):
+        """Instantiates a GithubClient.
+
+        Args:
+            github_username (str): Github username
+            github_token (str): Github authentication token
+            pool_size (int): maximum number of keep-alive connections to keep
+                open per host
+            retries (int): maximum number of retries for connection errors
+                and 5xx responses
+            backoff_factor (float): exponential backoff factor between retries
+            rate_limiter (RateLimiter): paces requests; defaults to the
+                limiter shared by every client for github_username
+            api_url (str): base URL of the Github API, for URLs which are not
+                taken from webhook payloads
+        """
+        self.github_username = github_username
+        self.api_url = api_url.rstrip("/")
+        self.rate_limiter = rate_limiter or get_rate_limiter(github_username)
+        self.session = requests.Session()
+        self.session.auth = requests.auth.HTTPBasicAuth(github_username, github_token)
+        self.session.headers.update(constants.GITHUB_HEADERS)
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=_retry_policy(retries, backoff_factor))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        """Sends a request once the rate limiter allows it.
+
+        Raises: RateLimitExceeded if the rate limit is exhausted
+        """
+        self.rate_limiter.acquire()
+        match = REPOSITORY_RE.search(url)
+        repository = match.group(1) if match else ""
+        start = time.time()
+        r = self.session.request(method, url, **kwargs)
+        metrics.github_request_seconds.observe(
+            time.time() - start, repository=repository, method=method)
+        metrics.github_responses.inc(repository=repository, status=r.status_code)
+        retry_after = self.rate_limiter.update(r)
+        if self.rate_limiter.remaining is not None:
+            metrics.github_rate_limit_remaining.set(
+                self.rate_limiter.remaining, user=self.github_username)
+        if retry_after is not None:
+            raise RateLimitExceeded(
+                "Github rate limit exceeded for {}; retry in {:.0f}s".format(
+                    self.github_username, retry_after),
+                response=r, retry_after=retry_after)
+        return r
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_rate_limiters = {}
+_clients_lock = threading.RLock()
+
+
+def get_rate_limiter(github_username):
+    """Returns the RateLimiter shared by every client for a Github user.
+
+    Github's rate limits apply per user, across all of the user's tokens.
+    """
+    with _clients_lock:
+        limiter = _rate_limiters.get(github_username)
+        if limiter is None:
+            limiter = _rate_limiters[github_username] = RateLimiter()
+    return limiter
+
+
+def get_client(github_auth):
+    """Returns the shared GithubClient for a set of credentials.
+
+    Args:
+        github_auth (GithubClient | tuple): a GithubClient, which is returned
+            unchanged, or a (github_username, github_token) tuple
+
+    Returns: GithubClient
+    """
+    if isinstance(github_auth, GithubClient):
+        return github_auth
+    github_auth = tuple(github_auth)
+    with _clients_lock:
+        client = _clients.get(github_auth)
+        if client is None:
+            client = _clients[github_auth] = GithubClient(*github_auth)
+    return client
@@ -1,21 +1,138 @@
 from __future__ import absolute_import
 
-import json
 import logging
 
-from snooze.callbacks import github_callback
-from snooze.lambda_config import github_auth, snooze_label, ignore_members_of
+import snooze.lambda_config as lambda_config
+from snooze.callbacks import github_callback, issue_url, repository_name, wants_event
+from snooze.constants import LAMBDA_WORKERS
+from snooze.dedup import delivery_id, make_deduplicator
+from snooze.executor import ShardedExecutor
+from snooze.github import GithubClient, get_client
+from snooze.payload import decode_payload, loads
 
 # this appears to be magical
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
+# created once per container so warm invocations reuse open connections,
+# worker threads, the membership cache in snooze.callbacks and the record of
+# recently processed deliveries
+executor = ShardedExecutor(LAMBDA_WORKERS)
+deduplicator = make_deduplicator()
+
+# A function deployed for one repository has github_auth, snooze_label and
+# ignore_members_of settings. A function shared by many repositories instead
+# has a routing table, mapping each repository's full name to a
+# (github_auth, snooze_label, ignore_members_of) tuple.
+if hasattr(lambda_config, "routes"):
+    github = None
+    routes = {name.lower(): route for name, route in lambda_config.routes.items()}
+else:
+    github = GithubClient(*lambda_config.github_auth)
+    routes = None
+
+
+def route(github_message):
+    """Looks up the settings for the repository a payload concerns.
+
+    Returns: (GithubClient, str snooze_label, str ignore_members_of), or None
+        if the repository isn't configured
+    """
+    if routes is None:
+        return github, lambda_config.snooze_label, lambda_config.ignore_members_of
+    settings = routes.get(repository_name(github_message).lower())
+    if settings is None:
+        return None
+    github_auth, snooze_label, ignore_members_of = settings
+    # clients are shared by repositories with the same credentials
+    return get_client(github_auth), snooze_label, ignore_members_of
+
+
+def parse_record(record):
+    """Decodes a record delivered by SNS, or by SQS from a SNS subscription.
+
+    Returns: (str record_id, str delivery_id, str github_event,
+        Object github_message); github_message is None for events
+        github_callback doesn't act on, whose payloads aren't decoded
+    """
+    if "Sns" in record:
+        sns_message = record["Sns"]
+        record_id = sns_message["MessageId"]
+    else:
+        sns_message = loads(record["body"])
+        record_id = record["messageId"]
+    github_event = sns_message['MessageAttributes']['X-Github-Event']['Value']
+    return (record_id, delivery_id(sns_message), github_event,
+            decode_payload(github_event, sns_message['Message'], wants_event))
+
+
+def accept_record(record, deliveries):
+    """Decodes a record and decides whether to handle it.
+
+    Malformed records, events github_callback doesn't act on, events for
+    unconfigured repositories and deliveries which were already processed,
+    by this container or earlier in the batch, are skipped.
+
+    Args:
+        record (dict): SNS or SQS record
+        deliveries (set): delivery ids accepted earlier in the batch
+
+    Returns: (str record_id, str delivery_id, str github_event,
+        Object github_message, tuple settings from route), or None if the
+        record should be skipped
+    """
+    try:
+        record_id, delivery, github_event, github_message = parse_record(record)
+    except (KeyError, ValueError):
+        logger.error("Dropping malformed record: %r" % (record,))
+        return None
+    if github_message is None:
+        logger.debug("Ignoring %s event" % github_event)
+        return None
+    settings = route(github_message)
+    if settings is None:
+        logger.warning("Ignoring %s event for unconfigured repository %s" %
+                       (github_event, repository_name(github_message)))
+        return None
+    if deduplicator.seen(delivery) or (delivery is not None and delivery in deliveries):
+        logger.info("Skipping duplicate delivery %s" % delivery)
+        return None
+    deliveries.add(delivery)
+    return record_id, delivery, github_event, github_message, settings
+
 
 def lambda_handler(event, _):
+    """Handles a batch of records concurrently.
+
+    Records for the same issue are handled in order. Returns the records
+    which failed in the SQS partial batch response format, so that an SQS
+    event source only retries those. SNS ignores the return value, so a
+    failed SNS record raises instead, letting Lambda retry the invocation.
+    Records which repeat a delivery already processed by this container are
+    skipped.
+    """
+    futures = []
+    deliveries = set()
     for record in event['Records']:
-        sns_message = record['Sns']
-        github_event = sns_message['MessageAttributes']['X-Github-Event']['Value']
+        accepted = accept_record(record, deliveries)
+        if accepted is None:
+            continue
+        record_id, delivery, github_event, github_message, settings = accepted
         logger.debug("Received event type %s" % github_event)
-        github_message = json.loads(sns_message['Message'])
-        github_callback(github_event, github_message, github_auth, snooze_label, ignore_members_of)
+        futures.append((record_id, delivery, executor.submit(
+            issue_url(github_message), github_callback,
+            github_event, github_message, *settings)))
+
+    failures = []
+    for record_id, delivery, future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            logger.error("Record %s failed: %s: %s" % (record_id, e.__class__.__name__, e))
+            failures.append(record_id)
+        else:
+            deduplicator.record(delivery)
+    if failures and any("Sns" in record for record in event['Records']):
+        raise RuntimeError("%d of %d records failed" % (len(failures), len(futures)))
+    return {"batchItemFailures": [{"itemIdentifier": record_id} for record_id in failures]}
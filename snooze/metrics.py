@@ -0,0 +1,263 @@
+"""Prometheus-style metrics for github-snooze-button.
+
+Metrics are always collected in-process; snooze_listen --metrics-port serves
+them over HTTP in the Prometheus text exposition format.
+"""
+from __future__ import absolute_import
+
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# metrics are only served to the local host unless another address is given
+DEFAULT_ADDRESS = "127.0.0.1"
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").
+            replace("\n", "\\n").replace('"', '\\"'))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, _escape(v)) for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError("{} expects labels {}, got {}".format(
+                self.name, self.labelnames, sorted(labels)))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def get(self, **labels):
+        """Returns the current value for a set of labels (for tests)."""
+        return self._values.get(self._key(labels), 0)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name + _format_labels(self.labelnames, key), value
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} {}".format(self.name, self.type)]
+        lines.extend("{} {}".format(name, _format_value(value))
+                     for name, value in self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class FunctionMetric(_Metric):
+    """A metric whose value is read from a function at scrape time."""
+
+    def __init__(self, name, documentation, type, function):
+        super(FunctionMetric, self).__init__(name, documentation)
+        self.type = type
+        self.function = function
+
+    def get(self):
+        return self.function()
+
+    def _samples(self):
+        yield self.name, self.function()
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def get(self, **labels):
+        """Returns the number of observations for a set of labels."""
+        counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+        return sum(counts)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total))
+                           for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield (self.name + "_bucket" +
+                       _format_labels(self.labelnames, key, [("le", _format_value(bound))]),
+                       cumulative)
+            yield self.name + "_sum" + _format_labels(self.labelnames, key), total
+            yield self.name + "_count" + _format_labels(self.labelnames, key), cumulative
+
+
+class Registry(object):
+    """A collection of metrics which can be rendered together."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def function(self, name, documentation, type, function):
+        return self.register(FunctionMetric(name, documentation, type, function))
+
+    def clear(self):
+        """Resets every metric's values, keeping the metrics registered."""
+        for metric in self._metrics:
+            metric.clear()
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics)
+        return "".join(metric.render() + "\n" for metric in metrics)
+
+
+registry = Registry()
+
+# RepositoryListener.poll, labelled by repository (or shared queue name)
+messages_received = registry.counter(
+    "snooze_sqs_messages_received_total", "SQS messages received", ["repository"])
+messages_deleted = registry.counter(
+    "snooze_sqs_messages_deleted_total", "SQS messages deleted after processing", ["repository"])
+messages_deferred = registry.counter(
+    "snooze_sqs_messages_deferred_total", "SQS messages left on the queue for a retry",
+    ["repository"])
+empty_polls = registry.counter(
+    "snooze_sqs_empty_receives_total", "SQS receives which returned no messages", ["repository"])
+filtered_messages = registry.counter(
+    "snooze_sqs_messages_filtered_total", "SQS messages dropped without decoding their payload",
+    ["repository"])
+duplicate_deliveries = registry.counter(
+    "snooze_duplicate_deliveries_total", "Webhook deliveries skipped as already processed",
+    ["repository"])
+receive_seconds = registry.histogram(
+    "snooze_sqs_receive_seconds", "Latency of SQS receive requests", ["repository"],
+    buckets=DEFAULT_BUCKETS + (20, 25))
+
+# snooze_webhook
+webhook_requests = registry.counter(
+    "snooze_webhook_requests_total", "Webhook deliveries received over HTTP, by response status",
+    ["status"])
+
+# github_callback
+events = registry.counter(
+    "snooze_events_total", "Github webhook events handled", ["repository", "event"])
+label_removals = registry.counter(
+    "snooze_label_removals_total", "Snooze labels removed", ["repository"])
+coalesced_events = registry.counter(
+    "snooze_coalesced_events_total",
+    "Events skipped because the issue's snooze label was just cleared", ["repository"])
+ignored_members = registry.counter(
+    "snooze_ignored_member_events_total",
+    "Events skipped because the author belongs to ignore_members_of", ["repository"])
+
+# Github API requests
+github_request_seconds = registry.histogram(
+    "snooze_github_request_seconds", "Latency of Github API requests",
+    ["repository", "method"])
+github_responses = registry.counter(
+    "snooze_github_responses_total", "Github API responses by status code",
+    ["repository", "status"])
+github_rate_limit_remaining = registry.gauge(
+    "snooze_github_rate_limit_remaining", "Github API requests remaining before the rate limit",
+    ["user"])
+
+
+def start_http_server(port, address=DEFAULT_ADDRESS, registry=registry):
+    """Serves metrics at http://address:port/metrics from a daemon thread.
+
+    Args:
+        port (int): port to listen on
+        address (str): address to listen on; "" listens on all addresses
+        registry (Registry): metrics to serve
+
+    Returns: the HTTPServer
+    """
+    # imported here so that the Lambda handler doesn't pay for http.server
+    try:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+    except ImportError:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            data = self.server.registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer((address, port), MetricsHandler)
+    server.registry = registry
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -1,30 +1,263 @@
 from __future__ import absolute_import
 
+import concurrent.futures
 import json
+import math
 import pprint
 import logging
+import time
 
 import boto3
-import requests
 
-from snooze.constants import GITHUB_HEADERS
+import snooze.metrics as metrics
+from snooze.cache import TTLCache
+from snooze.callbacks import issue_url
+from snooze.constants import (
+    CALLBACK_WORKERS, DEAD_LETTER_RETENTION, HOOK_PAGE_CACHE_SIZE, HOOK_PAGE_TTL, HOOK_WORKERS,
+    MAX_RECEIVE_COUNT, SQS_BATCH_SIZE, SQS_MAX_VISIBILITY_TIMEOUT, SQS_RETRY_BACKOFF)
+from snooze.dedup import delivery_id, make_deduplicator
+from snooze.payload import decode_payload, loads
+from snooze.executor import ShardedExecutor
+from snooze.github import RateLimitExceeded, get_client
 
 try:
     basestring
 except NameError:
     basestring = str
 
+# (github_username, url) -> (ETag, hooks, next page url) for pages of hook
+# listings, shared by every repository
+hook_pages = TTLCache(HOOK_PAGE_CACHE_SIZE, HOOK_PAGE_TTL)
 
-class RepositoryListener(object):
+
+class QueueListener(object):
+    """Processes Github webhook events delivered to an AWS SQS queue."""
+
+    def __init__(self, sqs_queue, route, executor=None, workers=CALLBACK_WORKERS,
+                 deduplicator=None, event_filter=None):
+        """Instantiates a QueueListener.
+
+        Args:
+            sqs_queue (boto3.SQS.Queue): queue receiving webhook events
+                from AWS SNS
+            route (function(str event_type, Object decoded_body)): returns
+                the callbacks which should see an event, or None to drop it
+            executor (ShardedExecutor): executor to run callbacks on, which
+                may be shared between listeners. Events for the same issue
+                are always handled in the order received.
+            workers (int): if no executor is given, the number of threads in
+                this listener's own executor
+            deduplicator (Deduplicator): skips messages which have already
+                been processed; defaults to an in-memory window
+            event_filter (function(str event_type, str action)): returns
+                whether an event should be handled, like
+                snooze.callbacks.wants_event; other messages are deleted
+                without fully decoding them. None handles every event.
+        """
+        self.sqs_queue = sqs_queue
+        self.route = route
+        self.executor = executor or ShardedExecutor(int(workers))
+        self.deduplicator = deduplicator or make_deduplicator()
+        self.event_filter = event_filter
+
+    def poll(self, wait=True, drain=False):
+        """Checks for messages from the queue.
+
+        Up to SQS_BATCH_SIZE messages are received at once, and the messages
+        of each batch are deleted with a single request once processed.
+
+        Args:
+            wait (bool): Use SQS long polling, i.e. wait up to 20 seconds for a
+                message to be received before returning an empty list.
+            drain (bool): Keep receiving, without waiting, until the queue
+                comes back empty.
+
+        Returns: number of messages received (int)
+        """
+        received = 0
+        while True:
+            start = time.time()
+            messages = self.sqs_queue.receive_messages(
+                AttributeNames=["ApproximateReceiveCount"],
+                MaxNumberOfMessages=SQS_BATCH_SIZE,
+                WaitTimeSeconds=20*wait)
+            metrics.receive_seconds.observe(time.time() - start, repository=self._metrics_label)
+            metrics.messages_received.inc(len(messages), repository=self._metrics_label)
+            if not messages:
+                metrics.empty_polls.inc(repository=self._metrics_label)
+            received += len(messages)
+            self._handle_messages(messages)
+            if not (drain and messages):
+                return received
+            wait = False
+
+    def _handle_messages(self, messages):
+        """Runs the callbacks for a batch of messages on the executor, then
+        deletes the messages once every callback has finished.
+
+        Messages whose callbacks failed are not deleted. They become visible
+        again after an exponential backoff, or once the Github rate limit
+        allows a retry, until the queue's redrive policy moves them to the
+        dead-letter queue. Redelivered messages are deleted unprocessed.
+        """
+        futures = {}
+        deliveries = {}
+        examined = []
+        try:
+            for message in messages:
+                examined.append(message)
+                self._submit_message(message, futures, deliveries)
+        finally:
+            # even if a message raised unexpectedly, the messages before it
+            # are still recorded and deleted or deferred
+            self._finish_messages(examined, futures, deliveries)
+
+    def _submit_message(self, message, futures, deliveries):
+        """Decodes a message and submits it to the executor, unless it is
+        malformed, filtered out or a duplicate."""
+        body = message.body
+        logging.debug(
+            "Queue {} received message: {}".format(
+                self.sqs_queue.url, body))
+        try:
+            decoded_full_body = loads(body)
+            event_type = decoded_full_body["MessageAttributes"]["X-Github-Event"]["Value"]
+            decoded_body = decode_payload(
+                event_type, decoded_full_body["Message"], self.event_filter)
+        except (KeyError, TypeError, ValueError):
+            logging.error("Queue {} received malformed message: {}".format(
+                self.sqs_queue.url, body))
+            return
+        if decoded_body is None:
+            metrics.filtered_messages.inc(repository=self._metrics_label)
+            return
+        key = delivery_id(decoded_full_body)
+        if self.deduplicator.seen(key) or (
+                key is not None and key in deliveries.values()):
+            metrics.duplicate_deliveries.inc(repository=self._metrics_label)
+            return
+        deliveries[message] = key
+        futures[message] = self.executor.submit(
+            issue_url(decoded_body), self._dispatch, event_type, decoded_body)
+
+    def _finish_messages(self, messages, futures, deliveries):
+        """Waits for the callbacks of a batch, then records the deliveries
+        which succeeded, deletes the messages which needn't be retried and
+        defers the rest."""
+        concurrent.futures.wait(list(futures.values()))
+        for message, future in futures.items():
+            if future.result() is None:
+                self.deduplicator.record(deliveries[message])
+        deferred = [(message, self._retry_delay(message, future.result()))
+                    for message, future in futures.items()
+                    if future.result() is not None]
+        deferred_messages = {message for message, _ in deferred}
+        self._delete_messages([m for m in messages if m not in deferred_messages])
+        self._defer_messages(deferred)
+
+    def _retry_delay(self, message, error):
+        """Returns how many seconds to wait before retrying a failed message."""
+        if isinstance(error, RateLimitExceeded):
+            return error.retry_after
+        receive_count = int(message.attributes.get("ApproximateReceiveCount", 1))
+        return SQS_RETRY_BACKOFF * 2 ** min(receive_count - 1, 16)
+
+    @property
+    def _metrics_label(self):
+        return getattr(self, "repository_name", self.sqs_queue.url)
+
+    def _delete_messages(self, messages):
+        """Deletes messages from the queue in batches."""
+        failed = self._batch_request(
+            self.sqs_queue.delete_messages, "delete",
+            [{"ReceiptHandle": message.receipt_handle} for message in messages])
+        metrics.messages_deleted.inc(len(messages) - failed, repository=self._metrics_label)
+
+    def _defer_messages(self, deferred):
+        """Leaves messages on the queue, hidden until they should be retried.
+
+        Args:
+            deferred (list<(boto3.SQS.Message, float)>): messages and the
+                number of seconds to hide them for
+        """
+        metrics.messages_deferred.inc(len(deferred), repository=self._metrics_label)
+        self._batch_request(
+            self.sqs_queue.change_message_visibility_batch, "defer",
+            [{"ReceiptHandle": message.receipt_handle,
+              "VisibilityTimeout": min(int(math.ceil(delay)), SQS_MAX_VISIBILITY_TIMEOUT)}
+             for message, delay in deferred])
+
+    def _batch_request(self, action, description, entries):
+        """Sends entries to a SQS batch action, SQS_BATCH_SIZE at a time.
+
+        Entries which fail for reasons other than a malformed request are
+        retried once; anything still failing is logged, and the message will
+        be received again after its visibility timeout.
+
+        Returns: number of entries which failed (int)
+        """
+        failures = 0
+        for start in range(0, len(entries), SQS_BATCH_SIZE):
+            batch = [dict(entry, Id=str(i))
+                     for i, entry in enumerate(entries[start:start + SQS_BATCH_SIZE])]
+            errors = []
+            for attempt in range(2):
+                response = action(Entries=batch)
+                failed = response.get("Failed", [])
+                errors.extend(f for f in failed if f.get("SenderFault"))
+                retry_ids = {f["Id"] for f in failed if not f.get("SenderFault")}
+                batch = [entry for entry in batch if entry["Id"] in retry_ids]
+                if not batch:
+                    break
+            else:
+                errors.extend(f for f in failed if not f.get("SenderFault"))
+            for failure in errors:
+                logging.error(
+                    "Queue {} failed to {} message: {} {}".format(
+                        self.sqs_queue.url, description,
+                        failure.get("Code"), failure.get("Message")))
+            failures += len(errors)
+        return failures
+
+    def _dispatch(self, event_type, decoded_body):
+        """Hands a decoded webhook event to the callbacks that should see it.
+
+        Returns: the exception raised by a callback if it failed,
+            otherwise None
+        """
+        for callback in self.route(event_type, decoded_body) or ():
+            try:
+                callback(event_type, decoded_body)
+            except RateLimitExceeded as e:
+                logging.warning(
+                    "Queue {} deferring message for {:.0f}s: {}".format(
+                        self.sqs_queue.url, e.retry_after, str(e)))
+                return e
+            except Exception as e:
+                logging.error(
+                    "Queue {} encountered exception {} while "
+                    "processing message {}: {}".format(
+                        self.sqs_queue.url, e.__class__.__name__,
+                        pprint.pformat(decoded_body), str(e)
+                    ))
+                return e
+        return None
+
+
+class RepositoryListener(QueueListener):
     """Sets up infrastructure for listening to a Github repository."""
 
     def __init__(self, repository_name,
                  github_username, github_token,
                  aws_key, aws_secret, aws_region,
-                 events, callbacks=None, **kwargs):
+                 events, callbacks=None, executor=None,
+                 callback_workers=CALLBACK_WORKERS,
+                 max_receive_count=MAX_RECEIVE_COUNT, dedup_store=None,
+                 event_filter=None, connect_github=True, **kwargs):
         """Instantiates a RepositoryListener.
         Additionally:
-         * Creates or connects to a AWS SQS queue named for the repository
+         * Creates or connects to a AWS SQS queue named for the repository,
+           and a dead-letter queue for messages which repeatedly fail
          * Creates or connects to a AWS SNS topic named for the repository
          * Connects the AWS SNS topic to the AWS SQS queue
          * Configures the Github repository to push hooks to the SNS topic
@@ -45,6 +278,20 @@ class RepositoryListener(object):
                 functions to call with a decoded Github JSON payload when a
                 webhook event lands. You can register these after instantiation
                 with register_callback.
+            executor (ShardedExecutor): executor to run callbacks on; see
+                QueueListener
+            callback_workers (int): if no executor is given, the number of
+                threads to run callbacks on
+            max_receive_count (int): times a message may be received before
+                it is moved to the dead-letter queue; 0 disables the
+                dead-letter queue
+            dedup_store (str): path of a SQLite database in which to remember
+                processed deliveries across restarts, or None to remember
+                them only in memory
+            event_filter (function(str, str)): see QueueListener
+            connect_github (bool): whether to configure the repository's
+                hook; if False, the caller registers it, for example with
+                connect_repositories, using the ARN of sns_topic
         """
         self.repository_name = repository_name
         self.github_username = github_username
@@ -55,65 +302,23 @@ class RepositoryListener(object):
 
         # create or reuse sqs queue
         sqs_resource = boto3.resource("sqs", region_name=self.aws_region)
-        self.sqs_queue = sqs_resource.create_queue(
-            QueueName="snooze__{}".format(self._to_topic(repository_name))
-        )
-
-        # create or reuse sns topic
-        sns_resource = boto3.resource("sns", region_name=self.aws_region)
-        sns_topic = sns_resource.create_topic(
-            Name=self._to_topic(repository_name)
-        )
-        sns_topic.subscribe(
-            Protocol='sqs',
-            Endpoint=self.sqs_queue.attributes["QueueArn"]
-        )
-
-        # configure repository to push to the sns topic
-        connect_github_to_sns(aws_key, aws_secret, aws_region,
-                              github_username, github_token, repository_name,
-                              sns_topic.arn, events)
+        super(RepositoryListener, self).__init__(create_queue(
+            sqs_resource, "snooze__{}".format(self._to_topic(repository_name)),
+            int(max_receive_count)
+        ), self._route, executor, callback_workers, make_deduplicator(dedup_store), event_filter)
+
+        self.sns_topic = subscribe_queue_to_repository(
+            self.sqs_queue, repository_name,
+            github_username, github_token,
+            aws_key, aws_secret, aws_region, events, connect_github)
 
         # register callbacks
         self._callbacks = []
         if callbacks:
             [self.register_callback(f) for f in callbacks]
 
-    def poll(self, wait=True):
-        """Checks for messages from the Github repository.
-
-        Args:
-            wait (bool): Use SQS long polling, i.e. wait up to 20 seconds for a
-                message to be received before returning an empty list.
-
-        Returns: None
-        """
-        messages = self.sqs_queue.receive_messages(WaitTimeSeconds=20*wait)
-        for message in messages:
-            body = message.body
-            logging.debug(
-                "Queue {} received message: {}".format(
-                    self.sqs_queue.url, body))
-            try:
-                decoded_full_body = json.loads(body)
-                decoded_body = json.loads(decoded_full_body["Message"])
-                event_type = decoded_full_body["MessageAttributes"]["X-Github-Event"]["Value"]
-            except ValueError:
-                logging.error("Queue {} received non-JSON message: {}".format(
-                    self.sqs_queue.url, body))
-            else:
-                for callback in self._callbacks:
-                    try:
-                        callback(event_type, decoded_body)
-                    except Exception as e:
-                        logging.error(
-                            "Queue {} encountered exception {} while "
-                            "processing message {}: {}".format(
-                                self.sqs_queue.url, e.__class__.__name__,
-                                pprint.pformat(decoded_body), str(e)
-                            ))
-            finally:
-                message.delete()
+    def _route(self, event_type, decoded_body):
+        return self._callbacks
 
     def _to_topic(self, repository_name):
         """Converts a repository_name to a valid SNS topic name.
@@ -123,7 +328,7 @@ class RepositoryListener(object):
 
         Returns: str
         """
-        return repository_name.replace("/", "__")
+        return to_topic(repository_name)
 
     def register_callback(self, callback):
         """Registers a callback on a webhook received event.
@@ -139,11 +344,237 @@ class RepositoryListener(object):
         self._callbacks.append(callback)
 
 
+class SharedQueueListener(QueueListener):
+    """Listens to many Github repositories through one shared SQS queue.
+
+    Each repository keeps its own SNS topic, but every topic is subscribed to
+    the same queue, so a single poller can service a whole organization.
+    Events are routed to the callbacks registered for the repository named in
+    the webhook payload.
+    """
+
+    def __init__(self, queue_name, aws_region, executor=None,
+                 callback_workers=CALLBACK_WORKERS,
+                 max_receive_count=MAX_RECEIVE_COUNT, dedup_store=None,
+                 event_filter=None):
+        """Instantiates a SharedQueueListener and creates or connects to an
+        AWS SQS queue named "snooze__<queue_name>".
+
+        Args:
+            queue_name (str): name shared by the repositories using the queue
+            aws_region (str): AWS region (e.g. 'us-west-2')
+            executor (ShardedExecutor): executor to run callbacks on; see
+                QueueListener
+            callback_workers (int): if no executor is given, the number of
+                threads to run callbacks on
+            max_receive_count (int): see RepositoryListener
+            dedup_store (str): see RepositoryListener
+            event_filter (function(str, str)): see QueueListener
+        """
+        self.repository_name = queue_name
+        self.aws_region = aws_region
+        sqs_resource = boto3.resource("sqs", region_name=aws_region)
+        super(SharedQueueListener, self).__init__(create_queue(
+            sqs_resource, "snooze__{}".format(queue_name), int(max_receive_count)
+        ), self._route, executor, callback_workers, make_deduplicator(dedup_store), event_filter)
+        self._routes = {}
+
+    def add_repository(self, repository_name,
+                       github_username, github_token,
+                       aws_key, aws_secret, aws_region,
+                       events, callbacks=None, connect_github=True, **kwargs):
+        """Connects a Github repository to the shared queue.
+
+        Takes the same arguments as RepositoryListener. The repository's SNS
+        topic is created in its own aws_region.
+
+        Returns: boto3.SNS.Topic
+        """
+        sns_topic = subscribe_queue_to_repository(
+            self.sqs_queue, repository_name,
+            github_username, github_token,
+            aws_key, aws_secret, aws_region, events, connect_github)
+        self._routes.setdefault(repository_name.lower(), [])
+        if callbacks:
+            [self.register_callback(repository_name, f) for f in callbacks]
+        return sns_topic
+
+    def register_callback(self, repository_name, callback):
+        """Registers a callback for webhook events from one repository.
+
+        Args:
+            repository_name (str): name of a Github repository
+            callback (function(str, Object)): as for
+                RepositoryListener.register_callback
+        """
+        self._routes.setdefault(repository_name.lower(), []).append(callback)
+
+    def _route(self, event_type, decoded_body):
+        repository_name = (decoded_body.get("repository") or {}).get("full_name")
+        callbacks = self._routes.get((repository_name or "").lower())
+        if callbacks is None:
+            logging.warning(
+                "Queue {} received {} event for unconfigured repository {}".format(
+                    self.sqs_queue.url, event_type, repository_name))
+        return callbacks
+
+
+def create_queue(sqs_resource, queue_name, max_receive_count):
+    """Creates or connects to a SQS queue and its dead-letter queue.
+
+    Messages received more than max_receive_count times are moved to a queue
+    named "<queue_name>__dead", where they are kept for 14 days.
+
+    Args:
+        sqs_resource (boto3.SQS.ServiceResource): SQS resource for the region
+        queue_name (str): name of the queue
+        max_receive_count (int): receives before a message is dead-lettered;
+            0 creates no dead-letter queue
+
+    Returns: boto3.SQS.Queue
+    """
+    sqs_queue = sqs_resource.create_queue(QueueName=queue_name)
+    if max_receive_count:
+        dead_letter_queue = sqs_resource.create_queue(
+            QueueName="{}__dead".format(queue_name),
+            Attributes={"MessageRetentionPeriod": str(DEAD_LETTER_RETENTION)})
+        sqs_queue.set_attributes(Attributes={"RedrivePolicy": json.dumps({
+            "deadLetterTargetArn": dead_letter_queue.attributes["QueueArn"],
+            "maxReceiveCount": str(max_receive_count),
+        })})
+    return sqs_queue
+
+
+def to_topic(repository_name):
+    """Converts a repository_name to a valid SNS topic name.
+
+    Args:
+        repository_name: Name of a Github repository
+
+    Returns: str
+    """
+    return repository_name.replace("/", "__")
+
+
+def subscribe_queue_to_repository(sqs_queue, repository_name,
+                                  github_username, github_token,
+                                  aws_key, aws_secret, aws_region, events,
+                                  connect_github=True):
+    """Routes webhook events from a Github repository to a SQS queue.
+
+    Creates or connects to a AWS SNS topic named for the repository, subscribes
+    the queue to it and, unless connect_github is False, configures the
+    repository to push hooks to the topic. The subscription only delivers the
+    given events; see filter_subscription.
+
+    Returns: boto3.SNS.Topic
+    """
+    sns_resource = boto3.resource("sns", region_name=aws_region)
+    sns_topic = sns_resource.create_topic(
+        Name=to_topic(repository_name)
+    )
+    subscription = sns_topic.subscribe(
+        Protocol='sqs',
+        Endpoint=sqs_queue.attributes["QueueArn"]
+    )
+    filter_subscription(subscription, events)
+
+    # configure repository to push to the sns topic
+    if connect_github:
+        connect_github_to_sns(aws_key, aws_secret, aws_region,
+                              github_username, github_token, repository_name,
+                              sns_topic.arn, events)
+    return sns_topic
+
+
+def filter_subscription(subscription, events):
+    """Sets a SNS subscription to deliver only the given Github events.
+
+    The filter policy matches the X-Github-Event message attribute, so events
+    which a repository's hooks send but which aren't configured (for example,
+    from a hook created with a longer event list) never reach the queue or
+    Lambda function. Actions are not message attributes, so they can't be
+    filtered this way.
+
+    Args:
+        subscription (boto3.SNS.Subscription): subscription to a repository's
+            SNS topic
+        events (list<str> | str): Github webhook events to deliver
+    """
+    subscription.set_attributes(
+        AttributeName="FilterPolicy",
+        AttributeValue=subscription_filter_policy(events))
+
+
+def subscription_filter_policy(events):
+    """Returns the SNS FilterPolicy which filter_subscription sets.
+
+    Args:
+        events (list<str> | str): Github webhook events to deliver
+
+    Returns: str
+    """
+    if isinstance(events, basestring):
+        events = [events]
+    return json.dumps({"X-Github-Event": sorted(events)})
+
+
+def list_hooks(github, repository_name):
+    """Lists every hook of a Github repository.
+
+    Each page of the listing is remembered in hook_pages with its ETag and
+    requested conditionally afterwards, so an unchanged page costs a 304
+    response, which doesn't count against the rate limit.
+
+    Args:
+        github (GithubClient): Github client with admin access to the repository
+        repository_name (str): name of a Github repository
+
+    Returns: list<dict>
+    """
+    url = "{}/repos/{}/hooks?per_page=100".format(github.api_url, repository_name)
+    hooks = []
+    while url:
+        key = (github.github_username, url)
+        cached = hook_pages.get(key)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        r = github.get(url, headers=headers)
+        if cached and r.status_code == 304:
+            page, next_url = cached[1], cached[2]
+        else:
+            r.raise_for_status()
+            page = r.json()
+            next_url = r.links.get("next", {}).get("url")
+            if r.headers.get("ETag"):
+                hook_pages.set(key, (r.headers["ETag"], page, next_url))
+        hooks.extend(page)
+        url = next_url
+    return hooks
+
+
+def _hook_is_current(hook, config, events):
+    """Returns whether an existing hook already has the given settings.
+
+    Github doesn't return secrets, so a hook whose AWS key matches is
+    assumed to have the matching secret too.
+    """
+    hook_config = hook.get("config") or {}
+    return (hook.get("active", True) and
+            set(hook.get("events") or []) == set(events) and
+            all(hook_config.get(name) == config[name]
+                for name in ("aws_key", "sns_topic", "sns_region")))
+
+
 def connect_github_to_sns(aws_key, aws_secret, aws_region,
                           github_username, github_token, repository_name,
                           sns_topic_arn, events, **_):
     """Connects a Github repository to a SNS topic.
 
+    Reuses the repository's existing hook for the topic, updating it in place
+    if its settings differ, and deletes any further hooks for the same
+    topic, which would deliver every event more than once. A hook is only
+    created if the repository has none for the topic.
+
     Args:
         sns_topic_arn: ARN of an existing SNS topic
         events (list<str> | str): Github webhook events to monitor for
@@ -151,22 +582,64 @@ def connect_github_to_sns(aws_key, aws_secret, aws_region,
 
     Returns: None
     """
-    auth = requests.auth.HTTPBasicAuth(github_username, github_token)
+    github = get_client((github_username, github_token))
     if isinstance(events, basestring):
         events = [events]
-    payload = {
-        "name": "amazonsns",
-        "config": {
-            "aws_key": aws_key,
-            "aws_secret": aws_secret,
-            "sns_topic": sns_topic_arn,
-            "sns_region": aws_region,
-        },
-        "events": events,
+    config = {
+        "aws_key": aws_key,
+        "aws_secret": aws_secret,
+        "sns_topic": sns_topic_arn,
+        "sns_region": aws_region,
     }
-    r = requests.post(
-        "https://api.github.com/repos/{}/hooks".format(repository_name),
-        data=json.dumps(payload),
-        headers=GITHUB_HEADERS,
-        auth=auth)
+    url = "{}/repos/{}/hooks".format(github.api_url, repository_name)
+    hooks = [hook for hook in list_hooks(github, repository_name)
+             if hook.get("name") == "amazonsns" and
+             (hook.get("config") or {}).get("sns_topic") == sns_topic_arn]
+
+    for duplicate in hooks[1:]:
+        logging.info("Deleting duplicate hook {} of {}".format(duplicate["id"], repository_name))
+        r = github.delete("{}/{}".format(url, duplicate["id"]))
+        if r.status_code != 404:
+            r.raise_for_status()
+
+    payload = {"config": config, "events": events, "active": True}
+    if not hooks:
+        payload["name"] = "amazonsns"
+        r = github.post(url, data=json.dumps(payload))
+    elif _hook_is_current(hooks[0], config, events):
+        logging.debug("Hook {} of {} is up to date".format(hooks[0]["id"], repository_name))
+        return
+    else:
+        r = github.patch("{}/{}".format(url, hooks[0]["id"]), data=json.dumps(payload))
     r.raise_for_status()
+
+
+def connect_repositories(repositories, workers=HOOK_WORKERS):
+    """Connects several Github repositories to their SNS topics at once.
+
+    Every repository is attempted even if some fail.
+
+    Args:
+        repositories (list<dict>): keyword arguments for connect_github_to_sns,
+            one dict per repository
+        workers (int): the most repositories to connect at once
+
+    Raises: the first exception raised connecting a repository, once every
+        repository has been attempted
+    """
+    if not repositories:
+        return
+    pool = concurrent.futures.ThreadPoolExecutor(max(1, min(workers, len(repositories))))
+    try:
+        futures = [pool.submit(connect_github_to_sns, **repository)
+                   for repository in repositories]
+        errors = [future.exception() for future in futures]
+    finally:
+        pool.shutdown()
+    for repository, error in zip(repositories, errors):
+        if error is not None:
+            logging.error("Could not connect {} to SNS: {}".format(
+                repository["repository_name"], error))
+    for error in errors:
+        if error is not None:
+            raise error
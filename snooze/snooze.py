@@ -6,48 +6,167 @@ import sys
 import threading
 import time
 
-from snooze.callbacks import github_callback
+import snooze.metrics as metrics
+from snooze.callbacks import github_callback, membership_cache, wants_event
 from snooze.config import parse_config
-from snooze.constants import LISTEN_EVENTS
-from snooze.repository_listener import RepositoryListener
+from snooze.constants import ASYNC_CONCURRENCY, SHARED_CALLBACK_WORKERS, SHARED_EXECUTOR_THRESHOLD
+from snooze.executor import ShardedExecutor
+from snooze.github import get_client
+from snooze.repository_listener import RepositoryListener, SharedQueueListener, connect_repositories
 
 logging.basicConfig(level=logging.DEBUG)
 
 
 def poll_forever(repo_listener, wait):
     while True:
-        repo_listener.poll()
+        repo_listener.poll(drain=True)
         logging.debug("Waiting {}s before polling {}".
                       format(wait, repo_listener.repository_name))
         time.sleep(wait)
 
 
+def make_callback(github, snooze_label, ignore_members_of, coalesce_window):
+    return lambda event, message: github_callback(event, message, github,
+                                                  snooze_label, ignore_members_of,
+                                                  coalesce_window)
+
+
+def shared_executor(config, workers=None, asyncio=False, concurrency=ASYNC_CONCURRENCY):
+    """Returns the executor every listener should share, or None to give
+    each listener its own callback_workers threads.
+
+    The executor is shared if workers is set, in asyncio mode, where it has
+    as many threads as polls may be in flight, and when there are more than
+    SHARED_EXECUTOR_THRESHOLD repositories, so that the number of threads
+    doesn't grow with the number of repositories.
+
+    Args:
+        config (dict): configuration dictionary from parse_config
+        workers (int): size of the shared executor, or None
+        asyncio (bool): whether the queues are polled from an event loop
+        concurrency (int): the most polls in flight at once in asyncio mode
+
+    Returns: ShardedExecutor or None
+    """
+    if workers:
+        return ShardedExecutor(workers)
+    if asyncio:
+        return ShardedExecutor(concurrency)
+    if len(config) > SHARED_EXECUTOR_THRESHOLD:
+        return ShardedExecutor(SHARED_CALLBACK_WORKERS)
+    return None
+
+
+def build_pollers(config, executor=None):
+    """Creates a listener for each repository, or each shared queue.
+
+    The repositories' Github hooks are registered concurrently once every
+    listener has been created.
+
+    Args:
+        config (dict): configuration dictionary from parse_config
+        executor (ShardedExecutor): executor shared by every listener, or
+            None to give each listener its own
+
+    Returns: list<(QueueListener, float poll_interval)>
+    """
+    pollers = []
+    shared_listeners = {}
+    hooks = []
+    prewarmed = set()
+    for name, repo in config.items():
+        # repositories sharing credentials share one pooled Github client
+        github = get_client((repo["github_username"], repo["github_token"]))
+        organization = repo["ignore_members_of"]
+        if organization and repo["prewarm_membership"] and organization not in prewarmed:
+            membership_cache.prewarm(github, organization)
+            prewarmed.add(organization)
+        callback = make_callback(github, repo["snooze_label"], repo["ignore_members_of"],
+                                 float(repo["coalesce_window"]))
+        poll_interval = float(repo["poll_interval"])
+        if repo["shared_queue"]:
+            key = (repo["shared_queue"], repo["aws_region"])
+            if key not in shared_listeners:
+                shared_listeners[key] = [
+                    SharedQueueListener(*key, executor=executor,
+                                        callback_workers=repo["callback_workers"],
+                                        max_receive_count=repo["max_receive_count"],
+                                        dedup_store=repo["dedup_store"],
+                                        event_filter=wants_event),
+                    poll_interval]
+            sns_topic = shared_listeners[key][0].add_repository(
+                callbacks=[callback],
+                events=repo["listen_events"],
+                connect_github=False,
+                **repo)
+            shared_listeners[key][1] = min(shared_listeners[key][1], poll_interval)
+        else:
+            listener = RepositoryListener(
+                callbacks=[callback],
+                events=repo["listen_events"],
+                executor=executor,
+                event_filter=wants_event,
+                connect_github=False,
+                **repo)
+            sns_topic = listener.sns_topic
+            pollers.append((listener, poll_interval))
+        hooks.append(dict(repo, sns_topic_arn=sns_topic.arn, events=repo["listen_events"]))
+    pollers.extend(tuple(poller) for poller in shared_listeners.values())
+    connect_repositories(hooks)
+    return pollers
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("config")
+    parser.add_argument(
+        "--asyncio", action="store_true",
+        help="poll every repository from a single asyncio event loop "
+             "instead of one thread per repository (Python 3 only)")
+    parser.add_argument(
+        "--concurrency", type=int, default=ASYNC_CONCURRENCY,
+        help="with --asyncio, the most queues to poll at once (default: %(default)s)")
+    parser.add_argument(
+        "--workers", type=int,
+        help="handle events for all repositories on one pool of this many threads, "
+             "instead of callback_workers threads per repository (default: --concurrency "
+             "with --asyncio, {} with more than {} repositories)".format(
+                 SHARED_CALLBACK_WORKERS, SHARED_EXECUTOR_THRESHOLD))
+    parser.add_argument(
+        "--metrics-port", type=int,
+        help="serve Prometheus metrics at http://ADDRESS:PORT/metrics")
+    parser.add_argument(
+        "--metrics-address", default=metrics.DEFAULT_ADDRESS,
+        help="address to serve metrics on; \"\" for all addresses (default: %(default)s)")
     args = parser.parse_args()
+    if args.asyncio and sys.version_info < (3, 5):
+        logging.error("--asyncio requires Python 3.5 or later")
+        return False
 
     config = parse_config(args.config)
-    for name, repo in config.items():
-        github_auth = (repo["github_username"], repo["github_password"])
-        snooze_label = repo["snooze_label"]
-        ignore_members_of = repo["ignore_members_of"]
-        callback = lambda event, message: github_callback(event, message, github_auth,
-                                                          snooze_label, ignore_members_of)
-        listener = RepositoryListener(
-            callbacks=[callback],
-            events=LISTEN_EVENTS,
-            **repo)
-        t = threading.Thread(target=poll_forever, args=(listener, repo["poll_interval"]))
+    if args.metrics_port:
+        metrics.start_http_server(args.metrics_port, args.metrics_address)
+    executor = shared_executor(config, args.workers, args.asyncio, args.concurrency)
+    pollers = build_pollers(config, executor)
+
+    if args.asyncio:
+        from snooze.async_runner import run_pollers
+        return run_pollers(pollers, args.concurrency)
+
+    threads = []
+    for listener, poll_interval in pollers:
+        t = threading.Thread(target=poll_forever, args=(listener, poll_interval))
         t.daemon = True
         t.start()
+        threads.append(t)
     while True:
         # wait forever for a signal or an unusual termination
-        if threading.active_count() < len(config) + 1:
+        if not all(t.is_alive() for t in threads):
             logging.error("Child polling thread quit!")
             return False
         time.sleep(1)
     return True
 
+
 if __name__ == "__main__":
     sys.exit(not main())
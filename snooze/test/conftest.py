@@ -0,0 +1,25 @@
+import pytest
+
+import snooze.callbacks
+import snooze.github
+import snooze.metrics
+import snooze.repository_listener
+
+
+@pytest.fixture(autouse=True)
+def reset_shared_state():
+    """Keeps caches shared between repositories from leaking between tests."""
+    snooze.callbacks.membership_cache.clear()
+    snooze.callbacks.stats.clear()
+    snooze.callbacks.cleared_issues.clear()
+    snooze.callbacks.label_state.clear()
+    snooze.metrics.registry.clear()
+    snooze.repository_listener.hook_pages.clear()
+    # clients share a rate limiter per user, whose state earlier tests set
+    snooze.github._clients.clear()
+    snooze.github._rate_limiters.clear()
+    yield
+    snooze.callbacks.membership_cache.clear()
+    snooze.callbacks.stats.clear()
+    snooze.callbacks.cleared_issues.clear()
+    snooze.callbacks.label_state.clear()
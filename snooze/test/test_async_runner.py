@@ -0,0 +1,75 @@
+import sys
+import threading
+import time
+
+import pytest
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 5), reason="requires asyncio")
+
+
+class FakeListener(object):
+    def __init__(self, repository_name, fail_after=None, busy=False):
+        self.repository_name = repository_name
+        self.fail_after = fail_after
+        self.busy = busy
+        self.polls = []
+        self.times = []
+        self.threads = set()
+
+    def poll(self, wait=True, drain=False):
+        self.polls.append((wait, drain))
+        self.times.append(time.time())
+        self.threads.add(threading.current_thread().name)
+        if self.fail_after is not None and len(self.polls) >= self.fail_after:
+            raise RuntimeError("SQS is down")
+        if self.busy:
+            # a queue which never comes back empty would drain forever
+            if drain:
+                time.sleep(5)
+            return 10
+        return 0
+
+
+class TestRunPollers(object):
+    def test_polls_until_failure(self):
+        from snooze.async_runner import run_pollers
+        healthy = [FakeListener("tdsmith/repo{}".format(i)) for i in range(20)]
+        broken = FakeListener("tdsmith/broken", fail_after=3)
+        before = threading.active_count()
+        assert run_pollers([(l, 0) for l in healthy] + [(broken, 0)], concurrency=4,
+                           idle_backoff=0.01) is False
+        assert len(broken.polls) == 3
+        assert all(l.polls for l in healthy)
+        # more repositories than slots: short polls, and no more threads than slots
+        assert broken.polls[0] == (False, False)
+        assert len(set.union(*[l.threads for l in healthy + [broken]])) <= 4
+        assert threading.active_count() <= before + 4
+
+    def test_long_polls_with_enough_slots(self):
+        from snooze.async_runner import run_pollers
+        broken = FakeListener("tdsmith/broken", fail_after=1)
+        run_pollers([(broken, 0)], concurrency=4)
+        assert broken.polls == [(True, True)]
+
+    def test_busy_queues_rotate(self):
+        from snooze.async_runner import run_pollers
+        busy = [FakeListener("tdsmith/busy{}".format(i), busy=True) for i in range(2)]
+        broken = FakeListener("tdsmith/broken", fail_after=1)
+        start = time.time()
+        run_pollers([(l, 0) for l in busy] + [(broken, 0)], concurrency=2)
+        assert broken.polls == [(False, False)]
+        assert time.time() - start < 5
+
+    def test_idle_queues_back_off(self):
+        from snooze.async_runner import idle_delay, run_pollers
+        broken = FakeListener("tdsmith/broken", fail_after=3)
+        run_pollers([(broken, 0), (FakeListener("tdsmith/idle"), 0)], concurrency=1,
+                    idle_backoff=0.05)
+        gaps = [b - a for a, b in zip(broken.times, broken.times[1:])]
+        assert gaps[0] >= 0.05 and gaps[1] >= 0.1
+
+        delays = [0]
+        for _ in range(7):
+            delays.append(idle_delay(delays[-1], 1, 20))
+        assert delays == [0, 1, 2, 4, 8, 16, 20, 20]
+        assert idle_delay(0, 1, 20) == 1
@@ -0,0 +1,59 @@
+import pytest
+import responses
+
+import snooze.cache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache(object):
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    def test_expiry(self, clock):
+        cache = snooze.cache.TTLCache(maxsize=10, ttl=60, clock=clock)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=5)
+        clock.now += 10
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_lru_eviction(self, clock):
+        cache = snooze.cache.TTLCache(maxsize=2, ttl=60, clock=clock)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert len(cache) == 2
+
+
+class TestMembershipCache(object):
+    @responses.activate
+    def test_prewarm(self):
+        page1 = "https://api.github.com/orgs/fellowship/members?per_page=100"
+        page2 = "https://api.github.com/orgs/fellowship/members?per_page=100&page=2"
+        responses.add(responses.GET, page1, json=[{"login": "frodo"}, {"login": "sam"}],
+                      headers={"Link": '<{}>; rel="next"'.format(page2)}, match_querystring=True)
+        responses.add(responses.GET, page2, json=[{"login": "pippin"}], match_querystring=True)
+        cache = snooze.cache.MembershipCache()
+        assert cache.prewarm(("frodo", "baggins"), "fellowship") == 3
+        assert cache.lookup("fellowship", "Pippin") is True
+        assert cache.lookup("fellowship", "sauron") is None
+
+    def test_negative_ttl(self):
+        cache = snooze.cache.MembershipCache(ttl=60, negative_ttl=0)
+        cache.store("fellowship", "frodo", True)
+        cache.store("fellowship", "sauron", False)
+        assert cache.lookup("fellowship", "frodo") is True
+        assert cache.lookup("fellowship", "sauron") is None
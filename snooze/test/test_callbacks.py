@@ -1,4 +1,5 @@
 import json
+import time
 from textwrap import dedent
 
 import pytest
@@ -26,13 +27,22 @@ class TestGithubWebhookCallback(object):
             """))
         return snooze.parse_config(str(config))["baxterthehacker/public-repo"]
 
+    def snooze_again(self, config, url):
+        r = snooze.github_callback(
+            "issues",
+            {"action": "labeled", "issue": {"url": url, "labels": [{"name": "snooze"}]}},
+            (config["github_username"], config["github_token"]),
+            config["snooze_label"],
+            config["ignore_members_of"])
+        assert r is False
+
     @responses.activate
     def test_issue_comment_callback(self, config):
         """Test that a snooze label is removed from issues when a new comment
         is received."""
         responses.add(
-            responses.PATCH,
-            "https://api.github.com/repos/baxterthehacker/public-repo/issues/2")
+            responses.DELETE,
+            "https://api.github.com/repos/baxterthehacker/public-repo/issues/2/labels/snooze")
         r = snooze.github_callback(
             "issue_comment",
             json.loads(github_responses.SNOOZED_ISSUE_COMMENT),
@@ -41,6 +51,7 @@ class TestGithubWebhookCallback(object):
             config["ignore_members_of"])
         assert r is True
         assert len(responses.calls) == 1
+        self.snooze_again(config, "https://api.github.com/repos/baxterthehacker/public-repo/issues/2")
 
         org_url = "https://api.github.com/orgs/fellowship/members/baxterthehacker"
         responses.add(responses.GET, org_url, status=204)  # is a member
@@ -79,12 +90,8 @@ class TestGithubWebhookCallback(object):
         """Test that a snooze label is removed from PRs when a new commit is
         pushed."""
         responses.add(
-            responses.PATCH,
-            "https://api.github.com/repos/octocat/Hello-World/issues/1347")
-        responses.add(
-            responses.GET,
-            "https://api.github.com/repos/baxterthehacker/public-repo/issues/1",
-            body=github_responses.SNOOZED_ISSUE_GET)
+            responses.DELETE,
+            "https://api.github.com/repos/baxterthehacker/public-repo/issues/1/labels/snooze")
         r = snooze.github_callback(
             "pull_request",
             json.loads(github_responses.PULL_REQUEST),
@@ -92,16 +99,18 @@ class TestGithubWebhookCallback(object):
             config["snooze_label"],
             config["ignore_members_of"])
         assert r is True
-        assert len(responses.calls) == 2
+        assert len(responses.calls) == 1
+        # without labels in the payload, the label is removed blindly
+        assert snooze.callbacks.stats["pr_issue_fetches_avoided"] == 0
 
     @responses.activate
     def test_pr_synchronize_callback_not_snoozed(self, config):
         """Test that a snooze label is not removed from PRs when a new commit is
         pushed but there is no snooze label."""
         responses.add(
-            responses.GET,
-            "https://api.github.com/repos/baxterthehacker/public-repo/issues/1",
-            body=github_responses.UNSNOOZED_ISSUE_GET)
+            responses.DELETE,
+            "https://api.github.com/repos/baxterthehacker/public-repo/issues/1/labels/snooze",
+            status=404)
         r = snooze.github_callback(
             "pull_request",
             json.loads(github_responses.PULL_REQUEST),
@@ -111,17 +120,42 @@ class TestGithubWebhookCallback(object):
         assert r is False
         assert len(responses.calls) == 1
 
+    @responses.activate
+    def test_pr_synchronize_callback_payload_labels(self, config):
+        """Test that labels carried in the PR payload save a request for
+        PRs which are not snoozed."""
+        responses.add(
+            responses.DELETE,
+            "https://api.github.com/repos/baxterthehacker/public-repo/issues/1/labels/snooze")
+        message = json.loads(github_responses.PULL_REQUEST)
+        message["pull_request"]["labels"] = [{"name": "snooze"}, {"name": "bug"}]
+        r = snooze.github_callback(
+            "pull_request",
+            message,
+            (config["github_username"], config["github_token"]),
+            config["snooze_label"],
+            config["ignore_members_of"])
+        assert r is True
+        assert len(responses.calls) == 1
+        assert snooze.callbacks.stats["pr_issue_fetches_avoided"] == 1
+
+        message["pull_request"]["labels"] = []
+        r = snooze.github_callback(
+            "pull_request",
+            message,
+            (config["github_username"], config["github_token"]),
+            config["snooze_label"],
+            config["ignore_members_of"])
+        assert r is False
+        assert len(responses.calls) == 1
+
     @responses.activate
     def test_pr_commit_comment_callback(self, config):
         """Test that a snooze label is removed from PRs when a new commit is
         pushed."""
         responses.add(
-            responses.PATCH,
-            "https://api.github.com/repos/octocat/Hello-World/issues/1347")
-        responses.add(
-            responses.GET,
-            "https://api.github.com/repos/baxterthehacker/public-repo/issues/1",
-            body=github_responses.SNOOZED_ISSUE_GET)
+            responses.DELETE,
+            "https://api.github.com/repos/baxterthehacker/public-repo/issues/1/labels/snooze")
         r = snooze.github_callback(
             "pull_request_review_comment",
             json.loads(github_responses.PULL_REQUEST_REVIEW_COMMENT),
@@ -129,7 +163,8 @@ class TestGithubWebhookCallback(object):
             config["snooze_label"],
             config["ignore_members_of"])
         assert r is True
-        assert len(responses.calls) == 2
+        assert len(responses.calls) == 1
+        self.snooze_again(config, "https://api.github.com/repos/baxterthehacker/public-repo/issues/1")
 
         org_url = "https://api.github.com/orgs/fellowship/members/baxterthehacker"
         responses.add(responses.GET, org_url, status=204)  # is a member
@@ -156,9 +191,9 @@ class TestGithubWebhookCallback(object):
         """Test that a snooze label is not removed from PRs when a new commit is
         pushed but there is no snooze label."""
         responses.add(
-            responses.GET,
-            "https://api.github.com/repos/baxterthehacker/public-repo/issues/1",
-            body=github_responses.UNSNOOZED_ISSUE_GET)
+            responses.DELETE,
+            "https://api.github.com/repos/baxterthehacker/public-repo/issues/1/labels/snooze",
+            status=404)
         r = snooze.github_callback(
             "pull_request_review_comment",
             json.loads(github_responses.PULL_REQUEST_REVIEW_COMMENT),
@@ -168,6 +203,85 @@ class TestGithubWebhookCallback(object):
         assert r is False
         assert len(responses.calls) == 1
 
+    @responses.activate
+    def test_burst_is_coalesced(self, config):
+        """Test that a burst of review comments removes the label once."""
+        responses.add(
+            responses.DELETE,
+            "https://api.github.com/repos/baxterthehacker/public-repo/issues/1/labels/snooze")
+        results = [snooze.github_callback(
+            "pull_request_review_comment",
+            json.loads(github_responses.PULL_REQUEST_REVIEW_COMMENT),
+            (config["github_username"], config["github_token"]),
+            config["snooze_label"],
+            config["ignore_members_of"]) for _ in range(5)]
+        assert results == [True, False, False, False, False]
+        assert len(responses.calls) == 1
+        assert snooze.callbacks.stats["coalesced_events"] == 4
+
+        r = snooze.github_callback(
+            "pull_request_review_comment",
+            json.loads(github_responses.PULL_REQUEST_REVIEW_COMMENT),
+            (config["github_username"], config["github_token"]),
+            config["snooze_label"],
+            config["ignore_members_of"],
+            coalesce_window=0)
+        assert r is False
+        assert len(responses.calls) == 1
+        assert snooze.callbacks.stats["label_checks_avoided"] == 1
+
+    @responses.activate
+    def test_resnoozed_issue_is_not_coalesced(self, config):
+        """Test that an event whose payload shows the label put back after it
+        was cleared isn't coalesced, even without the labeled event."""
+        url = "https://api.github.com/repos/baxterthehacker/public-repo/issues/2"
+        responses.add(responses.DELETE, url + "/labels/snooze")
+        args = ((config["github_username"], config["github_token"]),
+                config["snooze_label"], config["ignore_members_of"])
+        message = json.loads(github_responses.SNOOZED_ISSUE_COMMENT)
+        message["issue"]["url"] = url
+        assert snooze.github_callback("issue_comment", message, *args) is True
+
+        # delivered late, from before the removal
+        assert snooze.github_callback("issue_comment", message, *args) is False
+        assert len(responses.calls) == 1
+
+        message["issue"]["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        assert snooze.github_callback("issue_comment", message, *args) is True
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_label_state_follows_issues_events(self, config):
+        """Test that issues known not to be snoozed are skipped when the
+        payload carries no labels."""
+        url = "https://api.github.com/repos/baxterthehacker/public-repo/issues/1"
+        responses.add(responses.DELETE, url + "/labels/snooze")
+        args = ((config["github_username"], config["github_token"]),
+                config["snooze_label"], config["ignore_members_of"])
+        message = json.loads(github_responses.PULL_REQUEST)
+        assert "labels" not in message["pull_request"]
+
+        r = snooze.github_callback(
+            "issues", {"action": "unlabeled", "issue": {"url": url, "labels": []}}, *args)
+        assert r is False
+        assert snooze.github_callback("pull_request", message, *args) is False
+        assert len(responses.calls) == 0
+
+        self.snooze_again(config, url)
+        assert snooze.github_callback("pull_request", message, *args) is True
+        assert len(responses.calls) == 1
+        assert snooze.callbacks.label_state.get((url, "snooze")) is False
+
+    @responses.activate
+    def test_clear_label_quotes_label_name(self, config):
+        url = "https://api.github.com/repos/baxterthehacker/public-repo/issues/2/labels/response%20needed"
+        responses.add(responses.DELETE, url, json=[])
+        issue = {"url": "https://api.github.com/repos/baxterthehacker/public-repo/issues/2",
+                 "html_url": "https://github.com/baxterthehacker/public-repo/issues/2"}
+        github_auth = (config["github_username"], config["github_token"])
+        assert snooze.callbacks.clear_snooze_label_if_set(github_auth, issue, "response needed")
+        assert responses.calls[0].request.url == url
+
     def test_bad_callback_type_is_logged(self, config):
         with LogCapture() as l:
             snooze.github_callback("foobar", None, None, None, None)
@@ -212,3 +326,21 @@ class TestIsMember(object):
         responses.add(responses.GET, url, status=200)
         with pytest.raises(requests.exceptions.HTTPError):
             snooze.callbacks.is_member_of(github_auth, "bilbo", "fellowship")
+
+    @responses.activate
+    def test_is_member_cached(self, config, github_auth):
+        url = "https://api.github.com/orgs/fellowship/members/bilbo"
+        responses.add(responses.GET, url, status=204)
+        cache = snooze.callbacks.membership_cache
+        assert snooze.callbacks.is_member_of(github_auth, "bilbo", "fellowship")
+        assert snooze.callbacks.is_member_of(github_auth, "Bilbo", "fellowship")
+        assert len(responses.calls) == 1
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    @responses.activate
+    def test_is_member_uncached(self, config, github_auth):
+        url = "https://api.github.com/orgs/fellowship/members/sauron"
+        responses.add(responses.GET, url, status=404)
+        for _ in range(2):
+            assert not snooze.callbacks.is_member_of(github_auth, "sauron", "fellowship", cache=None)
+        assert len(responses.calls) == 2
@@ -0,0 +1,51 @@
+import snooze.dedup
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_delivery_id():
+    assert snooze.dedup.delivery_id({"MessageId": "m1"}) == "m1"
+    assert snooze.dedup.delivery_id({
+        "MessageId": "m1",
+        "MessageAttributes": {"X-Github-Delivery": {"Type": "String", "Value": "guid"}},
+    }) == "guid"
+    assert snooze.dedup.delivery_id({}) is None
+
+
+class TestDeduplicator(object):
+    def test_records_only_processed_deliveries(self):
+        deduplicator = snooze.dedup.Deduplicator()
+        assert not deduplicator.seen("a")
+        assert not deduplicator.seen("a")
+        deduplicator.record("a")
+        assert deduplicator.seen("a")
+        assert not deduplicator.seen(None)
+        assert deduplicator.duplicates == 1
+
+    def test_window_is_bounded(self):
+        deduplicator = snooze.dedup.Deduplicator(maxsize=2)
+        for key in "abc":
+            deduplicator.record(key)
+        assert not deduplicator.seen("a")
+        assert deduplicator.seen("c")
+
+    def test_sqlite_store_persists(self, tmpdir):
+        filename = str(tmpdir.join("deliveries.sqlite"))
+        snooze.dedup.make_deduplicator(filename).record("a")
+        deduplicator = snooze.dedup.make_deduplicator(filename)
+        assert deduplicator.seen("a")
+        assert not deduplicator.seen("b")
+
+    def test_sqlite_store_expires(self, tmpdir):
+        clock = FakeClock()
+        store = snooze.dedup.SQLiteDeliveryStore(str(tmpdir.join("d.sqlite")), ttl=60, clock=clock)
+        store.add("a")
+        assert "a" in store
+        clock.now += 61
+        assert "a" not in store
@@ -0,0 +1,211 @@
+import os
+import subprocess
+import sys
+import zipfile
+
+import pytest
+from botocore.exceptions import ClientError
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import snooze.deploy_lambda
+
+
+class TestLeanPackage(object):
+    def test_copy_package_lean(self, tmpdir):
+        snooze.deploy_lambda._copy_package(str(tmpdir), lean=True)
+        shipped = set(os.listdir(str(tmpdir.join("snooze"))))
+        assert shipped == set(snooze.deploy_lambda.LAMBDA_MODULES) | {"__init__.py"}
+        assert tmpdir.join("snooze", "__init__.py").read() == \
+            snooze.deploy_lambda.LAMBDA_PACKAGE_INIT
+
+    def test_strip_package(self, tmpdir):
+        tmpdir.mkdir("requests").join("api.py").write("")
+        tmpdir.join("requests", "api.pyc").write("")
+        tmpdir.mkdir("tests").join("test_api.py").write("")
+        snooze.deploy_lambda._strip_package(str(tmpdir))
+        assert tmpdir.join("requests", "api.py").check()
+        assert not tmpdir.join("requests", "api.pyc").check()
+        assert not tmpdir.join("tests").check()
+
+    def test_lean_package_imports(self, tmpdir):
+        snooze.deploy_lambda._copy_package(str(tmpdir), lean=True)
+        tmpdir.join("lambda_handler.py").write(tmpdir.join("snooze", "lambda_handler.py").read())
+        tmpdir.join("snooze", "lambda_config.py").write(
+            "github_auth = ('u', 't')\nsnooze_label = 'snooze'\nignore_members_of = None\n")
+        assert snooze.deploy_lambda.measure_import_time(str(tmpdir)) > 0
+
+
+class TestDeterministicPackages(object):
+    def test_write_zip_is_deterministic(self, tmpdir):
+        digests = []
+        for name, mtime in [("a", 1500000000), ("b", 1600000000)]:
+            source = tmpdir.mkdir(name)
+            source.mkdir("snooze").join("callbacks.py").write("pass\n")
+            source.join("lambda_handler.py").write("pass\n")
+            source.join("lambda_handler.pyc").write("")
+            for path in source.visit():
+                os.utime(str(path), (mtime, mtime))
+            zip_filename = str(tmpdir.join(name + ".zip"))
+            snooze.deploy_lambda.write_zip(str(source), zip_filename)
+            with open(zip_filename, "rb") as f:
+                digests.append(snooze.deploy_lambda.code_sha256(f.read()))
+        assert digests[0] == digests[1]
+        names = zipfile.ZipFile(str(tmpdir.join("a.zip"))).namelist()
+        assert names == ["lambda_handler.py", "snooze/callbacks.py"]
+
+    def test_cached_requirements_expire(self, tmpdir):
+        releases = ["requests-2.31.0", "requests-2.32.3"]
+        installs = []
+
+        def pip_install(requires, target):
+            os.makedirs(os.path.join(target, releases[len(installs)] + ".dist-info"))
+            installs.append(requires)
+
+        cache_dir = str(tmpdir)
+        with mock.patch("snooze.deploy_lambda._pip_install", pip_install):
+            cached = snooze.deploy_lambda._cached_requirements(["requests"], cache_dir)
+            assert snooze.deploy_lambda._cached_requirements(["requests"], cache_dir) == cached
+            assert len(installs) == 1
+            assert snooze.deploy_lambda._installed_versions(cached) == [
+                "requests-2.31.0.dist-info"]
+
+            os.utime(cached, (0, 0))
+            assert snooze.deploy_lambda._cached_requirements(["requests"], cache_dir) == cached
+            assert len(installs) == 2
+            assert snooze.deploy_lambda._installed_versions(cached) == [
+                "requests-2.32.3.dist-info"]
+        assert os.listdir(cache_dir) == [os.path.basename(cached)]
+
+    def test_unchanged_function_is_not_updated(self, tmpdir):
+        zip_filename = tmpdir.join("package.zip")
+        zip_filename.write(b"package", mode="wb")
+        client = mock.Mock()
+        client.get_function.return_value = {"Configuration": {
+            "FunctionName": "snooze__a__b",
+            "FunctionArn": "arn:snooze__a__b",
+            "CodeSha256": snooze.deploy_lambda.code_sha256(b"package"),
+        }}
+        aws = snooze.deploy_lambda.AwsCache(mock.Mock(client=mock.Mock(return_value=client)))
+        repo = {"zip_filename": str(zip_filename), "aws_region": "us-west-2"}
+        arn = snooze.deploy_lambda.create_or_update_lambda_function(
+            None, "snooze__a__b", repo, aws)
+        assert arn == "arn:snooze__a__b"
+        assert not client.update_function_code.called
+        client.get_function.assert_called_once_with(FunctionName="snooze__a__b")
+
+        zip_filename.write(b"changed package", mode="wb")
+        snooze.deploy_lambda.create_or_update_lambda_function(None, "snooze__a__b", repo, aws)
+        assert client.update_function_code.called
+
+
+class TestAwsLookups(object):
+    def test_missing_role_is_created_once(self):
+        iam = mock.Mock()
+        iam.get_role.side_effect = ClientError(
+            {"Error": {"Code": "NoSuchEntity"}}, "GetRole")
+        iam.create_role.return_value = {"Role": {"Arn": "arn:role"}}
+        session = mock.Mock(client=mock.Mock(return_value=iam))
+        aws = snooze.deploy_lambda.AwsCache(session)
+        assert snooze.deploy_lambda.create_or_get_lambda_role(aws) == "arn:role"
+        assert snooze.deploy_lambda.create_or_get_lambda_role(aws) == "arn:role"
+        assert iam.get_role.call_count == iam.create_role.call_count == 1
+        assert session.client.call_count == 1
+
+    def test_existing_role_is_not_created(self):
+        iam = mock.Mock()
+        iam.get_role.return_value = {"Role": {"Arn": "arn:role"}}
+        aws = snooze.deploy_lambda.AwsCache(mock.Mock(client=mock.Mock(return_value=iam)))
+        assert snooze.deploy_lambda.create_or_get_lambda_role(aws) == "arn:role"
+        assert not iam.create_role.called
+
+
+class TestSnsPermissions(object):
+    def test_shared_function_gets_one_permission_per_region(self, tmpdir):
+        zip_filename = tmpdir.join("package.zip")
+        zip_filename.write(b"package", mode="wb")
+        client = mock.Mock()
+        client.get_function.return_value = {"Configuration": {
+            "FunctionArn": "arn:aws:lambda:us-west-2:1234:function:snooze__shared",
+            "CodeSha256": snooze.deploy_lambda.code_sha256(b"package"),
+        }}
+        client.add_permission.side_effect = ClientError(
+            {"Error": {"Code": "ResourceConflictException"}}, "AddPermission")
+        aws = snooze.deploy_lambda.AwsCache(mock.Mock(client=mock.Mock(return_value=client)))
+        config = {name: {"zip_filename": str(zip_filename), "aws_region": "us-west-2"}
+                  for name in ["tdsmith/a", "tdsmith/b"]}
+        snooze.deploy_lambda.deploy_shared_functions(None, config, aws)
+        client.add_permission.assert_called_once_with(
+            FunctionName="snooze__shared", StatementId="sns",
+            Action="lambda:InvokeFunction", Principal="sns.amazonaws.com",
+            SourceArn="arn:aws:sns:us-west-2:1234:*")
+
+    def test_other_permission_errors_are_raised(self):
+        client = mock.Mock()
+        client.add_permission.side_effect = ClientError(
+            {"Error": {"Code": "PolicyLengthExceededException"}}, "AddPermission")
+        with pytest.raises(ClientError):
+            snooze.deploy_lambda.allow_sns_invoke(client, "snooze__a__b", "1", "arn:topic")
+
+
+def test_other_functions_are_unsubscribed():
+    shared = "arn:aws:lambda:us-west-2:1234:function:snooze__shared"
+    old = "arn:aws:lambda:us-west-2:1234:function:snooze__a__b"
+    mine = "arn:aws:lambda:us-west-2:1234:function:my_function"
+    subscriptions = [
+        {"SubscriptionArn": "sub:" + endpoint, "Protocol": protocol, "Endpoint": endpoint}
+        for protocol, endpoint in [("lambda", shared), ("lambda", old), ("lambda", mine),
+                                   ("sqs", "arn:aws:sqs:us-west-2:1234:snooze__a__b")]]
+    sns = mock.Mock()
+    sns.get_paginator.return_value.paginate.return_value = [
+        {"Subscriptions": subscriptions[:2]}, {"Subscriptions": subscriptions[2:]}]
+    assert snooze.deploy_lambda.unsubscribe_other_functions(sns, "arn:topic", shared) == [old]
+    sns.get_paginator.return_value.paginate.assert_called_once_with(TopicArn="arn:topic")
+    sns.unsubscribe.assert_called_once_with(SubscriptionArn="sub:" + old)
+
+
+def test_phase_timer():
+    now = [0.0]
+    timer = snooze.deploy_lambda.PhaseTimer(clock=lambda: now[0])
+    step = timer.stepper()
+    step("creating SNS topic")
+    now[0] = 2.0
+    step("connecting Github")
+    now[0] = 3.0
+    step(None)
+    with timer.phase("creating SNS topic"):
+        now[0] = 7.0
+    assert timer.phases == {"creating SNS topic": [6.0, 2, 4.0],
+                            "connecting Github": [1.0, 1, 1.0]}
+
+
+def test_deploy_repositories_reports_failures():
+    deployed = []
+
+    def deploy_repository(role_arn, repository_name, repo, aws, progress,
+                          shared_function_arn):
+        progress("uploading Lambda function")
+        if repository_name == "tdsmith/broken":
+            raise ValueError("no such repository")
+        deployed.append(repository_name)
+
+    config = {name: {"aws_region": "us-west-2"}
+              for name in ["tdsmith/a", "tdsmith/b", "tdsmith/broken"]}
+    with mock.patch("snooze.deploy_lambda.deploy_repository", deploy_repository):
+        failures = snooze.deploy_lambda.deploy_repositories(None, config, workers=2,
+                                                            aws=mock.Mock())
+    assert sorted(deployed) == ["tdsmith/a", "tdsmith/b"]
+    assert list(failures) == ["tdsmith/broken"]
+    assert isinstance(failures["tdsmith/broken"], ValueError)
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="lazy package imports need Python 3.7")
+def test_package_imports_lazily():
+    script = ("import sys, snooze.callbacks; "
+              "assert 'boto3' not in sys.modules, 'boto3 imported'; "
+              "assert snooze.RepositoryListener; assert 'boto3' in sys.modules")
+    root = os.path.dirname(os.path.dirname(snooze.deploy_lambda.__file__))
+    subprocess.check_call([sys.executable, "-c", script], cwd=root)
@@ -0,0 +1,38 @@
+import threading
+import time
+
+import snooze.executor
+
+
+class TestShardedExecutor(object):
+    def test_same_key_runs_in_order(self):
+        executor = snooze.executor.ShardedExecutor(4)
+        seen = []
+
+        def task(i):
+            time.sleep(0.001 * (5 - i))
+            seen.append(i)
+
+        futures = [executor.submit("issue/1", task, i) for i in range(5)]
+        [f.result() for f in futures]
+        executor.shutdown()
+        assert seen == list(range(5))
+
+    def test_different_keys_run_concurrently(self):
+        executor = snooze.executor.ShardedExecutor(2)
+        barrier = threading.Event()
+        started = []
+
+        def task(i):
+            started.append(i)
+            if len(started) == 2:
+                barrier.set()
+            return barrier.wait(1)
+
+        # keys without a shard collision, and tasks without a key
+        for keys in [(0, 1), (None, None)]:
+            del started[:]
+            barrier.clear()
+            futures = [executor.submit(key, task, i) for i, key in enumerate(keys)]
+            assert all(f.result() for f in futures)
+        executor.shutdown()
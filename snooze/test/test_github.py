@@ -0,0 +1,120 @@
+import pytest
+import responses
+
+import snooze.github
+
+
+@pytest.fixture
+def github_auth():
+    return ("frodo", "baggins")
+
+
+class TestGithubClient(object):
+    def test_get_client_is_shared(self, github_auth):
+        client = snooze.github.get_client(github_auth)
+        assert snooze.github.get_client(list(github_auth)) is client
+        assert snooze.github.get_client(client) is client
+        assert snooze.github.get_client(("samwise", "gamgee")) is not client
+
+    def test_pool_size(self, github_auth):
+        client = snooze.github.GithubClient(*github_auth, pool_size=3)
+        adapter = client.session.get_adapter("https://api.github.com")
+        assert adapter._pool_maxsize == 3
+        assert adapter.max_retries.total == snooze.constants.GITHUB_RETRIES
+
+    @responses.activate
+    def test_request_sends_auth_and_headers(self, github_auth):
+        url = "https://api.github.com/repos/baxterthehacker/public-repo/issues/2"
+        responses.add(responses.GET, url, json={})
+        snooze.github.GithubClient(*github_auth).get(url)
+        request = responses.calls[0].request
+        assert request.headers["Accept"] == snooze.constants.GITHUB_HEADERS["Accept"]
+        assert request.headers["Authorization"].startswith("Basic ")
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse(object):
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class TestRateLimiter(object):
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    def test_paces_when_quota_is_low(self, clock):
+        limiter = snooze.github.RateLimiter(burst=2, max_wait=60, clock=clock, sleep=clock.sleep)
+        limiter.update(FakeResponse(headers={
+            "X-RateLimit-Remaining": "10", "X-RateLimit-Reset": str(clock.now + 100)}))
+        for _ in range(4):
+            limiter.acquire()
+        # two requests from the burst, then the remaining 8 spread over 100s
+        assert len(clock.slept) == 2
+        assert all(12 <= delay < 13 for delay in clock.slept)
+
+    def test_plentiful_quota_is_not_paced(self, clock):
+        limiter = snooze.github.RateLimiter(clock=clock, sleep=clock.sleep)
+        limiter.update(FakeResponse(headers={
+            "X-RateLimit-Remaining": "5000", "X-RateLimit-Reset": str(clock.now + 3600)}))
+        for _ in range(300):
+            limiter.acquire()
+        assert clock.slept == []
+
+    def test_long_pacing_defers(self, clock):
+        limiter = snooze.github.RateLimiter(burst=2, max_wait=10, clock=clock, sleep=clock.sleep)
+        limiter.update(FakeResponse(headers={
+            "X-RateLimit-Remaining": "100", "X-RateLimit-Reset": str(clock.now + 3600)}))
+        limiter.acquire()
+        limiter.acquire()
+        with pytest.raises(snooze.github.RateLimitExceeded) as excinfo:
+            limiter.acquire()
+        assert 30 < excinfo.value.retry_after < 40
+        assert clock.slept == []
+
+    def test_exhausted_quota_defers(self, clock):
+        limiter = snooze.github.RateLimiter(max_wait=10, clock=clock, sleep=clock.sleep)
+        limiter.update(FakeResponse(headers={
+            "X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(clock.now + 600)}))
+        with pytest.raises(snooze.github.RateLimitExceeded) as excinfo:
+            limiter.acquire()
+        assert excinfo.value.retry_after == 600
+
+    def test_secondary_limit(self, clock):
+        limiter = snooze.github.RateLimiter(clock=clock, sleep=clock.sleep)
+        assert limiter.update(FakeResponse(403, {"Retry-After": "60"})) == 60
+        assert limiter.update(FakeResponse(403)) is None
+        with pytest.raises(snooze.github.RateLimitExceeded):
+            limiter.acquire()
+        clock.now += 60
+        limiter.acquire()
+        assert clock.slept == []
+
+    def test_shared_per_user(self):
+        client = snooze.github.GithubClient("frodo", "baggins")
+        other = snooze.github.GithubClient("frodo", "other_token")
+        assert client.rate_limiter is other.rate_limiter
+        assert client.rate_limiter is not snooze.github.GithubClient("sam", "gamgee").rate_limiter
+
+    @responses.activate
+    def test_client_raises_on_rate_limit(self, github_auth):
+        url = "https://api.github.com/repos/baxterthehacker/public-repo/issues/2"
+        responses.add(responses.GET, url, status=429, headers={"Retry-After": "30"})
+        client = snooze.github.GithubClient(
+            *github_auth, rate_limiter=snooze.github.RateLimiter())
+        with pytest.raises(snooze.github.RateLimitExceeded) as excinfo:
+            client.get(url)
+        assert 29 < excinfo.value.retry_after <= 30
@@ -0,0 +1,91 @@
+import json
+import sys
+import types
+
+import pytest
+import responses
+
+import github_responses
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    lambda_config = types.ModuleType("snooze.lambda_config")
+    lambda_config.github_auth = ("frodo", "baggins")
+    lambda_config.snooze_label = "snooze"
+    lambda_config.ignore_members_of = None
+    monkeypatch.setitem(sys.modules, "snooze.lambda_config", lambda_config)
+    monkeypatch.delitem(sys.modules, "snooze.lambda_handler", raising=False)
+    import snooze.lambda_handler
+    return snooze.lambda_handler
+
+
+def sns_notification(message_id, payload, event_type="issue_comment"):
+    return {
+        "MessageId": message_id,
+        "Message": payload,
+        "MessageAttributes": {"X-Github-Event": {"Type": "String", "Value": event_type}},
+    }
+
+
+def issue_comment(number):
+    payload = json.loads(github_responses.SNOOZED_ISSUE_COMMENT)
+    payload["issue"]["url"] = "https://api.github.com/repos/baxterthehacker/public-repo/issues/{}".format(number)
+    return json.dumps(payload)
+
+
+class TestLambdaHandler(object):
+    @responses.activate
+    def test_sns_record(self, handler):
+        url = "https://api.github.com/repos/baxterthehacker/public-repo/issues/2/labels/snooze"
+        responses.add(responses.DELETE, url)
+        event = {"Records": [{"Sns": sns_notification("1", issue_comment(2))}]}
+        assert handler.lambda_handler(event, None) == {"batchItemFailures": []}
+        assert len(responses.calls) == 1
+
+    @responses.activate
+    def test_sns_failure_raises(self, handler):
+        url = "https://api.github.com/repos/baxterthehacker/public-repo/issues/2/labels/snooze"
+        responses.add(responses.DELETE, url, status=422)
+        event = {"Records": [{"Sns": sns_notification("1", issue_comment(2))}]}
+        with pytest.raises(RuntimeError):
+            handler.lambda_handler(event, None)
+
+    @responses.activate
+    def test_sqs_batch_partial_failure(self, handler):
+        base = "https://api.github.com/repos/baxterthehacker/public-repo/issues/{}/labels/snooze"
+        for number in range(1, 6):
+            responses.add(responses.DELETE, base.format(number), status=422 if number == 3 else 200)
+        event = {"Records": [
+            {"messageId": "m{}".format(number),
+             "body": json.dumps(sns_notification(str(number), issue_comment(number)))}
+            for number in range(1, 6)]}
+        event["Records"].append({"messageId": "garbage", "body": "not json"})
+        assert handler.lambda_handler(event, None) == {"batchItemFailures": [{"itemIdentifier": "m3"}]}
+        assert len(responses.calls) == 5
+
+    @responses.activate
+    def test_duplicate_deliveries_are_skipped(self, handler):
+        url = "https://api.github.com/repos/baxterthehacker/public-repo/issues/2/labels/snooze"
+        responses.add(responses.DELETE, url)
+        record = {"Sns": sns_notification("1", issue_comment(2))}
+        assert handler.lambda_handler({"Records": [record, record]}, None) == \
+            {"batchItemFailures": []}
+        assert handler.lambda_handler({"Records": [record]}, None) == {"batchItemFailures": []}
+        assert len(responses.calls) == 1
+
+    @responses.activate
+    def test_shared_function_routes_by_repository(self, handler, monkeypatch):
+        lambda_config = sys.modules["snooze.lambda_config"]
+        del lambda_config.github_auth
+        lambda_config.routes = {"BaxterTheHacker/public-repo": (("frodo", "baggins"), "snooze", None)}
+        monkeypatch.delitem(sys.modules, "snooze.lambda_handler")
+        import snooze.lambda_handler as shared_handler
+        url = "https://api.github.com/repos/baxterthehacker/public-repo/issues/2/labels/snooze"
+        responses.add(responses.DELETE, url)
+        other = json.loads(issue_comment(3))
+        other["repository"]["full_name"] = "tdsmith/other"
+        event = {"Records": [{"Sns": sns_notification("1", issue_comment(2))},
+                             {"Sns": sns_notification("2", json.dumps(other))}]}
+        assert shared_handler.lambda_handler(event, None) == {"batchItemFailures": []}
+        assert [call.request.url for call in responses.calls] == [url]
@@ -0,0 +1,66 @@
+import json
+
+import requests
+import responses
+
+import snooze
+import snooze.metrics
+import github_responses
+
+
+class TestMetrics(object):
+    def test_render(self):
+        registry = snooze.metrics.Registry()
+        counter = registry.counter("spam_total", "Spam eaten", ["kind"])
+        histogram = registry.histogram("eggs_seconds", "Egg boiling time", buckets=(1, 5))
+        registry.function("ham", "Ham remaining", "gauge", lambda: 3)
+        counter.inc(kind='with "beans"')
+        counter.inc(2, kind='with "beans"')
+        histogram.observe(0.5)
+        histogram.observe(4)
+        histogram.observe(9)
+        assert registry.render().splitlines() == [
+            "# HELP spam_total Spam eaten",
+            "# TYPE spam_total counter",
+            'spam_total{kind="with \\"beans\\""} 3.0',
+            "# HELP eggs_seconds Egg boiling time",
+            "# TYPE eggs_seconds histogram",
+            'eggs_seconds_bucket{le="1.0"} 1.0',
+            'eggs_seconds_bucket{le="5.0"} 2.0',
+            'eggs_seconds_bucket{le="+Inf"} 3.0',
+            "eggs_seconds_sum 13.5",
+            "eggs_seconds_count 3.0",
+            "# HELP ham Ham remaining",
+            "# TYPE ham gauge",
+            "ham 3.0",
+        ]
+
+    def test_http_server(self):
+        server = snooze.metrics.start_http_server(0)
+        try:
+            # only the local host can reach the metrics by default
+            assert server.server_address[0] == "127.0.0.1"
+            snooze.metrics.events.inc(repository="tdsmith/test_repo", event="issue_comment")
+            r = requests.get("http://127.0.0.1:{}/metrics".format(server.server_address[1]))
+            assert r.headers["Content-Type"].startswith("text/plain")
+            assert ('snooze_events_total{repository="tdsmith/test_repo",event="issue_comment"} 1.0'
+                    in r.text.splitlines())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    @responses.activate
+    def test_callback_and_request_metrics(self):
+        responses.add(
+            responses.DELETE,
+            "https://api.github.com/repos/baxterthehacker/public-repo/issues/2/labels/snooze",
+            headers={"X-RateLimit-Remaining": "4999", "X-RateLimit-Reset": "2000000000"})
+        snooze.github_callback(
+            "issue_comment", json.loads(github_responses.SNOOZED_ISSUE_COMMENT),
+            ("frodo", "baggins"), "snooze", None)
+        repository = "baxterthehacker/public-repo"
+        assert snooze.metrics.events.get(repository=repository, event="issue_comment") == 1
+        assert snooze.metrics.label_removals.get(repository=repository) == 1
+        assert snooze.metrics.github_responses.get(repository=repository, status=200) == 1
+        assert snooze.metrics.github_request_seconds.get(repository=repository, method="DELETE") == 1
+        assert snooze.metrics.github_rate_limit_remaining.get(user="frodo") == 4999
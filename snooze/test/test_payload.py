@@ -0,0 +1,41 @@
+import json
+
+import github_responses
+import snooze.callbacks
+import snooze.payload
+
+
+def test_peek_action():
+    assert snooze.payload.peek_action(github_responses.PULL_REQUEST) == "synchronize"
+    assert snooze.payload.peek_action('{"action": "opened", "number": 1}') == "opened"
+    assert snooze.payload.peek_action('{"number": 1, "action": "opened"}') is None
+    assert snooze.payload.peek_action('{"pull_request": {"action": "opened"}}') is None
+
+
+def test_wants_event():
+    assert snooze.callbacks.wants_event("issue_comment", "created")
+    assert snooze.callbacks.wants_event("pull_request", "synchronize")
+    assert snooze.callbacks.wants_event("pull_request", None)
+    assert not snooze.callbacks.wants_event("pull_request", "assigned")
+    assert not snooze.callbacks.wants_event("push")
+    assert snooze.callbacks.wants_event("issues", "unlabeled")
+    assert not snooze.callbacks.wants_event("issues", "edited")
+
+
+class TestDecodePayload(object):
+    def test_rejected_without_decoding(self):
+        payload = '{"action": "assigned", this is not json'
+        assert snooze.payload.decode_payload(
+            "pull_request", payload, snooze.callbacks.wants_event) is None
+
+    def test_action_checked_after_decoding(self):
+        payload = json.dumps({"number": 1, "action": "assigned"})
+        assert snooze.payload.decode_payload(
+            "pull_request", payload, snooze.callbacks.wants_event) is None
+        payload = json.dumps({"number": 1, "action": "synchronize"})
+        assert snooze.payload.decode_payload(
+            "pull_request", payload, snooze.callbacks.wants_event) == json.loads(payload)
+
+    def test_no_filter(self):
+        payload = json.dumps({"action": "assigned"})
+        assert snooze.payload.decode_payload("pull_request", payload) == {"action": "assigned"}
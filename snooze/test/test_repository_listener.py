@@ -3,6 +3,11 @@ import logging
 from textwrap import dedent
 import types
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 import boto3
 import moto
 import pytest
@@ -11,10 +16,20 @@ from testfixtures import LogCapture
 import six
 
 import snooze
+import snooze.callbacks
+import snooze.github
+import snooze.metrics
 
 logging.getLogger("botocore").setLevel(logging.INFO)
 
 
+def mock_hooks(repository_name, hooks=()):
+    """Mocks the listing and creation of a repository's hooks."""
+    url = "https://api.github.com/repos/{}/hooks".format(repository_name)
+    responses.add(responses.GET, url, json=list(hooks))
+    responses.add(responses.POST, url)
+
+
 class MockAPIMetaclass(type):
     """Metaclass which wraps all methods of its instances with decorators
     that redirect SNS and SQS calls to moto and activates responses."""
@@ -60,18 +75,29 @@ class TestRepositoryListenener(object):
         assert len(list(sqs.queues.all())) == 0
         assert len(list(sns.topics.all())) == 0
 
-        responses.add(responses.POST, "https://api.github.com/repos/tdsmith/test_repo/hooks")
+        mock_hooks("tdsmith/test_repo")
         snooze.RepositoryListener(events=snooze.LISTEN_EVENTS, **config["tdsmith/test_repo"])
         assert len(list(sqs.queues.all())) > 0
         assert len(list(sns.topics.all())) > 0
 
+    def test_subscription_filters_events(self, config):
+        mock_hooks("tdsmith/test_repo")
+        repo = dict(config["tdsmith/test_repo"])
+        snooze.RepositoryListener(events=["pull_request", "issue_comment"], **repo)
+        sns = boto3.resource("sns", region_name="us-west-2")
+        subscription, = sns.subscriptions.all()
+        assert json.loads(subscription.attributes["FilterPolicy"]) == {
+            "X-Github-Event": ["issue_comment", "pull_request"]}
+        assert json.loads(responses.calls[-1].request.body)["events"] == [
+            "pull_request", "issue_comment"]
+
     def test_poll(self, config, trivial_message):
         self._test_poll_was_polled = False
 
         def my_callback(event, message):
             self._test_poll_was_polled = True
 
-        responses.add(responses.POST, "https://api.github.com/repos/tdsmith/test_repo/hooks")
+        mock_hooks("tdsmith/test_repo")
         repo_listener = snooze.RepositoryListener(
             events=snooze.LISTEN_EVENTS,
             callbacks=[my_callback], **config["tdsmith/test_repo"])
@@ -88,7 +114,7 @@ class TestRepositoryListenener(object):
         assert self._test_poll_was_polled
 
     def test_bad_message_is_logged(self, config, trivial_message):
-        responses.add(responses.POST, "https://api.github.com/repos/tdsmith/test_repo/hooks")
+        mock_hooks("tdsmith/test_repo")
         repo_listener = snooze.RepositoryListener(
             events=snooze.LISTEN_EVENTS,
             **config["tdsmith/test_repo"])
@@ -108,3 +134,241 @@ class TestRepositoryListenener(object):
         with LogCapture() as l:
             repo_listener.poll()
             assert 'I object!' in str(l)
+
+    def test_poll_batches(self, config, trivial_message):
+        received = []
+        mock_hooks("tdsmith/test_repo")
+        repo_listener = snooze.RepositoryListener(
+            events=snooze.LISTEN_EVENTS,
+            callbacks=[lambda event, message: received.append(message)],
+            **config["tdsmith/test_repo"])
+
+        sqs = boto3.resource("sqs", region_name="us-west-2")
+        sqs_queue = list(sqs.queues.all())[0]
+        for _ in range(25):
+            sqs_queue.send_message(MessageBody=trivial_message)
+
+        assert repo_listener.poll(wait=False, drain=True) == 25
+        assert len(received) == 25
+        sqs_queue.reload()
+        assert int(sqs_queue.attributes["ApproximateNumberOfMessages"]) == 0
+        assert repo_listener.poll(wait=False, drain=True) == 0
+
+    def test_partial_delete_failure_is_retried(self, config, trivial_message):
+        mock_hooks("tdsmith/test_repo")
+        repo_listener = snooze.RepositoryListener(
+            events=snooze.LISTEN_EVENTS,
+            **config["tdsmith/test_repo"])
+        calls = []
+
+        def delete_messages(Entries):
+            calls.append([entry["Id"] for entry in Entries])
+            if len(calls) == 1:
+                return {"Failed": [
+                    {"Id": "0", "SenderFault": False, "Code": "InternalError"},
+                    {"Id": "1", "SenderFault": True, "Code": "ReceiptHandleIsInvalid"}]}
+            return {}
+
+        class FakeMessage(object):
+            receipt_handle = "handle"
+
+        repo_listener.sqs_queue = mock.Mock(url="queue", delete_messages=delete_messages)
+        with LogCapture() as l:
+            repo_listener._delete_messages([FakeMessage() for _ in range(3)])
+        assert calls == [["0", "1", "2"], ["0"]]
+        assert "ReceiptHandleIsInvalid" in str(l)
+        assert "InternalError" not in str(l)
+
+    def test_shared_queue_routes_by_repository(self, config):
+        received = {"tdsmith/test_repo": [], "tdsmith/other_repo": []}
+        for name in received:
+            mock_hooks(name)
+        listener = snooze.SharedQueueListener("tdsmith", "us-west-2")
+        for name in received:
+            repo = dict(config["tdsmith/test_repo"], repository_name=name)
+            listener.add_repository(
+                events=snooze.LISTEN_EVENTS,
+                callbacks=[lambda event, message, name=name: received[name].append(event)],
+                **repo)
+
+        sqs = boto3.resource("sqs", region_name="us-west-2")
+        sns = boto3.resource("sns", region_name="us-west-2")
+        assert sorted(q.url.split("/")[-1] for q in sqs.queues.all()) == [
+            "snooze__tdsmith", "snooze__tdsmith__dead"]
+        assert len(list(sns.topics.all())) == 2
+
+        for name in ["tdsmith/Test_Repo", "tdsmith/other_repo", "sauron/mordor"]:
+            listener.sqs_queue.send_message(MessageBody=json.dumps({
+                "Message": json.dumps({"repository": {"full_name": name}}),
+                "MessageAttributes": {"X-Github-Event": {"Value": "issue_comment"}},
+            }))
+        with LogCapture() as l:
+            assert listener.poll(wait=False, drain=True) == 3
+            assert "sauron/mordor" in str(l)
+        assert received == {"tdsmith/test_repo": ["issue_comment"],
+                            "tdsmith/other_repo": ["issue_comment"]}
+
+    def test_rate_limited_message_is_deferred(self, config, trivial_message):
+        def my_callback(event, message):
+            raise snooze.github.RateLimitExceeded("slow down", retry_after=120)
+
+        mock_hooks("tdsmith/test_repo")
+        repo_listener = snooze.RepositoryListener(
+            events=snooze.LISTEN_EVENTS,
+            callbacks=[my_callback], **config["tdsmith/test_repo"])
+        sqs_queue = repo_listener.sqs_queue
+        sqs_queue.send_message(MessageBody=trivial_message)
+
+        with LogCapture() as l:
+            assert repo_listener.poll(wait=False) == 1
+            assert "deferring" in str(l)
+        sqs_queue.reload()
+        assert int(sqs_queue.attributes["ApproximateNumberOfMessages"]) == 0
+        assert int(sqs_queue.attributes["ApproximateNumberOfMessagesNotVisible"]) == 1
+
+    def test_failed_message_is_retried_then_dead_lettered(self, config, trivial_message):
+        def my_callback(event, message):
+            raise ValueError("Github is down")
+
+        mock_hooks("tdsmith/test_repo")
+        repo = dict(config["tdsmith/test_repo"], max_receive_count="2")
+        repo_listener = snooze.RepositoryListener(
+            events=snooze.LISTEN_EVENTS,
+            callbacks=[my_callback], **repo)
+        sqs_queue = repo_listener.sqs_queue
+        redrive_policy = json.loads(sqs_queue.attributes["RedrivePolicy"])
+        assert int(redrive_policy["maxReceiveCount"]) == 2
+        assert redrive_policy["deadLetterTargetArn"].endswith("snooze__tdsmith__test_repo__dead")
+
+        sqs_queue.send_message(MessageBody=trivial_message)
+        with mock.patch("snooze.repository_listener.SQS_RETRY_BACKOFF", 0):
+            assert repo_listener.poll(wait=False) == 1
+            assert repo_listener.poll(wait=False) == 1
+            # the third receive moves the message to the dead-letter queue
+            assert repo_listener.poll(wait=False) == 0
+        sqs = boto3.resource("sqs", region_name="us-west-2")
+        dead_letter_queue = sqs.get_queue_by_name(QueueName="snooze__tdsmith__test_repo__dead")
+        assert int(dead_letter_queue.attributes["ApproximateNumberOfMessages"]) == 1
+
+    def test_redelivered_message_is_skipped(self, config):
+        received = []
+        mock_hooks("tdsmith/test_repo")
+        repo_listener = snooze.RepositoryListener(
+            events=snooze.LISTEN_EVENTS,
+            callbacks=[lambda event, message: received.append(message)],
+            **config["tdsmith/test_repo"])
+        body = json.dumps({
+            "MessageId": "a6b7c8",
+            "Message": json.dumps({"key": "value"}),
+            "MessageAttributes": {"X-Github-Event": {"Value": "issue_comment"}},
+        })
+        for _ in range(3):
+            repo_listener.sqs_queue.send_message(MessageBody=body)
+        assert repo_listener.poll(wait=False, drain=True) == 3
+        repo_listener.sqs_queue.send_message(MessageBody=body)
+        assert repo_listener.poll(wait=False) == 1
+        assert len(received) == 1
+        assert snooze.metrics.duplicate_deliveries.get(repository="tdsmith/test_repo") == 3
+        repo_listener.sqs_queue.reload()
+        assert int(repo_listener.sqs_queue.attributes["ApproximateNumberOfMessages"]) == 0
+
+    def test_message_without_event_type_is_dropped(self, config, trivial_message):
+        received = []
+        mock_hooks("tdsmith/test_repo")
+        repo_listener = snooze.RepositoryListener(
+            events=snooze.LISTEN_EVENTS,
+            callbacks=[lambda event, message: received.append(event)],
+            **config["tdsmith/test_repo"])
+        repo_listener.sqs_queue.send_message(MessageBody=trivial_message)
+        repo_listener.sqs_queue.send_message(MessageBody=json.dumps({"Message": "{}"}))
+        repo_listener.sqs_queue.send_message(MessageBody=trivial_message)
+        with LogCapture() as l:
+            assert repo_listener.poll(wait=False, drain=True) == 3
+            assert "malformed" in str(l)
+        assert received == ["spam", "spam"]
+        repo_listener.sqs_queue.reload()
+        assert int(repo_listener.sqs_queue.attributes["ApproximateNumberOfMessages"]) == 0
+        assert int(repo_listener.sqs_queue.attributes["ApproximateNumberOfMessagesNotVisible"]) == 0
+
+    def test_filtered_message_is_deleted(self, config):
+        received = []
+        mock_hooks("tdsmith/test_repo")
+        repo_listener = snooze.RepositoryListener(
+            events=snooze.LISTEN_EVENTS,
+            callbacks=[lambda event, message: received.append(message["action"])],
+            event_filter=snooze.callbacks.wants_event,
+            **config["tdsmith/test_repo"])
+        for action in ["assigned", "synchronize"]:
+            repo_listener.sqs_queue.send_message(MessageBody=json.dumps({
+                "Message": json.dumps({"action": action}),
+                "MessageAttributes": {"X-Github-Event": {"Value": "pull_request"}},
+            }))
+        assert repo_listener.poll(wait=False, drain=True) == 2
+        assert received == ["synchronize"]
+        assert snooze.metrics.filtered_messages.get(repository="tdsmith/test_repo") == 1
+        repo_listener.sqs_queue.reload()
+        assert int(repo_listener.sqs_queue.attributes["ApproximateNumberOfMessages"]) == 0
+
+    def test_retry_delay(self, config):
+        mock_hooks("tdsmith/test_repo")
+        repo_listener = snooze.RepositoryListener(
+            events=snooze.LISTEN_EVENTS,
+            **config["tdsmith/test_repo"])
+        backoff = snooze.constants.SQS_RETRY_BACKOFF
+        for receive_count, delay in [(1, backoff), (2, 2 * backoff), (4, 8 * backoff)]:
+            message = mock.Mock(attributes={"ApproximateReceiveCount": str(receive_count)})
+            assert repo_listener._retry_delay(message, ValueError()) == delay
+        rate_limited = snooze.github.RateLimitExceeded("slow down", retry_after=600)
+        assert repo_listener._retry_delay(message, rate_limited) == 600
+
+
+class TestConnectGithubToSns(object):
+    topic = "arn:aws:sns:us-west-2:123456789012:tdsmith__test_repo"
+    url = "https://api.github.com/repos/tdsmith/test_repo/hooks"
+
+    def hook(self, hook_id, events=("issue_comment",), topic=topic):
+        return {"id": hook_id, "name": "amazonsns", "active": True, "events": list(events),
+                "config": {"aws_key": "shire", "aws_secret": "********",
+                           "sns_topic": topic, "sns_region": "us-west-2"}}
+
+    def connect(self, events=("issue_comment",)):
+        snooze.repository_listener.connect_github_to_sns(
+            "shire", "precious", "us-west-2", "frodo", "baggins", "tdsmith/test_repo",
+            self.topic, list(events))
+
+    @responses.activate
+    def test_existing_hook_is_reused(self):
+        other_topic = self.hook(3, topic="arn:aws:sns:us-west-2:123456789012:elsewhere")
+        responses.add(responses.GET, self.url, json=[self.hook(1), self.hook(2), other_topic],
+                      headers={"ETag": '"abc"'})
+        responses.add(responses.DELETE, self.url + "/2", status=204)
+        self.connect()
+        assert [(call.request.method, call.request.url) for call in responses.calls] == [
+            ("GET", self.url + "?per_page=100"), ("DELETE", self.url + "/2")]
+
+    @responses.activate
+    def test_unchanged_listing_is_revalidated(self):
+        responses.add(responses.GET, self.url, json=[self.hook(1)], headers={"ETag": '"abc"'})
+        self.connect()
+        responses.replace(responses.GET, self.url, status=304)
+        self.connect()
+        assert len(responses.calls) == 2
+        assert responses.calls[-1].request.headers["If-None-Match"] == '"abc"'
+
+    @responses.activate
+    def test_changed_hook_is_updated(self):
+        responses.add(responses.GET, self.url, json=[self.hook(1)])
+        responses.add(responses.PATCH, self.url + "/1")
+        self.connect(events=["issue_comment", "pull_request"])
+        body = json.loads(responses.calls[-1].request.body)
+        assert body["events"] == ["issue_comment", "pull_request"]
+        assert body["config"]["aws_secret"] == "precious"
+
+    @responses.activate
+    def test_hooks_are_listed_across_pages(self):
+        page2 = self.url + "?per_page=100&page=2"
+        responses.add(responses.GET, self.url, json=[],
+                      headers={"Link": '<{}>; rel="next"'.format(page2)})
+        responses.add(responses.GET, page2, json=[self.hook(1)])
+        self.connect()
+        assert len(responses.calls) == 2
@@ -3,6 +3,7 @@ from textwrap import dedent
 import pytest
 
 import snooze
+import snooze.constants
 
 
 class TestConfigParser(object):
@@ -36,6 +37,21 @@ class TestConfigParser(object):
         assert parsed["tdsmith/test_repo"]["github_username"] == "tdsmith"
         assert parsed["tdsmith/test_repo"]["poll_interval"] == 0
         assert parsed["tdsmith/test_repo"]["ignore_members_of"] is None
+        assert parsed["tdsmith/test_repo"]["listen_events"] == snooze.constants.LISTEN_EVENTS
+
+    def test_parse_config_listen_events(self, tmpdir):
+        config = tmpdir.join("config.txt")
+        config.write(dedent("""\
+            [tdsmith/test_repo]
+            github_username: tdsmith
+            github_token: deadbeefcafe
+            aws_key: key
+            aws_secret: secret
+            snooze_label: snooze
+            listen_events: issue_comment, pull_request
+            """))
+        parsed = snooze.parse_config(str(config))
+        assert parsed["tdsmith/test_repo"]["listen_events"] == ["issue_comment", "pull_request"]
 
     def test_parse_config_raises(self, tmpdir):
         try:
@@ -46,3 +62,14 @@ class TestConfigParser(object):
         config.write("[tdsmith/test_repo]\ngithub_username: tdsmith\n")
         with pytest.raises(configparser.NoOptionError):
             snooze.parse_config(str(config))
+
+
+class TestSharedExecutor(object):
+    def test_shared_executor(self):
+        few = {"tdsmith/repo{}".format(i): {} for i in range(2)}
+        many = {"tdsmith/repo{}".format(i): {}
+                for i in range(snooze.constants.SHARED_EXECUTOR_THRESHOLD + 1)}
+        assert snooze.shared_executor(few) is None
+        assert snooze.shared_executor(few, workers=3).workers == 3
+        assert snooze.shared_executor(few, asyncio=True, concurrency=16).workers == 16
+        assert snooze.shared_executor(many).workers == snooze.constants.SHARED_CALLBACK_WORKERS
@@ -0,0 +1,154 @@
+import threading
+import time
+
+try:
+    from urllib.request import Request, urlopen
+except ImportError:
+    from urllib2 import Request, urlopen
+
+import responses
+from testfixtures import LogCapture
+
+import github_responses
+import snooze.metrics
+from snooze.snooze import make_callback
+from snooze.webhook_server import WebhookReceiver, WebhookServer, sign, verify_signature
+
+
+def delivery(payload=github_responses.SNOOZED_ISSUE_COMMENT, secret="hunter2"):
+    body = payload.encode("utf-8")
+    return body, sign(secret, body)
+
+
+class TestWebhookReceiver(object):
+    def receiver(self, queue_size=10):
+        received = []
+        receiver = WebhookReceiver(workers=2, queue_size=queue_size)
+        receiver.add_repository("BaxterTheHacker/public-repo", "hunter2",
+                                lambda event, message: received.append((event, message)))
+        return receiver, received
+
+    def test_verify_signature(self):
+        body, signature = delivery()
+        assert verify_signature("hunter2", body, signature)
+        assert not verify_signature("hunter3", body, signature)
+        assert not verify_signature("hunter2", body, None)
+
+    def test_signed_delivery_is_handled(self):
+        receiver, received = self.receiver()
+        body, signature = delivery()
+        assert receiver.receive("issue_comment", "d1", body, signature) == 202
+        receiver.dispatch(receiver.queue.get_nowait()).result()
+        assert [event for event, _ in received] == ["issue_comment"]
+        assert snooze.metrics.webhook_requests.get(status=202) == 1
+
+        # a redelivery is skipped
+        assert receiver.receive("issue_comment", "d1", body, signature) == 202
+        assert receiver.dispatch(receiver.queue.get_nowait()) is None
+        assert len(received) == 1
+
+    def test_unsigned_delivery_is_refused(self):
+        receiver, received = self.receiver()
+        body, signature = delivery(secret="wrong")
+        assert receiver.receive("issue_comment", "d1", body, signature) == 401
+        assert receiver.receive("issue_comment", "d1", body, None) == 401
+        assert receiver.queue.empty()
+
+    def test_delivery_signed_for_another_repository_is_dropped(self):
+        receiver, received = self.receiver()
+        receiver.add_repository("tdsmith/other", "other secret", lambda event, message: None)
+        body, signature = delivery(secret="other secret")
+        assert receiver.receive("issue_comment", "d1", body, signature) == 202
+        assert receiver.dispatch(receiver.queue.get_nowait()) is None
+        assert not received
+
+    def test_failed_event_is_retried(self):
+        handled = threading.Event()
+        attempts = []
+
+        def callback(event, message):
+            attempts.append(event)
+            if len(attempts) == 1:
+                raise ValueError("Github is down")
+            handled.set()
+
+        receiver = WebhookReceiver(workers=1, queue_size=10, retry_backoff=0.01)
+        receiver.add_repository("baxterthehacker/public-repo", "hunter2", callback)
+        body, signature = delivery()
+        assert receiver.receive("issue_comment", "d1", body, signature) == 202
+        future = receiver.dispatch(receiver.queue.get_nowait())
+        assert isinstance(future.exception(), ValueError)
+        assert handled.wait(5)
+        assert attempts == ["issue_comment", "issue_comment"]
+
+        # the delivery is recorded once the retry succeeds
+        deadline = time.time() + 5
+        while not receiver.deduplicator.seen("d1") and time.time() < deadline:
+            time.sleep(0.01)
+        assert receiver.deduplicator.seen("d1")
+
+    def test_pending_retries_count_against_queue_size(self):
+        def callback(event, message):
+            raise ValueError("Github is down")
+
+        receiver = WebhookReceiver(workers=1, queue_size=1, retry_backoff=60)
+        receiver.add_repository("baxterthehacker/public-repo", "hunter2", callback)
+        body, signature = delivery()
+        assert receiver.receive("issue_comment", "d1", body, signature) == 202
+        receiver.dispatch(receiver.queue.get_nowait())
+        receiver.executor.shutdown()
+        assert len(receiver._retries) == 1
+        assert receiver.receive("issue_comment", "d2", body, signature) == 503
+        # further retries are dropped rather than queued
+        assert not receiver._schedule_retry(receiver._retries[0][2], 2, 60)
+        assert len(receiver._retries) == 1
+
+    def test_failing_event_is_dropped_after_max_attempts(self):
+        attempts = []
+
+        def callback(event, message):
+            attempts.append(event)
+            raise ValueError("Github is down")
+
+        receiver = WebhookReceiver(workers=1, queue_size=10, max_attempts=1)
+        receiver.add_repository("baxterthehacker/public-repo", "hunter2", callback)
+        body, signature = delivery()
+        assert receiver.receive("issue_comment", "d1", body, signature) == 202
+        with LogCapture() as l:
+            receiver.dispatch(receiver.queue.get_nowait())
+            receiver.executor.shutdown()
+        assert attempts == ["issue_comment"]
+        assert "Dropping issue_comment event" in str(l)
+
+    def test_full_queue_refuses_deliveries(self):
+        receiver, received = self.receiver(queue_size=1)
+        body, signature = delivery()
+        assert receiver.receive("issue_comment", "d1", body, signature) == 202
+        assert receiver.receive("issue_comment", "d2", body, signature) == 503
+
+
+@responses.activate
+def test_server_acknowledges_and_clears_label():
+    responses.add_passthru("http://127.0.0.1")
+    url = "https://api.github.com/repos/baxterthehacker/public-repo/issues/2/labels/snooze"
+    cleared = threading.Event()
+    responses.add_callback(responses.DELETE, url, callback=lambda request: cleared.set() or (200, {}, ""))
+
+    receiver = WebhookReceiver(workers=1)
+    receiver.add_repository("baxterthehacker/public-repo", "hunter2",
+                            make_callback(("frodo", "baggins"), "snooze", None, 30))
+    server = WebhookServer(receiver, port=0, address="127.0.0.1")
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    receiver.start()
+    try:
+        body, signature = delivery()
+        request = Request("http://127.0.0.1:{}/".format(server.server_address[1]), body, {
+            "X-GitHub-Event": "issue_comment", "X-GitHub-Delivery": "d1",
+            "X-Hub-Signature-256": signature, "Content-Type": "application/json"})
+        assert urlopen(request).getcode() == 202
+        assert cleared.wait(5)
+    finally:
+        server.shutdown()
+        server.server_close()
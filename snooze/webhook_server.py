@@ -0,0 +1,376 @@
+"""Receives Github webhook deliveries over HTTP, without SNS and SQS.
+
+Each delivery's signature is verified and the delivery is acknowledged at
+once. A dispatcher thread takes deliveries from a bounded queue, decodes them
+and hands them to github_callback on a ShardedExecutor, so that events for
+the same issue are still handled in order. Events whose callbacks fail are
+retried after a delay.
+"""
+from __future__ import absolute_import
+
+import argparse
+import hashlib
+import heapq
+import hmac
+import itertools
+import logging
+import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+
+import snooze.metrics as metrics
+from snooze.callbacks import issue_url, membership_cache, repository_name, wants_event
+from snooze.config import parse_config
+from snooze.constants import (WEBHOOK_MAX_ATTEMPTS, WEBHOOK_MAX_BODY, WEBHOOK_PORT, WEBHOOK_QUEUE_SIZE,
+                              WEBHOOK_RETRY_BACKOFF, WEBHOOK_WORKERS)
+from snooze.dedup import make_deduplicator
+from snooze.executor import ShardedExecutor
+from snooze.github import RateLimitExceeded, get_client
+from snooze.payload import decode_payload
+from snooze.snooze import make_callback
+
+
+def sign(secret, body):
+    """Returns the X-Hub-Signature-256 header Github sends with a body."""
+    return "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret, body, signature):
+    """Returns whether a delivery was signed with a webhook's secret.
+
+    Args:
+        secret (str): the webhook's secret
+        body (bytes): the body of the delivery, as received
+        signature (str): the delivery's X-Hub-Signature-256 header, or None
+    """
+    if not signature:
+        return False
+    return hmac.compare_digest(sign(secret, body), str(signature))
+
+
+def payload_text(body, content_type=None):
+    """Returns the JSON payload of a delivery, which Github sends either as
+    the body or, for form-encoded hooks, as its "payload" field.
+
+    Raises: KeyError or ValueError if the body can't be decoded
+    """
+    text = body.decode("utf-8")
+    if (content_type or "").startswith("application/x-www-form-urlencoded"):
+        return parse_qs(text)["payload"][0]
+    return text
+
+
+class WebhookReceiver(object):
+    """Verifies webhook deliveries and handles them in the background."""
+
+    def __init__(self, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE,
+                 deduplicator=None, event_filter=wants_event,
+                 max_attempts=WEBHOOK_MAX_ATTEMPTS, retry_backoff=WEBHOOK_RETRY_BACKOFF):
+        """Instantiates a WebhookReceiver.
+
+        Args:
+            workers (int): the most events to handle at once
+            queue_size (int): the most deliveries to hold while they wait to
+                be decoded or retried, and again while they wait for a worker;
+                further deliveries are refused and further retries dropped
+            deduplicator (Deduplicator): skips deliveries which have already
+                been processed; defaults to an in-memory window
+            event_filter (function(str event_type, str action)): see
+                QueueListener
+            max_attempts (int): the most times to try an event's callback
+            retry_backoff (float): seconds to wait before retrying a failed
+                event, doubling with each attempt; rate limited events wait
+                for the rate limit to reset instead
+        """
+        self.queue_size = queue_size
+        self.queue = queue.Queue(queue_size)
+        self.executor = ShardedExecutor(int(workers))
+        self.deduplicator = deduplicator or make_deduplicator()
+        self.event_filter = event_filter
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._in_flight = threading.BoundedSemaphore(queue_size)
+        self._routes = {}
+        # (due time, sequence number, event, attempt), earliest first
+        self._retries = []
+        self._retry_ids = itertools.count()
+        self._retry_ready = threading.Condition()
+        self._retry_thread = None
+
+    def add_repository(self, repository_name, webhook_secret, callback):
+        """Accepts deliveries for a repository.
+
+        Args:
+            repository_name (str): name of a Github repository
+            webhook_secret (str): secret of the repository's webhook
+            callback (function(str, Object)): as for
+                RepositoryListener.register_callback
+        """
+        self._routes[repository_name.lower()] = (webhook_secret, callback)
+
+    def _backlog(self):
+        """Returns how many deliveries are waiting to be decoded or retried."""
+        return self.queue.qsize() + len(self._retries)
+
+    def _secret_for(self, body, signature):
+        for secret in set(route[0] for route in self._routes.values()):
+            if verify_signature(secret, body, signature):
+                return secret
+        return None
+
+    def receive(self, event_type, delivery, body, signature, content_type=None):
+        """Verifies a delivery and queues it to be handled.
+
+        The payload isn't decoded until it is dispatched, so the delivery can
+        be acknowledged at once.
+
+        Args:
+            event_type (str): X-GitHub-Event header
+            delivery (str): X-GitHub-Delivery header
+            body (bytes): body of the delivery
+            signature (str): X-Hub-Signature-256 header
+            content_type (str): Content-Type header
+
+        Returns: HTTP status (int); 202 if the delivery was queued
+        """
+        secret = self._secret_for(body, signature)
+        if secret is None:
+            status = 401
+        elif not event_type:
+            status = 400
+        elif event_type == "ping":
+            status = 200
+        elif self._backlog() >= self.queue_size:
+            logging.warning("Refusing {} delivery {}: queue is full".format(event_type, delivery))
+            status = 503
+        else:
+            try:
+                self.queue.put_nowait((event_type, delivery, body, content_type, secret))
+                status = 202
+            except queue.Full:
+                logging.warning("Refusing {} delivery {}: queue is full".format(event_type, delivery))
+                status = 503
+        metrics.webhook_requests.inc(status=status)
+        return status
+
+    def dispatch(self, item):
+        """Decodes a queued delivery and submits it to its repository's
+        callback, waiting if queue_size events are already waiting for a
+        worker.
+
+        Returns: concurrent.futures.Future, or None if the delivery was skipped
+        """
+        event_type, delivery, body, content_type, secret = item
+        try:
+            message = decode_payload(event_type, payload_text(body, content_type),
+                                     self.event_filter)
+        except (KeyError, ValueError) as e:
+            logging.error("Dropping malformed {} delivery {}: {}".format(event_type, delivery, e))
+            return None
+        if message is None:
+            logging.debug("Ignoring {} event".format(event_type))
+            return None
+        name = repository_name(message)
+        route = self._routes.get(name.lower())
+        # a delivery is only trusted for the repository whose secret signed it
+        if route is None or route[0] != secret:
+            logging.warning("Dropping {} event for unconfigured repository {}".format(
+                event_type, name))
+            return None
+        if self.deduplicator.seen(delivery):
+            metrics.duplicate_deliveries.inc(repository=name)
+            return None
+        return self._submit((name, route[1], event_type, delivery, message), 1)
+
+    def _submit(self, event, attempt):
+        name, callback, event_type, delivery, message = event
+        self._in_flight.acquire()
+        future = self.executor.submit(issue_url(message), callback, event_type, message)
+        future.add_done_callback(lambda f: self._done(f, event, attempt))
+        return future
+
+    def _retry_delay(self, error, attempt):
+        """Returns how many seconds to wait before retrying a failed event."""
+        if isinstance(error, RateLimitExceeded):
+            return error.retry_after
+        return self.retry_backoff * 2 ** (attempt - 1)
+
+    def _done(self, future, event, attempt):
+        name, _, event_type, delivery, _ = event
+        self._in_flight.release()
+        error = future.exception()
+        if error is None:
+            self.deduplicator.record(delivery)
+            return
+        description = "{} event for {} (attempt {} of {}): {}: {}".format(
+            event_type, name, attempt, self.max_attempts, error.__class__.__name__, error)
+        if attempt >= self.max_attempts:
+            logging.error("Dropping {}".format(description))
+            return
+        delay = self._retry_delay(error, attempt)
+        if self._schedule_retry(event, attempt + 1, delay):
+            logging.warning("Retrying in {:.0f}s: {}".format(delay, description))
+        else:
+            logging.error("Dropping {}: queue is full".format(description))
+
+    def _schedule_retry(self, event, attempt, delay):
+        """Queues an event to be submitted again after delay seconds.
+
+        Returns: False if the queue is full, so the event was dropped
+        """
+        with self._retry_ready:
+            if self._backlog() >= self.queue_size:
+                return False
+            heapq.heappush(self._retries, (time.time() + delay, next(self._retry_ids), event, attempt))
+            if self._retry_thread is None:
+                self._retry_thread = threading.Thread(target=self._retry_forever)
+                self._retry_thread.daemon = True
+                self._retry_thread.start()
+            self._retry_ready.notify()
+        return True
+
+    def _retry_forever(self):
+        while True:
+            with self._retry_ready:
+                while not self._retries or self._retries[0][0] > time.time():
+                    self._retry_ready.wait(self._retries[0][0] - time.time() if self._retries else None)
+                _, _, event, attempt = heapq.heappop(self._retries)
+            self._submit(event, attempt)
+
+    def _dispatch_forever(self):
+        while True:
+            self.dispatch(self.queue.get())
+
+    def start(self):
+        """Starts dispatching queued deliveries from a daemon thread."""
+        thread = threading.Thread(target=self._dispatch_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            self.send_error(400)
+            return
+        if length > WEBHOOK_MAX_BODY:
+            self.send_error(413)
+            return
+        status = self.server.receiver.receive(
+            self.headers.get("X-GitHub-Event"),
+            self.headers.get("X-GitHub-Delivery"),
+            self.rfile.read(length),
+            self.headers.get("X-Hub-Signature-256"),
+            self.headers.get("Content-Type"))
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logging.debug("{} - {}".format(self.address_string(), format % args))
+
+
+class WebhookServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, receiver, port=WEBHOOK_PORT, address=""):
+        """Instantiates a WebhookServer, which passes deliveries POSTed to
+        any path to receiver.
+
+        Args:
+            receiver (WebhookReceiver): receiver to pass deliveries to
+            port (int): port to listen on
+            address (str): address to listen on; all addresses by default
+        """
+        HTTPServer.__init__(self, (address, port), WebhookHandler)
+        self.receiver = receiver
+
+
+def build_receiver(config, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE):
+    """Creates a WebhookReceiver for every configured repository.
+
+    Args:
+        config (dict): configuration dictionary from parse_config
+        workers (int): see WebhookReceiver
+        queue_size (int): see WebhookReceiver
+
+    Returns: WebhookReceiver
+
+    Raises: ValueError if a repository has no webhook_secret
+    """
+    dedup_stores = [repo["dedup_store"] for repo in config.values() if repo["dedup_store"]]
+    receiver = WebhookReceiver(
+        workers, queue_size, make_deduplicator(dedup_stores[0] if dedup_stores else None))
+    prewarmed = set()
+    for name, repo in config.items():
+        if not repo["webhook_secret"]:
+            raise ValueError("{} has no webhook_secret".format(name))
+        github = get_client((repo["github_username"], repo["github_token"]))
+        organization = repo["ignore_members_of"]
+        if organization and repo["prewarm_membership"] and organization not in prewarmed:
+            membership_cache.prewarm(github, organization)
+            prewarmed.add(organization)
+        receiver.add_repository(name, repo["webhook_secret"], make_callback(
+            github, repo["snooze_label"], repo["ignore_members_of"],
+            float(repo["coalesce_window"])))
+    return receiver
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config")
+    parser.add_argument(
+        "--address", default="",
+        help="address to listen on (default: all addresses)")
+    parser.add_argument(
+        "--port", type=int, default=WEBHOOK_PORT,
+        help="port to receive webhooks on (default: %(default)s)")
+    parser.add_argument(
+        "--workers", type=int, default=WEBHOOK_WORKERS,
+        help="the most events to handle at once (default: %(default)s)")
+    parser.add_argument(
+        "--queue-size", type=int, default=WEBHOOK_QUEUE_SIZE,
+        help="the most deliveries to hold before refusing more (default: %(default)s)")
+    parser.add_argument(
+        "--metrics-port", type=int,
+        help="serve Prometheus metrics at http://ADDRESS:PORT/metrics")
+    parser.add_argument(
+        "--metrics-address", default=metrics.DEFAULT_ADDRESS,
+        help="address to serve metrics on; \"\" for all addresses (default: %(default)s)")
+    args = parser.parse_args()
+
+    config = parse_config(args.config, aws=False)
+    try:
+        receiver = build_receiver(config, args.workers, args.queue_size)
+    except ValueError as e:
+        logging.error("snooze_webhook requires a webhook_secret for every repository: {}".format(e))
+        return False
+    if args.metrics_port:
+        metrics.start_http_server(args.metrics_port, args.metrics_address)
+    server = WebhookServer(receiver, args.port, args.address)
+    receiver.start()
+    logging.info("Receiving webhooks for {} repositories on port {}".format(
+        len(config), server.server_address[1]))
+    server.serve_forever()
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(not main())